@@ -4,3 +4,15 @@ from django.apps import AppConfig
 class BreathingConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'breathing'
+
+    def ready(self):
+        from django.db.backends.signals import connection_created
+        from django.db.models.signals import post_delete, post_save
+        from . import catalog, reminders, sqlite
+        from .models import BreathingExercise, UserPreference
+
+        post_save.connect(catalog.bump_version_on_commit, sender=BreathingExercise, dispatch_uid='catalog-save')
+        post_delete.connect(catalog.bump_version_on_commit, sender=BreathingExercise, dispatch_uid='catalog-delete')
+        connection_created.connect(sqlite.configure_connection, dispatch_uid='sqlite-profile')
+        post_save.connect(reminders.preference_saved, sender=UserPreference, dispatch_uid='reminders-save')
+        post_delete.connect(reminders.preference_deleted, sender=UserPreference, dispatch_uid='reminders-delete')
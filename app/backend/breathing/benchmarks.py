@@ -0,0 +1,120 @@
+"""Latency and query-count benchmarks for the API endpoints.
+
+`run` requests every endpoint in ENDPOINTS through the test client as one
+user (authentication is bypassed with force_authenticate) and records the
+p50/p95 latency and the most queries any request made. `compare` checks
+the results against a stored baseline (benchmark_baseline.json next to
+this file): a query count above the baseline is always a regression, and
+a p95 latency more than `latency_tolerance` above it is one when a
+tolerance is given. Latency baselines only mean something on the machine
+that recorded them.
+
+    python manage.py benchmark_api                    # compare against the baseline
+    python manage.py benchmark_api --update-baseline  # record a new one
+"""
+import json
+import os
+import statistics
+import time
+from collections import namedtuple
+from contextlib import ExitStack
+from urllib.parse import urlencode
+
+from django.core.cache import cache
+from django.db import connections
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), 'benchmark_baseline.json')
+
+ENDPOINTS = [
+    ('exercise-list', {}),
+    ('exercise-search', {'q': 'breathing calm'}),
+    ('session-list', {}),
+    ('preference-list', {}),
+    ('preference-my-preferences', {}),
+    ('practice-list', {}),
+    ('practice-today', {}),
+    ('metrics-list', {}),
+    ('metrics-progress-summary', {}),
+    ('metrics-chart-data', {'period': 'month'}),
+    ('metrics-chart-data', {'period': 'raw'}),
+    ('metrics-weekly-stats', {}),
+    ('metrics-monthly-stats', {}),
+    ('metrics-quarterly-stats', {}),
+    ('metrics-yearly-stats', {}),
+    ('metrics-dashboard', {}),
+]
+
+Result = namedtuple('Result', ['endpoint', 'status', 'p50_ms', 'p95_ms', 'queries'])
+
+
+def endpoint_label(name, params):
+    return f'{name}?{urlencode(params)}' if params else name
+
+
+def run(user, repeat=20, warmup=2):
+    """Benchmark every endpoint as `user`; returns one Result per endpoint"""
+    client = APIClient()
+    client.force_authenticate(user)
+    cache.clear()
+    results = []
+    for name, params in ENDPOINTS:
+        url = reverse(name)
+        for _ in range(warmup):
+            client.get(url, params)
+
+        timings, queries, status = [], 0, None
+        for _ in range(repeat):
+            with ExitStack() as stack:
+                # Count on every database, so reads routed to a replica are included
+                captured = [stack.enter_context(CaptureQueriesContext(connections[alias])) for alias in connections]
+                started = time.perf_counter()
+                response = client.get(url, params)
+                timings.append(time.perf_counter() - started)
+            queries = max(queries, sum(len(context) for context in captured))
+            status = response.status_code
+
+        timings.sort()
+        results.append(Result(
+            endpoint=endpoint_label(name, params),
+            status=status,
+            p50_ms=1000 * statistics.median(timings),
+            p95_ms=1000 * timings[int(0.95 * (len(timings) - 1))],
+            queries=queries,
+        ))
+    return results
+
+
+def load_baseline(path=BASELINE_PATH):
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_baseline(results, path=BASELINE_PATH):
+    baseline = {
+        result.endpoint: {'p50_ms': round(result.p50_ms, 2), 'p95_ms': round(result.p95_ms, 2),
+                          'queries': result.queries}
+        for result in results
+    }
+    with open(path, 'w') as f:
+        json.dump(baseline, f, indent=2)
+        f.write('\n')
+
+
+def compare(results, baseline, latency_tolerance=None):
+    """Regressions of `results` against `baseline`, as messages"""
+    regressions = []
+    for result in results:
+        if result.status != 200:
+            regressions.append(f'{result.endpoint}: status {result.status}')
+        expected = baseline.get(result.endpoint)
+        if expected is None:
+            continue  # a new endpoint: nothing to compare with until the baseline is updated
+        if result.queries > expected['queries']:
+            regressions.append(f"{result.endpoint}: {result.queries} queries, baseline {expected['queries']}")
+        if latency_tolerance is not None and result.p95_ms > expected['p95_ms'] * (1 + latency_tolerance):
+            regressions.append(f"{result.endpoint}: p95 {result.p95_ms:.1f} ms, "
+                               f"baseline {expected['p95_ms']:.1f} ms (+{latency_tolerance:.0%} allowed)")
+    return regressions
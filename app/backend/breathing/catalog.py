@@ -0,0 +1,71 @@
+"""Versioned, cached payloads for the read-mostly exercise catalog.
+
+Every committed write to BreathingExercise bumps a catalog version kept in
+the cache. The serialized list and detail payloads are cached per version,
+and the version doubles as the strong ETag and Last-Modified of every
+catalog response, so a client revalidating an unchanged catalog gets a 304
+without a database query. Payloads are cached per format (JSON or
+MessagePack), each with its own ETag.
+
+The version lives in Django's cache, so with more than one server process
+CACHES must point at a shared backend (see REDIS_URL in settings).
+"""
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.http import http_date, parse_http_date_safe
+
+VERSION_KEY = 'catalog:version'
+PAYLOAD_TIMEOUT = 24 * 3600
+
+
+def get_version():
+    """Current catalog version: nanoseconds since the epoch at the last write"""
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        # Nothing cached (fresh cache or eviction): start a version no client can hold yet
+        cache.add(VERSION_KEY, time.time_ns(), timeout=None)
+        version = cache.get(VERSION_KEY)
+    return version
+
+
+def bump_version():
+    previous = cache.get(VERSION_KEY) or 0
+    cache.set(VERSION_KEY, max(time.time_ns(), previous + 1), timeout=None)
+
+
+def bump_version_on_commit(**kwargs):
+    """Signal receiver: invalidate once the write is visible to readers, not before"""
+    transaction.on_commit(bump_version)
+
+
+def etag(version, variant=None):
+    """Strong ETag of one catalog response: the list, or a `variant` such as a detail pk or search"""
+    return f'"catalog-{version}"' if variant is None else f'"catalog-{version}-{variant}"'
+
+
+def last_modified(version):
+    return http_date(version // 1_000_000_000)
+
+
+def is_not_modified(request, version, variant=None):
+    """True if the client's conditional headers already match this catalog version"""
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if if_none_match is not None:
+        tags = [tag.strip() for tag in if_none_match.split(',')]
+        # Weak comparison: a compressed response carries the same tag marked weak
+        current = etag(version, variant)
+        return current in tags or 'W/' + current in tags
+    if_modified_since = parse_http_date_safe(request.META.get('HTTP_IF_MODIFIED_SINCE', ''))
+    return if_modified_since is not None and version // 1_000_000_000 <= if_modified_since
+
+
+def get_payload(version, key, build):
+    """Serialized payload for `key` at `version`, built with build() on a miss"""
+    cache_key = f'catalog:{version}:{key}'
+    payload = cache.get(cache_key)
+    if payload is None:
+        payload = build()
+        cache.set(cache_key, payload, timeout=PAYLOAD_TIMEOUT)
+    return payload
@@ -0,0 +1,62 @@
+"""Primary/replica database routing.
+
+Writes, and reads by default, go to the primary ('default'). Code that
+can tolerate replication lag opts in with `read_from_replica()`, which
+routes the rest of the current request's reads to a random replica from
+settings.DATABASE_REPLICAS. A user whose own write succeeded in the last
+REPLICA_STICKY_SECONDS is pinned to the primary so they always read what
+they just wrote; the pin lives in the cache so every server process sees it.
+"""
+import random
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import cache
+
+PRIMARY = 'default'
+
+_replica_reads = ContextVar('replica_reads', default=False)
+
+
+def replicas():
+    return getattr(settings, 'DATABASE_REPLICAS', [])
+
+
+def read_from_replica(enabled=True):
+    """Route reads in the current context to a replica; returns a token for _replica_reads.reset()"""
+    return _replica_reads.set(enabled and bool(replicas()))
+
+
+def reset_reads(token):
+    _replica_reads.reset(token)
+
+
+def _pin_key(user_id):
+    return f'db:primary-pin:{user_id}'
+
+
+def pin_to_primary(user_id):
+    cache.set(_pin_key(user_id), True, timeout=getattr(settings, 'REPLICA_STICKY_SECONDS', 5))
+
+
+def is_pinned(user_id):
+    return user_id is not None and cache.get(_pin_key(user_id), False)
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        if _replica_reads.get():
+            return random.choice(replicas())
+        return PRIMARY
+
+    def db_for_write(self, model, **hints):
+        return PRIMARY
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {PRIMARY, *replicas()}
+        return obj1._state.db in databases and obj2._state.db in databases
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas get their schema from the primary in production; in
+        # tests they are separate databases that need the same tables
+        return True
@@ -0,0 +1,49 @@
+"""Largest-Triangle-Three-Buckets downsampling for chart series.
+
+LTTB keeps the first and last points and, from each of `threshold - 2`
+equal-count buckets in between, the point that forms the largest triangle
+with the point kept from the previous bucket and the average of the next
+bucket. Peaks and dips survive, so the chart keeps its shape at a fraction
+of the points.
+
+Several series sharing one x axis are downsampled together: each
+candidate's triangle area is summed over the series after scaling each to
+its own range, so all datasets keep the same labels.
+"""
+import numpy as np
+
+
+def lttb_indices(x, ys, threshold):
+    """Indices of the points to keep from `x` (1-D) and `ys` (one row per series)"""
+    x = np.asarray(x, dtype=np.float64)
+    ys = np.atleast_2d(np.asarray(ys, dtype=np.float64))
+    n = len(x)
+    if threshold >= n or n <= 2:
+        return np.arange(n)
+    if threshold < 3:
+        raise ValueError("threshold must be at least 3")
+
+    # Scale every series to [0, 1] so one with large values cannot drown out the others
+    spans = np.ptp(ys, axis=1, keepdims=True)
+    ys = (ys - ys.min(axis=1, keepdims=True)) / np.where(spans == 0, 1, spans)
+
+    # Bucket edges over the interior points 1 .. n-2, plus the last point as a bucket of its own
+    edges = np.floor(np.linspace(1, n - 1, threshold - 1)).astype(np.intp)
+    starts = np.append(edges[:-1], n - 1)
+    ends = np.append(edges[1:], n)
+    counts = ends - starts
+    average_x = np.add.reduceat(x, starts) / counts
+    average_ys = np.add.reduceat(ys, starts, axis=1) / counts
+
+    kept = np.empty(threshold, dtype=np.intp)
+    kept[0], kept[-1] = 0, n - 1
+    a = 0
+    for bucket in range(threshold - 2):
+        start, end = starts[bucket], ends[bucket]
+        next_x, next_ys = average_x[bucket + 1], average_ys[:, bucket + 1:bucket + 2]
+        # Twice the triangle area between the last kept point, each candidate and the next bucket's average
+        areas = np.abs((x[a] - next_x) * (ys[:, start:end] - ys[:, a:a + 1])
+                       - (x[a] - x[start:end]) * (next_ys - ys[:, a:a + 1])).sum(axis=0)
+        a = start + int(np.argmax(areas))
+        kept[bucket + 1] = a
+    return kept
@@ -0,0 +1,208 @@
+"""Prometheus-style metrics for the API, exposed at /metrics.
+
+A small in-process registry of counters, gauges and histograms rendered in
+the Prometheus text exposition format. MetricsMiddleware records per route
+(the URL name, which for DRF viewsets is `<basename>-<action>`, e.g.
+`metrics-chart-data`):
+
+- request count by status, latency and response size
+- requests in flight
+- SQL queries per request and the time spent in them, through a database
+  execute wrapper on every connection for the duration of the request
+
+FirebaseAuthenticationMiddleware adds the time spent verifying ID tokens.
+
+Values live in the process that recorded them, so with several server
+workers each one has to be scraped on its own.
+"""
+import threading
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+from django.http import HttpResponse, HttpResponseForbidden
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.25, 0.5, 0.75, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+REGISTRY = []
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values):
+    if not names:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    type = None
+
+    def __init__(self, name, documentation, label_names=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._values = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _key(self, labels):
+        if len(labels) != len(self.label_names):
+            raise ValueError(f"{self.name} takes labels {self.label_names}, got {labels}")
+        return tuple(str(value) for value in labels)
+
+    def samples(self):
+        """(suffix, label names, label values, value) for every series"""
+        with self._lock:
+            return [('', self.label_names, key, value) for key, value in sorted(self._values.items())]
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.type}']
+        for suffix, names, values, value in self.samples():
+            lines.append(f'{self.name}{suffix}{_format_labels(names, values)} {_format_value(value)}')
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, *labels, amount=1):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    type = 'gauge'
+
+    def inc(self, *labels, amount=1):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, *labels, amount=1):
+        self.inc(*labels, amount=-amount)
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, documentation, label_names=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, label_names)
+        self.buckets = tuple(buckets) + (float('inf'),)
+
+    def observe(self, value, *labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # Per-bucket (not cumulative) counts, then the sum
+                state = self._values[key] = [[0] * len(self.buckets), 0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+                    break
+            state[1] += value
+
+    def samples(self):
+        samples = []
+        with self._lock:
+            for key, (counts, total) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets, counts):
+                    cumulative += count
+                    samples.append(('_bucket', self.label_names + ('le',), key + (_format_value(bound),), cumulative))
+                samples.append(('_sum', self.label_names, key, total))
+                samples.append(('_count', self.label_names, key, cumulative))
+        return samples
+
+
+def render_metrics():
+    return '\n'.join(metric.render() for metric in REGISTRY) + '\n'
+
+
+REQUESTS = Counter('http_requests_total', 'HTTP requests by route, method and status',
+                   ['route', 'method', 'status'])
+REQUEST_LATENCY = Histogram('http_request_duration_seconds', 'Time to produce the response',
+                            ['route', 'method'])
+REQUESTS_IN_FLIGHT = Gauge('http_requests_in_flight', 'Requests being handled right now')
+RESPONSE_SIZE = Histogram('http_response_size_bytes', 'Response body size as sent, after compression',
+                          ['route'], buckets=SIZE_BUCKETS)
+REQUEST_QUERIES = Histogram('http_request_db_queries', 'SQL queries made while handling one request',
+                            ['route'], buckets=QUERY_COUNT_BUCKETS)
+REQUEST_DB_TIME = Histogram('http_request_db_duration_seconds', 'Time spent in SQL queries for one request',
+                            ['route'])
+FIREBASE_VERIFICATION = Histogram('firebase_token_verification_seconds', 'Time to verify a Firebase ID token',
+                                  ['outcome'])
+
+
+def route_name(request):
+    """The URL name a request resolved to: bounded label values, unlike raw paths"""
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unmatched'
+    return match.url_name or match.view_name or 'unnamed'
+
+
+class QueryRecorder:
+    """Execute wrapper that counts and times the queries of one request"""
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.seconds += time.perf_counter() - started
+
+
+class MetricsMiddleware:
+    """Record latency, size and SQL usage of every request; goes first in MIDDLEWARE"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        queries = QueryRecorder()
+        REQUESTS_IN_FLIGHT.inc()
+        started = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(queries))
+                response = self.get_response(request)
+        finally:
+            REQUESTS_IN_FLIGHT.dec()
+        elapsed = time.perf_counter() - started
+
+        route = route_name(request)
+        REQUESTS.inc(route, request.method, response.status_code)
+        REQUEST_LATENCY.observe(elapsed, route, request.method)
+        if not response.streaming:
+            RESPONSE_SIZE.observe(len(response.content), route)
+        REQUEST_QUERIES.observe(queries.count, route)
+        REQUEST_DB_TIME.observe(queries.seconds, route)
+        return response
+
+
+def metrics_view(request):
+    """Prometheus scrape endpoint, limited to METRICS_ALLOWED_IPS ('*' allows any client)"""
+    allowed = getattr(settings, 'METRICS_ALLOWED_IPS', ['127.0.0.1', '::1'])
+    if '*' not in allowed and request.META.get('REMOTE_ADDR') not in allowed:
+        return HttpResponseForbidden()
+    return HttpResponse(render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,160 @@
+"""Per-user daily practice ledger.
+
+Each PracticeDay row holds the minutes and completed sessions of one user on
+one day, the daily goal at the time and the practice streak ending that day.
+Saving or deleting a UserSession refreshes its day in the same transaction
+by re-aggregating just that day's sessions, so reading today's status or a
+calendar never touches the session history.
+
+Days are calendar days in the user's UserPreference.timezone (UTC without
+preferences), both here and in `rebuild`, so changing the time zone
+rebuilds the user's ledger.
+
+A day counts towards the streak when at least one session was completed
+on it. A day's streak is the previous day's streak plus one, so changing
+whether a day was practiced only has to renumber the run of consecutive
+days after it.
+
+Refreshes of one user's days are serialized by locking the user row.
+
+Rows changed behind the ORM's back (bulk update/delete of sessions) can be
+recomputed with `python manage.py rebuild_practice_ledger`.
+"""
+from datetime import datetime, time, timedelta
+from zoneinfo import ZoneInfo
+
+from django.db import transaction
+from django.db.models import Count, Q, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import PracticeDay, User, UserPreference, UserSession
+
+DEFAULT_GOAL_MINUTES = 10
+
+
+def user_settings(user_id):
+    """The user's daily goal in minutes and the time zone their days are counted in"""
+    preference = UserPreference.objects.filter(user_id=user_id).values_list('practice_goal_minutes', 'timezone').first()
+    if preference is None:
+        return DEFAULT_GOAL_MINUTES, ZoneInfo('UTC')
+    return preference[0], ZoneInfo(preference[1])
+
+
+def user_timezone(user_id):
+    return user_settings(user_id)[1]
+
+
+def session_day(start_time, tz):
+    """The calendar day in `tz` a session counts towards"""
+    return timezone.localdate(start_time, tz)
+
+
+def day_bounds(day, tz):
+    start = timezone.make_aware(datetime.combine(day, time.min), tz)
+    return start, timezone.make_aware(datetime.combine(day + timedelta(days=1), time.min), tz)
+
+
+def refresh_session(session):
+    """Refresh the day `session` counts towards in its user's time zone"""
+    return refresh_day(session.user_id, session_day(session.start_time, user_timezone(session.user_id)))
+
+
+def _streak_before(user_id, day):
+    previous = PracticeDay.objects.filter(user_id=user_id, date=day - timedelta(days=1)).values_list('streak', flat=True).first()
+    return previous or 0
+
+
+def refresh_day(user_id, day):
+    """Re-aggregate one user's sessions on `day` into the ledger and renumber the streak run after it"""
+    with transaction.atomic():
+        # The day's row may not exist yet, so lock the user instead: concurrent first
+        # sessions of a day then create the row one after the other
+        list(User.objects.select_for_update().filter(pk=user_id).values_list('pk', flat=True))
+        goal, tz = user_settings(user_id)
+        start, end = day_bounds(day, tz)
+        totals = UserSession.objects.filter(
+            user_id=user_id, start_time__gte=start, start_time__lt=end, completed=True
+        ).aggregate(minutes=Sum('duration_minutes'), sessions=Count('id'))
+        row = PracticeDay.objects.select_for_update().filter(user_id=user_id, date=day).first()
+        if row is None and not totals['sessions']:
+            return None
+        if row is None:
+            row = PracticeDay(user_id=user_id, date=day)
+        was_practiced = row.pk is not None and row.practiced
+
+        row.minutes = totals['minutes'] or 0
+        row.sessions_completed = totals['sessions']
+        row.goal_minutes = goal
+        old_streak = row.streak
+        row.streak = _streak_before(user_id, day) + 1 if row.practiced else 0
+        row.save()
+
+        if row.practiced != was_practiced or row.streak != old_streak:
+            _renumber_following(user_id, day, row.streak)
+    return row
+
+
+def _renumber_following(user_id, day, streak):
+    """Carry `streak` forward through the consecutive days after `day`"""
+    following = PracticeDay.objects.select_for_update().filter(user_id=user_id, date__gt=day).order_by('date')
+    expected = day + timedelta(days=1)
+    for row in following.iterator():
+        if row.date != expected:
+            break  # a gap: the run ended and later streaks do not depend on this day
+        streak = streak + 1 if row.practiced else 0
+        if row.streak == streak:
+            break  # everything after this is already numbered from here
+        row.streak = streak
+        row.save(update_fields=['streak'])
+        expected += timedelta(days=1)
+
+
+def today_status(user_id, today=None):
+    """Today's minutes, goal progress and current streak, from at most two ledger rows"""
+    goal, tz = user_settings(user_id)
+    today = today or timezone.localdate(timezone=tz)
+    yesterday = today - timedelta(days=1)
+    rows = {row.date: row for row in PracticeDay.objects.filter(user_id=user_id, date__in=[today, yesterday])}
+
+    row = rows.get(today)
+    minutes = row.minutes if row else 0
+    if row and row.practiced:
+        streak = row.streak
+    else:
+        # Yesterday's streak is still alive until today ends
+        streak = rows[yesterday].streak if yesterday in rows else 0
+    return {
+        'date': today,
+        'minutes': minutes,
+        'sessions_completed': row.sessions_completed if row else 0,
+        'goal_minutes': goal,
+        'goal_progress': min(1.0, minutes / goal) if goal else 1.0,
+        'goal_met': minutes >= goal,
+        'current_streak': streak,
+    }
+
+
+def rebuild(user_id):
+    """Recompute a user's whole ledger from their sessions; returns the number of days written"""
+    goal, tz = user_settings(user_id)
+    days = (UserSession.objects.filter(user_id=user_id)
+            .annotate(day=TruncDate('start_time', tzinfo=tz))
+            .values('day')
+            .annotate(minutes=Sum('duration_minutes', filter=Q(completed=True)),
+                      sessions=Count('id', filter=Q(completed=True)))
+            .filter(sessions__gt=0)
+            .order_by('day'))
+
+    rows = []
+    previous_day, streak = None, 0
+    for day in days:
+        streak = streak + 1 if previous_day == day['day'] - timedelta(days=1) else 1
+        rows.append(PracticeDay(user_id=user_id, date=day['day'], minutes=day['minutes'] or 0,
+                                sessions_completed=day['sessions'], goal_minutes=goal, streak=streak))
+        previous_day = day['day']
+
+    with transaction.atomic():
+        PracticeDay.objects.filter(user_id=user_id).delete()
+        PracticeDay.objects.bulk_create(rows)
+    return len(rows)
@@ -0,0 +1,62 @@
+"""Benchmark every API endpoint against synthetic data in a throwaway test database.
+
+    python manage.py benchmark_api --users 20 --years 3 --repeat 30
+    python manage.py benchmark_api --update-baseline
+
+Exits with an error when an endpoint makes more queries than the baseline
+or, with --latency-tolerance, when its p95 latency regressed (see
+breathing/benchmarks.py).
+"""
+from django.core.management.base import BaseCommand, CommandError
+from django.test.runner import DiscoverRunner
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from breathing import benchmarks, synthetic
+from breathing.models import User
+
+
+class Command(BaseCommand):
+    help = "Measure p50/p95 latency and query counts of the API endpoints and compare them with a baseline"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=5)
+        parser.add_argument('--exercises', type=int, default=50)
+        parser.add_argument('--sessions', type=int, default=300, help="Sessions per user")
+        parser.add_argument('--years', type=int, default=2, help="Years of daily metrics per user")
+        parser.add_argument('--metrics-per-day', type=int, default=2)
+        parser.add_argument('--repeat', type=int, default=20, help="Measured requests per endpoint")
+        parser.add_argument('--baseline', default=benchmarks.BASELINE_PATH)
+        parser.add_argument('--update-baseline', action='store_true', help="Record these results as the baseline")
+        parser.add_argument('--latency-tolerance', type=float, default=None,
+                            help="Also fail when p95 exceeds the baseline by more than this fraction (e.g. 0.5)")
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        runner = DiscoverRunner(verbosity=0, interactive=False)
+        old_config = runner.setup_databases()
+        try:
+            counts = synthetic.generate(
+                users=options['users'], exercises=options['exercises'], sessions_per_user=options['sessions'],
+                years=options['years'], metrics_per_day=options['metrics_per_day'],
+            )
+            self.stdout.write('Data: ' + ', '.join(f'{count} {name}' for name, count in counts.items()))
+            user = User.objects.filter(username__startswith='synthetic-').order_by('pk').first()
+            results = benchmarks.run(user, repeat=options['repeat'])
+        finally:
+            runner.teardown_databases(old_config)
+            teardown_test_environment()
+
+        self.stdout.write(f"{'endpoint':<45}{'status':>7}{'p50 ms':>9}{'p95 ms':>9}{'queries':>9}")
+        for result in results:
+            self.stdout.write(f'{result.endpoint:<45}{result.status:>7}{result.p50_ms:>9.2f}'
+                              f'{result.p95_ms:>9.2f}{result.queries:>9}')
+
+        if options['update_baseline']:
+            benchmarks.save_baseline(results, options['baseline'])
+            self.stdout.write(f"Baseline written to {options['baseline']}")
+            return
+        regressions = benchmarks.compare(results, benchmarks.load_baseline(options['baseline']),
+                                         options['latency_tolerance'])
+        if regressions:
+            raise CommandError('Regressions:\n  ' + '\n  '.join(regressions))
+        self.stdout.write('No regressions')
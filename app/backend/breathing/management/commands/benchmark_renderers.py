@@ -0,0 +1,129 @@
+"""Serialization time and response size for each API format.
+
+Renders payloads shaped like real responses (a metrics list and a
+dashboard) with DRF's stdlib JSONRenderer, the orjson renderer and the
+MessagePack renderer, parses them back with the matching parser, and
+compresses each body the way CompressionMiddleware would.
+
+    python manage.py benchmark_renderers --rows 1000 --repeat 20
+"""
+import io
+import random
+import time
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+
+from django.core.management.base import BaseCommand
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+
+from breathing.middleware import CompressionMiddleware, brotli
+from breathing.renderers import MessagePackParser, MessagePackRenderer, ORJSONParser, ORJSONRenderer
+
+FORMATS = [
+    ('json (stdlib)', JSONRenderer(), JSONParser()),
+    ('json (orjson)', ORJSONRenderer(), ORJSONParser()),
+    ('msgpack', MessagePackRenderer(), MessagePackParser()),
+]
+
+
+def metrics_list(rows):
+    """Rows as BreathingMetricsSerializer returns them"""
+    rng = random.Random(1)
+    start = datetime(2024, 1, 1, 7, 30, tzinfo=dt_timezone.utc)
+    result = []
+    for i in range(rows):
+        created = start + timedelta(hours=13 * i, seconds=rng.randint(0, 3600))
+        result.append({
+            'id': i + 1,
+            'bolt_score_change': rng.randint(-5, 5),
+            'mbt_steps_change': rng.randint(-10, 10),
+            'weekly_bolt_average': 24.571428571428573,
+            'weekly_mbt_average': 71.14285714285714,
+            'monthly_progress': {
+                'bolt_score_change': 3, 'mbt_steps_change': 12, 'measurements_count': 41,
+                'start_date': date(2024, 1, 1), 'end_date': date(2024, 1, 30),
+            },
+            'date': created.date().isoformat(),
+            'time': created.time().isoformat(),
+            'bolt_score': rng.randint(10, 60),
+            'mbt_steps': rng.randint(30, 120),
+            'notes': rng.choice(['', 'Morning, before coffee', 'After a run']),
+            'stress_level': rng.randint(1, 10),
+            'hours_slept': round(rng.uniform(5, 9), 1),
+            'created_at': created.isoformat().replace('+00:00', 'Z'),
+            'updated_at': created.isoformat().replace('+00:00', 'Z'),
+            'user': 1,
+        })
+    return result
+
+
+def dashboard(rows):
+    """A dashboard response (see breathing/progress.py) with `rows` rows per period"""
+    rng = random.Random(2)
+
+    def stats(label):
+        return [dict(label(i), bolt_score_avg=rng.uniform(10, 60), mbt_steps_avg=rng.uniform(30, 120),
+                     measurements_count=rng.randint(1, 60)) for i in range(rows)]
+
+    monthly = stats(lambda i: {'month': f'{2000 + i // 12}-{i % 12 + 1:02d}'})
+    return {
+        'latest_bolt_score': 31, 'latest_mbt_steps': 80,
+        'weekly_bolt_average': 29.5, 'weekly_mbt_average': 77.25,
+        'monthly_progress': {'bolt_score_change': 3, 'mbt_steps_change': 12, 'measurements_count': 41,
+                             'start_date': date(2024, 1, 1), 'end_date': date(2024, 1, 30)},
+        'weekly_stats': stats(lambda i: {'week_start': date(2000, 1, 3) + timedelta(weeks=i),
+                                         'week_end': date(2000, 1, 9) + timedelta(weeks=i)}),
+        'monthly_stats': monthly,
+        'quarterly_stats': stats(lambda i: {'quarter': f'{2000 + i // 4}-Q{i % 4 + 1}'}),
+        'yearly_stats': stats(lambda i: {'year': str(2000 + i), 'improvement': {'bolt_score': 2, 'mbt_steps': 5}}),
+        'chart': {'labels': [row['month'] for row in monthly],
+                  'datasets': [{'label': 'BOLT Score Average', 'data': [row['bolt_score_avg'] for row in monthly]},
+                               {'label': 'MBT Steps Average', 'data': [row['mbt_steps_avg'] for row in monthly]}]},
+    }
+
+
+def best_time(function, repeat):
+    """Fastest of `repeat` runs, in milliseconds"""
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - started)
+    return min(timings) * 1000
+
+
+class Command(BaseCommand):
+    help = 'Compare render/parse time and compressed size of the JSON and MessagePack API formats'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1000, help='Rows in the metrics list')
+        parser.add_argument('--repeat', type=int, default=20, help='Runs per measurement; the fastest counts')
+
+    def handle(self, *args, **options):
+        repeat = options['repeat']
+        compression = CompressionMiddleware(lambda request: None)
+        encodings = compression.encodings()
+        if brotli is None:
+            self.stdout.write('brotli is not installed: only gzip is measured')
+
+        payloads = [
+            (f"metrics list ({options['rows']} rows)", metrics_list(options['rows'])),
+            ('dashboard (52 rows per period)', dashboard(52)),
+        ]
+        for name, data in payloads:
+            self.stdout.write(f'\n{name}')
+            header = f"{'format':<15}{'render ms':>11}{'parse ms':>10}{'bytes':>10}"
+            for encoding in encodings:
+                header += f"{encoding + ' bytes':>12}{encoding + ' ms':>9}"
+            self.stdout.write(header)
+
+            for label, renderer, parser in FORMATS:
+                body = renderer.render(data)
+                render_ms = best_time(lambda: renderer.render(data), repeat)
+                parse_ms = best_time(lambda: parser.parse(io.BytesIO(body)), repeat)
+                line = f'{label:<15}{render_ms:>11.2f}{parse_ms:>10.2f}{len(body):>10}'
+                for encoding in encodings:
+                    compressed = compression.compress(body, encoding)
+                    compress_ms = best_time(lambda: compression.compress(body, encoding), repeat)
+                    line += f'{len(compressed):>12}{compress_ms:>9.2f}'
+                self.stdout.write(line)
@@ -0,0 +1,139 @@
+"""Concurrent write throughput on SQLite with and without the production profile.
+
+Each mode runs in a fresh subprocess against a fresh database file:
+
+- rollback: SQLite defaults (SQLITE_PROFILE=off)
+- wal: the production pragmas (WAL, synchronous=NORMAL, busy_timeout, ...)
+- wal+queue: the pragmas plus the write-coalescing queue
+
+Writer threads create metrics through the same serializer path as
+POST /api/metrics/, while reader threads keep listing them.
+
+    python manage.py benchmark_sqlite_writes --threads 16 --writes 200 --readers 2
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, connection
+
+MODES = {
+    'rollback': {'SQLITE_PROFILE': 'off', 'SQLITE_WRITE_QUEUE': 'false'},
+    'wal': {'SQLITE_PROFILE': 'production', 'SQLITE_WRITE_QUEUE': 'false'},
+    'wal+queue': {'SQLITE_PROFILE': 'production', 'SQLITE_WRITE_QUEUE': 'true'},
+}
+
+
+def run_workload(threads, writes, readers):
+    from breathing import write_queue
+    from breathing.models import BreathingMetrics, User
+    from breathing.serializers import BreathingMetricsSerializer
+
+    call_command('migrate', verbosity=0)
+    user = User.objects.create_user(username='benchmark', firebase_uid='benchmark')
+    start = threading.Barrier(threads + readers + 1)
+    writers_done = threading.Event()
+    latencies = []
+    errors = []
+    reads = [0]
+
+    def write():
+        start.wait()
+        try:
+            for i in range(writes):
+                serializer = BreathingMetricsSerializer(data={'bolt_score': 20 + i % 40, 'mbt_steps': 50})
+                serializer.is_valid(raise_exception=True)
+                started = time.perf_counter()
+                try:
+                    write_queue.save(serializer, user=user)
+                except OperationalError as e:
+                    errors.append(str(e))
+                latencies.append(time.perf_counter() - started)
+        finally:
+            connection.close()
+
+    def read():
+        start.wait()
+        try:
+            while not writers_done.is_set():
+                try:
+                    list(BreathingMetrics.objects.filter(user=user).values_list('bolt_score', flat=True)[:500])
+                    reads[0] += 1
+                except OperationalError as e:
+                    errors.append(str(e))
+        finally:
+            connection.close()
+
+    writer_threads = [threading.Thread(target=write) for _ in range(threads)]
+    reader_threads = [threading.Thread(target=read) for _ in range(readers)]
+    for thread in writer_threads + reader_threads:
+        thread.start()
+    start.wait()
+    started = time.perf_counter()
+    for thread in writer_threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    writers_done.set()
+    for thread in reader_threads:
+        thread.join()
+
+    latencies.sort()
+    committed = BreathingMetrics.objects.count()
+    result = {
+        'writes': committed,
+        'errors': len(errors),
+        'error_sample': errors[0] if errors else None,
+        'writes_per_second': committed / elapsed,
+        'reads_per_second': reads[0] / elapsed,
+        'latency_p50_ms': 1000 * statistics.median(latencies),
+        'latency_p95_ms': 1000 * latencies[int(0.95 * (len(latencies) - 1))],
+        'latency_max_ms': 1000 * latencies[-1],
+    }
+    if settings.SQLITE_WRITE_QUEUE:
+        queue = write_queue.get_queue()
+        result['mean_batch_size'] = queue.writes / queue.batches
+    return result
+
+
+class Command(BaseCommand):
+    help = "Benchmark concurrent metric writes on SQLite with and without the production profile"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=16, help="Concurrent writer threads")
+        parser.add_argument('--writes', type=int, default=100, help="Writes per thread")
+        parser.add_argument('--readers', type=int, default=2, help="Concurrent reader threads")
+        parser.add_argument('--modes', nargs='+', choices=list(MODES), default=list(MODES))
+        parser.add_argument('--worker', action='store_true', help=argparse.SUPPRESS)
+
+    def handle(self, *args, **options):
+        if options['worker']:
+            result = run_workload(options['threads'], options['writes'], options['readers'])
+            self.stdout.write(json.dumps(result))
+            return
+
+        results = {}
+        for mode in options['modes']:
+            with tempfile.TemporaryDirectory() as directory:
+                env = dict(os.environ, DATABASE_URL='sqlite:///' + os.path.join(directory, 'benchmark.sqlite3'),
+                           DJANGO_SETTINGS_MODULE='breathmanu.settings', **MODES[mode])
+                env.pop('DATABASE_REPLICA_URLS', None)
+                output = subprocess.run(
+                    [sys.executable, os.path.join(settings.BASE_DIR, 'manage.py'), 'benchmark_sqlite_writes', '--worker',
+                     '--threads', str(options['threads']), '--writes', str(options['writes']),
+                     '--readers', str(options['readers'])],
+                    env=env, check=True, capture_output=True, text=True
+                ).stdout
+            results[mode] = json.loads(output.strip().splitlines()[-1])
+            self.stdout.write(f"{mode:>10}: {results[mode]['writes_per_second']:8.1f} writes/s, "
+                              f"p95 {results[mode]['latency_p95_ms']:7.1f} ms, "
+                              f"{results[mode]['reads_per_second']:7.1f} reads/s, {results[mode]['errors']} errors")
+        self.stdout.write(json.dumps(results, indent=2))
@@ -0,0 +1,39 @@
+"""Fill the database with synthetic users, exercises, sessions and metrics.
+
+    python manage.py generate_synthetic_data --users 100 --years 3 --metrics-per-day 2
+
+Users are named `<prefix>-<n>`; pick another --prefix to add a second set.
+"""
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from breathing import synthetic
+from breathing.models import User
+
+
+class Command(BaseCommand):
+    help = "Generate synthetic users, exercises, sessions and years of metrics with bulk_create"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10)
+        parser.add_argument('--exercises', type=int, default=30)
+        parser.add_argument('--sessions', type=int, default=300, help="Sessions per user")
+        parser.add_argument('--years', type=int, default=2, help="Years of daily metrics per user")
+        parser.add_argument('--metrics-per-day', type=int, default=1)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--prefix', default='synthetic', help="Username prefix")
+        parser.add_argument('--batch-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        if User.objects.filter(username__startswith=f"{options['prefix']}-").exists():
+            raise CommandError(f"Users named {options['prefix']}-* already exist; choose another --prefix")
+
+        started = time.perf_counter()
+        counts = synthetic.generate(
+            users=options['users'], exercises=options['exercises'], sessions_per_user=options['sessions'],
+            years=options['years'], metrics_per_day=options['metrics_per_day'], seed=options['seed'],
+            prefix=options['prefix'], batch_size=options['batch_size'],
+        )
+        summary = ', '.join(f'{count} {name}' for name, count in counts.items())
+        self.stdout.write(f"Created {summary} in {time.perf_counter() - started:.1f} s")
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from breathing import ledger
+from breathing.models import User
+
+
+class Command(BaseCommand):
+    help = "Recompute the daily practice ledger and streaks from users' sessions"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, action='append', dest='users', help="Only this user id (repeatable)")
+
+    def handle(self, *args, **options):
+        users = User.objects.order_by('id')
+        if options['users']:
+            users = users.filter(id__in=options['users'])
+        total_users = total_days = 0
+        for user_id in users.values_list('id', flat=True).iterator():
+            total_days += ledger.rebuild(user_id)
+            total_users += 1
+        self.stdout.write(f"Rebuilt {total_days} practice days for {total_users} users")
@@ -0,0 +1,23 @@
+import logging
+
+from django.core.management.base import BaseCommand
+
+from breathing import reminders
+
+
+class Command(BaseCommand):
+    help = "Send daily practice reminders as they fall due (runs until stopped)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--sync-interval', type=int, default=60,
+                            help="Seconds between checks for preferences changed by other processes")
+
+    def handle(self, *args, **options):
+        logging.basicConfig(level=logging.INFO)
+        scheduler = reminders.ReminderScheduler(batch_size=options['batch_size'])
+        reminders.active_scheduler = scheduler
+        try:
+            scheduler.run_forever(sync_interval=options['sync_interval'])
+        except KeyboardInterrupt:
+            self.stdout.write(str(scheduler.metrics()))
@@ -1,9 +1,20 @@
+import gzip
+import time
+
 import firebase_admin
 from firebase_admin import auth, credentials
 from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.utils.cache import patch_vary_headers
 from django.utils.functional import empty
 from rest_framework.exceptions import AuthenticationFailed
+from . import db_router
+from .instrumentation import FIREBASE_VERIFICATION
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
 
 User = get_user_model()
 
@@ -20,7 +31,13 @@ class FirebaseAuthenticationMiddleware:
             token = auth_header.split(' ')[1]
             try:
                 # Verify the Firebase token
-                decoded_token = auth.verify_id_token(token)
+                started = time.perf_counter()
+                try:
+                    decoded_token = auth.verify_id_token(token)
+                except Exception:
+                    FIREBASE_VERIFICATION.observe(time.perf_counter() - started, 'failure')
+                    raise
+                FIREBASE_VERIFICATION.observe(time.perf_counter() - started, 'success')
                 firebase_uid = decoded_token['uid']
                 
                 # Get or create user in Django
@@ -42,4 +59,99 @@ class FirebaseAuthenticationMiddleware:
                 raise AuthenticationFailed(str(e))
         
         response = self.get_response(request)
-        return response 
\ No newline at end of file
+        return response
+
+
+class ReadYourWritesMiddleware:
+    """Pin a user's reads to the primary database for a short while after each of their writes"""
+    UNSAFE_METHODS = ('POST', 'PUT', 'PATCH', 'DELETE')
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        # DRF copies the user it authenticated onto the underlying request
+        user = getattr(request, 'user', None)
+        if request.method in self.UNSAFE_METHODS and response.status_code < 400 and user and user.is_authenticated:
+            db_router.pin_to_primary(user.pk)
+        return response
+
+
+def accepted_encodings(header):
+    """Content codings from an Accept-Encoding header, with their q-values"""
+    weights = {}
+    for part in header.split(','):
+        coding, _, params = part.partition(';')
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        weight = 1.0
+        params = params.strip().replace(' ', '')
+        if params.startswith('q='):
+            try:
+                weight = float(params[2:])
+            except ValueError:
+                weight = 0.0
+        weights[coding] = weight
+    return weights
+
+
+class CompressionMiddleware:
+    """Brotli or gzip for compressible responses of at least COMPRESSION_MIN_SIZE bytes.
+
+    The coding is negotiated from Accept-Encoding; Brotli is preferred on a
+    tie and only offered when the `brotli` package is installed. Like
+    Django's GZipMiddleware, a compressed response's ETag is made weak.
+    """
+    COMPRESSIBLE_TYPES = ('application/json', 'application/msgpack', 'application/javascript', 'image/svg+xml')
+    gzip_level = 6
+    brotli_quality = 5  # beyond 5 Brotli gets much slower for little gain on API payloads
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def encodings(self):
+        return ('br', 'gzip') if brotli is not None else ('gzip',)
+
+    def choose_encoding(self, header):
+        weights = accepted_encodings(header)
+        best, best_weight = None, 0.0
+        for coding in self.encodings():
+            weight = weights.get(coding, weights.get('*', 0.0))
+            if weight > best_weight:
+                best, best_weight = coding, weight
+        return best
+
+    def compressible(self, response):
+        content_type = response.get('Content-Type', '').split(';')[0].strip().lower()
+        return content_type.startswith('text/') or content_type in self.COMPRESSIBLE_TYPES
+
+    def compress(self, content, encoding):
+        if encoding == 'br':
+            return brotli.compress(content, quality=self.brotli_quality)
+        return gzip.compress(content, compresslevel=self.gzip_level, mtime=0)
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if response.streaming or response.has_header('Content-Encoding') or not self.compressible(response):
+            return response
+        if len(response.content) < getattr(settings, 'COMPRESSION_MIN_SIZE', 1024):
+            return response
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+        encoding = self.choose_encoding(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        if encoding is None:
+            return response
+        compressed = self.compress(response.content, encoding)
+        if len(compressed) >= len(response.content):
+            return response
+
+        response.content = compressed
+        response['Content-Length'] = str(len(compressed))
+        response['Content-Encoding'] = encoding
+        # The compressed bytes differ from the identity ones, so the tag can no longer be strong
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response['ETag'] = 'W/' + etag
+        return response
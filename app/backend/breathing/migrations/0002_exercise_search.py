@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-19 17:42
+
+from django.db import migrations, models
+
+from breathing.search import install_search_index, uninstall_search_index
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('breathing', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='breathingexercise',
+            index=models.Index(fields=['difficulty', 'duration_minutes'], name='breathing_b_difficu_4ba82a_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='breathingexercise',
+            index=models.Index(fields=['duration_minutes'], name='breathing_b_duratio_c29778_idx'),
+        ),
+        migrations.RunPython(install_search_index, uninstall_search_index),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-19 17:48
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('breathing', '0002_exercise_search'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PracticeDay',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('minutes', models.IntegerField(default=0)),
+                ('sessions_completed', models.IntegerField(default=0)),
+                ('goal_minutes', models.IntegerField(help_text='Daily goal in effect when the day was last updated')),
+                ('streak', models.IntegerField(default=0, help_text='Consecutive practice days ending on this day')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='practice_days', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['date'],
+                'constraints': [models.UniqueConstraint(fields=('user', 'date'), name='unique_practice_day')],
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-19 17:51
+
+import breathing.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('breathing', '0003_practice_ledger'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userpreference',
+            name='timezone',
+            field=models.CharField(default='UTC', help_text='IANA time zone that daily_reminder is in', max_length=64, validators=[breathing.models.validate_timezone]),
+        ),
+        migrations.AddIndex(
+            model_name='userpreference',
+            index=models.Index(fields=['updated_at'], name='breathing_u_updated_c43f86_idx'),
+        ),
+    ]
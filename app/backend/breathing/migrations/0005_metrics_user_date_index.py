@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-19 18:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('breathing', '0004_reminder_timezone'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='breathingmetrics',
+            index=models.Index(fields=['user', 'date', 'time'], name='breathing_b_user_id_44b9de_idx'),
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 5.2.18 on 2026-10-19 18:11
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('breathing', '0005_metrics_user_date_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SessionTelemetry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('pattern', models.JSONField(help_text="Prescribed phase durations in seconds, keyed as in the render app's patterns")),
+                ('sample_rate_hz', models.FloatField(blank=True, help_text='Sensor signal sample rate', null=True)),
+                ('signal_resolution', models.FloatField(default=0.001, help_text='Signal values are stored as multiples of this')),
+                ('data', models.BinaryField(null=True)),
+                ('phase_count', models.IntegerField(default=0)),
+                ('signal_count', models.IntegerField(default=0)),
+                ('stored_bytes', models.IntegerField(default=0)),
+                ('summary', models.JSONField(blank=True, help_text='Features computed when the upload completed', null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('completed_at', models.DateTimeField(blank=True, null=True)),
+                ('session', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='telemetry', to='breathing.usersession')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='TelemetryChunk',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('index', models.IntegerField()),
+                ('data', models.BinaryField()),
+                ('telemetry', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='chunks', to='breathing.sessiontelemetry')),
+            ],
+            options={
+                'ordering': ['index'],
+                'constraints': [models.UniqueConstraint(fields=('telemetry', 'index'), name='unique_telemetry_chunk')],
+            },
+        ),
+    ]
@@ -1,10 +1,15 @@
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth.models import User, AbstractUser
+from django.core.exceptions import ValidationError
 from django.core.validators import MinValueValidator, MaxValueValidator
 from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
 from django.utils import timezone
-from django.db.models import Avg, Max, Min
+from django.db.models import Avg, Max, Min, OuterRef, Subquery
 from collections import defaultdict
+import numpy as np
+
+from .downsample import lttb_indices
 
 class User(AbstractUser):
     firebase_uid = models.CharField(max_length=128, unique=True)
@@ -47,6 +52,13 @@ class BreathingExercise(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        # Full-text search over the text fields is set up in breathing/search.py
+        indexes = [
+            models.Index(fields=['difficulty', 'duration_minutes']),
+            models.Index(fields=['duration_minutes']),
+        ]
+
     def __str__(self):
         return self.name
 
@@ -75,24 +87,118 @@ class UserSession(models.Model):
         return f"{self.user.username} - {self.exercise.name} - {self.start_time}"
 
     def save(self, *args, **kwargs):
+        from . import ledger
         if self.end_time and self.start_time:
             duration = self.end_time - self.start_time
             self.duration_minutes = duration.seconds // 60
-        super().save(*args, **kwargs)
+        # The session and its day in the practice ledger change together
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            ledger.refresh_session(self)
+
+    def delete(self, *args, **kwargs):
+        from . import ledger
+        with transaction.atomic():
+            result = super().delete(*args, **kwargs)
+            ledger.refresh_session(self)
+        return result
+
+class SessionTelemetry(models.Model):
+    """Breath-phase events and sensor signal of one session, stored by breathing/telemetry.py"""
+    DEFAULT_SIGNAL_RESOLUTION = 0.001
+
+    session = models.OneToOneField(UserSession, on_delete=models.CASCADE, related_name='telemetry')
+    pattern = models.JSONField(help_text="Prescribed phase durations in seconds, keyed as in the render app's patterns")
+    sample_rate_hz = models.FloatField(null=True, blank=True, help_text="Sensor signal sample rate")
+    signal_resolution = models.FloatField(default=DEFAULT_SIGNAL_RESOLUTION,
+                                          help_text="Signal values are stored as multiples of this")
+    # Delta-encoded, compressed phase times, phase codes and signal; null until the upload is complete
+    data = models.BinaryField(null=True)
+    phase_count = models.IntegerField(default=0)
+    signal_count = models.IntegerField(default=0)
+    stored_bytes = models.IntegerField(default=0)
+    summary = models.JSONField(null=True, blank=True, help_text="Features computed when the upload completed")
+    created_at = models.DateTimeField(auto_now_add=True)
+    completed_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"Telemetry of session {self.session_id}"
+
+class TelemetryChunk(models.Model):
+    """One uploaded chunk of a session's telemetry, kept until the upload is completed"""
+    telemetry = models.ForeignKey(SessionTelemetry, on_delete=models.CASCADE, related_name='chunks')
+    index = models.IntegerField()
+    data = models.BinaryField()
+
+    class Meta:
+        ordering = ['index']
+        constraints = [
+            models.UniqueConstraint(fields=['telemetry', 'index'], name='unique_telemetry_chunk'),
+        ]
+
+def validate_timezone(value):
+    try:
+        ZoneInfo(value)
+    except (ZoneInfoNotFoundError, ValueError):
+        raise ValidationError(f"Unknown time zone: {value}")
 
 class UserPreference(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
     favorite_exercises = models.ManyToManyField(BreathingExercise, blank=True)
     daily_reminder = models.TimeField(null=True, blank=True)
+    timezone = models.CharField(max_length=64, default='UTC', validators=[validate_timezone],
+                                help_text="IANA time zone that daily_reminder is in")
     notification_enabled = models.BooleanField(default=True)
     theme = models.CharField(max_length=20, default='light')
     practice_goal_minutes = models.IntegerField(default=10, help_text="Daily practice goal in minutes")
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        # The reminder scheduler follows changes by updated_at (see reminders.py)
+        indexes = [models.Index(fields=['updated_at'])]
+
     def __str__(self):
         return f"{self.user.username}'s preferences"
 
+class PracticeDay(models.Model):
+    """One user's completed practice on one day, maintained from UserSession by breathing/ledger.py"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='practice_days')
+    date = models.DateField()
+    minutes = models.IntegerField(default=0)
+    sessions_completed = models.IntegerField(default=0)
+    goal_minutes = models.IntegerField(help_text="Daily goal in effect when the day was last updated")
+    streak = models.IntegerField(default=0, help_text="Consecutive practice days ending on this day")
+
+    class Meta:
+        ordering = ['date']
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'date'], name='unique_practice_day'),
+        ]
+
+    def __str__(self):
+        return f"{self.user.username} - {self.date}: {self.minutes} min"
+
+    @property
+    def practiced(self):
+        return self.sessions_completed > 0
+
+    @property
+    def goal_met(self):
+        return self.minutes >= self.goal_minutes
+
+class BreathingMetricsQuerySet(models.QuerySet):
+    def with_previous_scores(self):
+        """Annotate each row with the user's previous BOLT score and MBT steps in the same query"""
+        previous = BreathingMetrics.objects.filter(
+            user=OuterRef('user'),
+            date__lt=OuterRef('date')
+        ).order_by('-date', '-time')
+        return self.annotate(
+            previous_bolt_score=Subquery(previous.values('bolt_score')[:1]),
+            previous_mbt_steps=Subquery(previous.values('mbt_steps')[:1])
+        )
+
 class BreathingMetrics(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='breathing_metrics')
     date = models.DateField(auto_now_add=True)
@@ -132,36 +238,44 @@ class BreathingMetrics(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = BreathingMetricsQuerySet.as_manager()
+
     class Meta:
         ordering = ['-date', '-time']
+        # Serves the per-user date ranges and with_previous_scores(), which would otherwise sort every row
+        indexes = [models.Index(fields=['user', 'date', 'time'])]
         verbose_name = "Breathing Metrics"
         verbose_name_plural = "Breathing Metrics"
 
     def __str__(self):
         return f"{self.user.username}'s metrics - {self.date}"
 
-    @property
-    def bolt_score_change(self):
-        """Calculate change from previous BOLT score"""
+    def _previous_value(self, metric_type):
+        """Previous value of a metric, from with_previous_scores() if the row was loaded that way"""
+        annotation = f'previous_{metric_type}'
+        if annotation in self.__dict__:
+            return self.__dict__[annotation]
+
         previous_metric = BreathingMetrics.objects.filter(
-            user=self.user,
+            user_id=self.user_id,
             date__lt=self.date
         ).order_by('-date', '-time').first()
-        
-        if previous_metric:
-            return self.bolt_score - previous_metric.bolt_score
+        return getattr(previous_metric, metric_type) if previous_metric else None
+
+    @property
+    def bolt_score_change(self):
+        """Calculate change from previous BOLT score"""
+        previous = self._previous_value('bolt_score')
+        if previous is not None:
+            return self.bolt_score - previous
         return None
 
     @property
     def mbt_steps_change(self):
         """Calculate change from previous MBT steps"""
-        previous_metric = BreathingMetrics.objects.filter(
-            user=self.user,
-            date__lt=self.date
-        ).order_by('-date', '-time').first()
-        
-        if previous_metric:
-            return self.mbt_steps - previous_metric.mbt_steps
+        previous = self._previous_value('mbt_steps')
+        if previous is not None:
+            return self.mbt_steps - previous
         return None
 
     @classmethod
@@ -186,7 +300,7 @@ class BreathingMetrics(models.Model):
         metrics = cls.objects.filter(
             user=user,
             date__gte=thirty_days_ago
-        ).order_by('date')
+        ).order_by('date', 'time')
         
         if not metrics:
             return None
@@ -357,11 +471,49 @@ class BreathingMetrics(models.Model):
         return result
 
     @classmethod
-    def get_chart_data(cls, user, period='month'):
+    def get_raw_chart_data(cls, user, max_points=500):
+        """Every measurement, LTTB-downsampled to at most `max_points` when there are more"""
+        rows = cls.objects.filter(user=user).order_by('date', 'time').values_list(
+            'date', 'time', 'bolt_score', 'mbt_steps'
+        ).iterator(chunk_size=2000)
+        # Seconds since 0001-01-01, so points within a day keep their spacing
+        series = np.fromiter(
+            ((d.toordinal() * 86400 + t.hour * 3600 + t.minute * 60 + t.second, bolt, mbt)
+             for d, t, bolt, mbt in rows),
+            dtype=[('seconds', np.int64), ('bolt_score', np.float64), ('mbt_steps', np.float64)]
+        )
+        kept = lttb_indices(series['seconds'], [series['bolt_score'], series['mbt_steps']], max_points)
+        points = series[kept]
+
+        def label(seconds):
+            day, second = divmod(int(seconds), 86400)
+            return (datetime.fromordinal(day) + timedelta(seconds=second)).isoformat()
+
+        return {
+            'labels': [label(seconds) for seconds in points['seconds']],
+            'datasets': [
+                {
+                    'label': 'BOLT Score',
+                    'data': points['bolt_score'].astype(int).tolist()
+                },
+                {
+                    'label': 'MBT Steps',
+                    'data': points['mbt_steps'].astype(int).tolist()
+                }
+            ],
+            'total_points': len(series),
+            'downsampled': len(points) < len(series)
+        }
+
+    @classmethod
+    def get_chart_data(cls, user, period='month', max_points=500):
         """
         Get data formatted for charts
-        period can be: 'week', 'month', 'quarter', 'year'
+        period can be: 'week', 'month', 'quarter', 'year', or 'raw' for
+        individual measurements (downsampled to max_points)
         """
+        if period == 'raw':
+            return cls.get_raw_chart_data(user, max_points)
         if period == 'week':
             data = cls.get_weekly_stats(user, weeks=4)
             date_key = 'week_start'
@@ -374,7 +526,11 @@ class BreathingMetrics(models.Model):
         else:  # year
             data = cls.get_yearly_stats(user, years=2)
             date_key = 'year'
+        return cls.period_chart(data, date_key)
 
+    @staticmethod
+    def period_chart(data, date_key):
+        """Chart labels and datasets from the rows of one of the get_*_stats methods"""
         return {
             'labels': [str(item[date_key]) for item in data],
             'datasets': [
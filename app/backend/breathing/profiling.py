@@ -0,0 +1,203 @@
+"""On-demand cProfile of single API requests.
+
+A request is profiled when it carries either
+- `X-Profile-Token: <expires>.<signature>`, an HMAC-SHA256 with
+  PROFILING_SECRET over the expiry time and the request path. Admins issue
+  tokens at POST /api/admin/profiles/token/ and hand them to whoever can
+  reproduce the slow request, or
+- `X-Profile: 1` from a staff user.
+
+The profile is stored in REQUEST_PROFILE_DIR as a pstats file next to a
+JSON file with the request's route, status, duration and SQL usage. The
+response carries `X-Profile-Id`, and admins can list, read and download
+profiles under /api/admin/profiles/. Requests without either header only
+pay for one header lookup.
+
+Only one request is profiled at a time per process. A second profiled
+request that arrives meanwhile runs normally, with `X-Profile-Skipped`.
+"""
+import cProfile
+import hashlib
+import hmac
+import io
+import json
+import logging
+import os
+import pstats
+import secrets
+import threading
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+from django.utils import timezone
+
+from .instrumentation import QueryRecorder, route_name
+
+TOKEN_HEADER = 'HTTP_X_PROFILE_TOKEN'
+STAFF_HEADER = 'HTTP_X_PROFILE'
+MAX_TOKEN_SECONDS = 24 * 3600
+
+_active = threading.Lock()
+
+
+def _signature(expires, path):
+    return hmac.new(settings.PROFILING_SECRET.encode(), f'{expires}:{path}'.encode(), hashlib.sha256).hexdigest()
+
+
+def sign_token(path, ttl=600):
+    """Profile token for requests to `path` during the next `ttl` seconds"""
+    if not settings.PROFILING_SECRET:
+        raise ValueError("PROFILING_SECRET is not set")
+    expires = int(time.time()) + min(ttl, MAX_TOKEN_SECONDS)
+    return f'{expires}.{_signature(expires, path)}', expires
+
+
+def verify_token(token, path):
+    if not settings.PROFILING_SECRET:
+        return False
+    expires, _, signature = token.partition('.')
+    if not expires.isdigit() or int(expires) < time.time():
+        return False
+    return hmac.compare_digest(signature, _signature(int(expires), path))
+
+
+def profile_trigger(request):
+    """'token' or 'staff' if this request asked to be profiled and may be, else None"""
+    token = request.META.get(TOKEN_HEADER)
+    if token is not None and verify_token(token, request.path):
+        return 'token'
+    if request.META.get(STAFF_HEADER) == '1':
+        user = getattr(request, 'user', None)
+        if user is not None and user.is_authenticated and user.is_staff:
+            return 'staff'
+    return None
+
+
+class ProfileStore:
+    """Profiles as `<id>.prof` (pstats) and `<id>.json` (metadata), keeping the newest `max_profiles`"""
+
+    def __init__(self, directory, max_profiles=200):
+        self.directory = directory
+        self.max_profiles = max_profiles
+
+    def _path(self, profile_id, extension):
+        # Ids are generated here; anything else (e.g. path separators from a URL) is not a profile
+        if not profile_id.replace('-', '').isalnum():
+            raise KeyError(profile_id)
+        return os.path.join(self.directory, f'{profile_id}.{extension}')
+
+    def save(self, profile, metadata):
+        os.makedirs(self.directory, exist_ok=True)
+        profile_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{secrets.token_hex(4)}"
+        metadata = dict(metadata, id=profile_id)
+        profile.dump_stats(self._path(profile_id, 'prof'))
+        with open(self._path(profile_id, 'json'), 'w') as f:
+            json.dump(metadata, f)
+        self.prune()
+        return profile_id
+
+    def list(self):
+        """Metadata of every stored profile, newest first"""
+        if not os.path.isdir(self.directory):
+            return []
+        profiles = []
+        for name in sorted(os.listdir(self.directory), reverse=True):
+            if name.endswith('.json'):
+                try:
+                    with open(os.path.join(self.directory, name)) as f:
+                        profiles.append(json.load(f))
+                except (OSError, ValueError):
+                    continue  # removed or half-written meanwhile
+        return profiles
+
+    def get(self, profile_id):
+        try:
+            with open(self._path(profile_id, 'json')) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            raise KeyError(profile_id)
+
+    def profile_path(self, profile_id):
+        path = self._path(profile_id, 'prof')
+        if not os.path.exists(path):
+            raise KeyError(profile_id)
+        return path
+
+    def summary(self, profile_id, limit=40, sort='cumulative'):
+        """The top `limit` functions, as pstats prints them"""
+        output = io.StringIO()
+        stats = pstats.Stats(self.profile_path(profile_id), stream=output)
+        stats.strip_dirs().sort_stats(sort).print_stats(limit)
+        return output.getvalue()
+
+    def prune(self):
+        ids = sorted(name[:-5] for name in os.listdir(self.directory) if name.endswith('.json'))
+        for profile_id in ids[:max(0, len(ids) - self.max_profiles)]:
+            for extension in ('json', 'prof'):
+                try:
+                    os.remove(self._path(profile_id, extension))
+                except FileNotFoundError:
+                    pass
+
+
+def get_store():
+    return ProfileStore(settings.REQUEST_PROFILE_DIR, getattr(settings, 'REQUEST_PROFILE_MAX', 200))
+
+
+class ProfilingMiddleware:
+    """Run requests that ask for it (see profile_trigger) under cProfile; goes after authentication"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if TOKEN_HEADER not in request.META and STAFF_HEADER not in request.META:
+            return self.get_response(request)
+        trigger = profile_trigger(request)
+        if trigger is None:
+            return self.get_response(request)
+        if not _active.acquire(blocking=False):
+            response = self.get_response(request)
+            response['X-Profile-Skipped'] = 'another request is being profiled'
+            return response
+        try:
+            return self.profile(request, trigger)
+        finally:
+            _active.release()
+
+    def profile(self, request, trigger):
+        queries = QueryRecorder()
+        profile = cProfile.Profile()
+        started = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(queries))
+            profile.enable()
+            try:
+                response = self.get_response(request)
+            finally:
+                profile.disable()
+        elapsed = time.perf_counter() - started
+
+        user = getattr(request, 'user', None)
+        metadata = {
+            'created_at': timezone.now().isoformat(),
+            'trigger': trigger,
+            'method': request.method,
+            'path': request.path,
+            'query_string': request.META.get('QUERY_STRING', ''),
+            'route': route_name(request),
+            'status': response.status_code,
+            'duration_ms': round(1000 * elapsed, 3),
+            'db_queries': queries.count,
+            'db_ms': round(1000 * queries.seconds, 3),
+            'response_bytes': None if response.streaming else len(response.content),
+            'user_id': user.pk if user is not None and user.is_authenticated else None,
+        }
+        try:
+            response['X-Profile-Id'] = get_store().save(profile, metadata)
+        except OSError as e:
+            logging.error(f"Could not store request profile: {str(e)}")
+        return response
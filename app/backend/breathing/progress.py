@@ -0,0 +1,132 @@
+"""Single-pass progress dashboard over a user's BreathingMetrics.
+
+The dashboard used to be assembled from progress_summary, chart_data and
+the four *_stats endpoints, each running its own query and Python loop over
+the same rows. `build_dashboard` reads the rows once, ordered by date, into
+numpy columns and derives everything from them: each window is a
+`searchsorted` slice of the sorted days, and each period is a run of equal
+keys within it, summed with `np.add.reduceat`. The result has the same
+fields as the separate endpoints.
+"""
+from datetime import date, timedelta
+
+import numpy as np
+from django.utils import timezone
+
+from .models import BreathingMetrics
+
+PERIODS = {'week': 'weekly_stats', 'month': 'monthly_stats', 'quarter': 'quarterly_stats', 'year': 'yearly_stats'}
+DEFAULT_SPANS = {'weeks': 4, 'months': 12, 'quarters': 4, 'years': 2}
+# Longest spans the dashboard accepts: 100 years each, well inside what date arithmetic can reach
+MAX_SPANS = {'weeks': 5218, 'months': 1200, 'quarters': 400, 'years': 100}
+
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+
+def load_columns(user):
+    """The user's measurements as day ordinals, BOLT scores and MBT steps, oldest first"""
+    rows = BreathingMetrics.objects.filter(user=user).order_by('date', 'time').values_list(
+        'date', 'bolt_score', 'mbt_steps'
+    ).iterator(chunk_size=2000)
+    columns = np.fromiter(
+        ((day.toordinal(), bolt, mbt) for day, bolt, mbt in rows),
+        dtype=[('day', np.int64), ('bolt_score', np.int64), ('mbt_steps', np.int64)]
+    )
+    return columns['day'], columns['bolt_score'], columns['mbt_steps']
+
+
+def _window(days, start, end=None):
+    """Slice of the sorted `days` between the dates `start` and `end` (inclusive)"""
+    lo = int(np.searchsorted(days, start.toordinal(), side='left'))
+    hi = len(days) if end is None else int(np.searchsorted(days, end.toordinal(), side='right'))
+    return slice(lo, hi)
+
+
+def _period_stats(keys, bolt, mbt, labels, improvement=False):
+    """One row per run of equal `keys`, labelled by `labels(key)`"""
+    if not len(keys):
+        return []
+    starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+    ends = np.r_[starts[1:], len(keys)]
+    counts = ends - starts
+    bolt_avg = (np.add.reduceat(bolt, starts) / counts).tolist()
+    mbt_avg = (np.add.reduceat(mbt, starts) / counts).tolist()
+    bolt_change = (bolt[ends - 1] - bolt[starts]).tolist()
+    mbt_change = (mbt[ends - 1] - mbt[starts]).tolist()
+
+    result = []
+    for i, key in enumerate(keys[starts].tolist()):
+        row = labels(key)
+        row['bolt_score_avg'] = bolt_avg[i]
+        row['mbt_steps_avg'] = mbt_avg[i]
+        row['measurements_count'] = int(counts[i])
+        if improvement:
+            row['improvement'] = {
+                'bolt_score': bolt_change[i],
+                'mbt_steps': mbt_change[i]
+            } if counts[i] > 1 else None
+        result.append(row)
+    return result
+
+
+def _week_label(key):
+    week_start = date.fromordinal(key)
+    return {'week_start': week_start, 'week_end': week_start + timedelta(days=6)}
+
+
+def _month_label(key):
+    return {'month': f"{key // 12 + 1970}-{key % 12 + 1:02d}"}
+
+
+def _quarter_label(key):
+    return {'quarter': f"{key // 4 + 1970}-Q{key % 4 + 1}"}
+
+
+def _year_label(key):
+    return {'year': str(key)}
+
+
+def build_dashboard(user, period='month', weeks=4, months=12, quarters=4, years=2):
+    """progress_summary, the four *_stats results and chart_data for `period`, from one query"""
+    days, bolt, mbt = load_columns(user)
+    today = timezone.now().date()
+
+    # Month number since 1970-01 of every row, for the month, quarter and year keys
+    month_numbers = (days - EPOCH_ORDINAL).astype('datetime64[D]').astype('datetime64[M]').astype(np.int64)
+
+    def stats(start, keys, labels, improvement=False):
+        window = _window(days, start, today)
+        return _period_stats(keys[window], bolt[window], mbt[window], labels, improvement)
+
+    data = {
+        # Monday of each row's week
+        'weekly_stats': stats(today - timedelta(weeks=weeks), days - (days - 1) % 7, _week_label),
+        'monthly_stats': stats(today - timedelta(days=30 * months), month_numbers, _month_label),
+        'quarterly_stats': stats(today - timedelta(days=90 * quarters), month_numbers // 3, _quarter_label),
+        'yearly_stats': stats(today - timedelta(days=365 * years), month_numbers // 12 + 1970, _year_label,
+                              improvement=True),
+    }
+
+    last_week = _window(days, today - timedelta(days=7))
+    last_month = _window(days, today - timedelta(days=30))
+    monthly_progress = None
+    if last_month.stop > last_month.start:
+        first, last = last_month.start, last_month.stop - 1
+        monthly_progress = {
+            'bolt_score_change': int(bolt[last] - bolt[first]),
+            'mbt_steps_change': int(mbt[last] - mbt[first]),
+            'measurements_count': last - first + 1,
+            'start_date': date.fromordinal(int(days[first])),
+            'end_date': date.fromordinal(int(days[last]))
+        }
+
+    date_key = {'week': 'week_start', 'month': 'month', 'quarter': 'quarter', 'year': 'year'}[period]
+    return {
+        'latest_bolt_score': int(bolt[-1]) if len(days) else None,
+        'latest_mbt_steps': int(mbt[-1]) if len(days) else None,
+        'weekly_bolt_average': float(bolt[last_week].mean()) if last_week.stop > last_week.start else 0,
+        'weekly_mbt_average': float(mbt[last_week].mean()) if last_week.stop > last_week.start else 0,
+        'monthly_progress': monthly_progress,
+        **data,
+        'chart': BreathingMetrics.period_chart(data[PERIODS[period]], date_key),
+    }
@@ -0,0 +1,242 @@
+"""Daily reminder scheduling on a hashed timing wheel.
+
+The wheel has one slot per minute of the UTC day. A user with a
+`daily_reminder` sits in the slot of their next reminder, converted from
+their own time zone to UTC, together with the absolute minute it is due.
+Each tick walks only the slots for the minutes that have passed since the
+previous tick, so its cost is proportional to the users due, not to the
+number of users. A fired reminder is rescheduled from the user's local time
+for the next day, which moves it to the right slot across DST changes.
+
+The wheel is kept up to date incrementally:
+- In-process, `post_save` on UserPreference updates it directly.
+- The standalone scheduler (`python manage.py run_reminder_scheduler`)
+  also follows preferences changed by other processes through the indexed
+  `updated_at` column.
+
+Due reminders are re-checked against the database and handed to the
+dispatcher in batches. settings.REMINDER_DISPATCHER names the dispatcher
+class: anything with a `send(reminders)` method.
+"""
+import logging
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime, timedelta, timezone as dt_timezone
+from zoneinfo import ZoneInfo
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import UserPreference
+
+SLOTS = 24 * 60
+
+Reminder = namedtuple('Reminder', ['user_id', 'due_at'])
+
+
+def next_occurrence(local_time, tz_name, now):
+    """The next aware UTC datetime after `now` at which it is `local_time` in `tz_name`"""
+    tz = ZoneInfo(tz_name)
+    local_now = now.astimezone(tz)
+    day = local_now.date()
+    for _ in range(2):
+        candidate = datetime.combine(day, local_time, tzinfo=tz).astimezone(dt_timezone.utc)
+        if candidate > now:
+            return candidate
+        day += timedelta(days=1)
+    return candidate
+
+
+class TimingWheel:
+    """Users by minute of the UTC day, each with the absolute minute (epoch // 60) it is due"""
+
+    def __init__(self):
+        self.slots = [dict() for _ in range(SLOTS)]
+        self.slot_of = {}  # user_id -> slot, for O(1) reschedule and removal
+
+    def __len__(self):
+        return len(self.slot_of)
+
+    def schedule(self, user_id, due_minute):
+        self.unschedule(user_id)
+        slot = due_minute % SLOTS
+        self.slots[slot][user_id] = due_minute
+        self.slot_of[user_id] = slot
+
+    def unschedule(self, user_id):
+        slot = self.slot_of.pop(user_id, None)
+        if slot is not None:
+            del self.slots[slot][user_id]
+
+    def pop_due(self, from_minute, to_minute):
+        """Remove and return (user_id, due_minute) for entries due in (from_minute, to_minute]"""
+        due = []
+        # After a lag of more than a day every slot has to be looked at once
+        for minute in range(max(from_minute + 1, to_minute - SLOTS + 1), to_minute + 1):
+            slot = self.slots[minute % SLOTS]
+            ready = [(user_id, due_minute) for user_id, due_minute in slot.items() if due_minute <= to_minute]
+            for user_id, due_minute in ready:
+                del slot[user_id]
+                del self.slot_of[user_id]
+            due.extend(ready)
+        return due
+
+
+class LoggingDispatcher:
+    """Default dispatcher: logs reminders until a push channel is configured"""
+
+    def send(self, reminders):
+        logging.info(f"Sending {len(reminders)} daily reminders")
+
+
+class ReminderScheduler:
+    def __init__(self, dispatcher=None, batch_size=500):
+        if dispatcher is None:
+            dispatcher = import_string(getattr(settings, 'REMINDER_DISPATCHER',
+                                               'breathing.reminders.LoggingDispatcher'))()
+        self.dispatcher = dispatcher
+        self.batch_size = batch_size
+        self.wheel = TimingWheel()
+        self.schedule_of = {}  # user_id -> (local_time, tz_name)
+        self.last_minute = None
+        self.synced_at = None
+        self._lock = threading.Lock()
+        # Metrics
+        self.ticks = 0
+        self.dispatched = 0
+        self.batches = 0
+        self.max_batch_size = 0
+        self.last_tick_lag_seconds = 0.0
+        self.max_tick_lag_seconds = 0.0
+
+    def load(self, now=None):
+        """Fill the wheel from every preference with a reminder; the only full scan"""
+        now = now or timezone.now()
+        self.synced_at = now
+        rows = UserPreference.objects.filter(
+            notification_enabled=True, daily_reminder__isnull=False
+        ).values_list('user_id', 'daily_reminder', 'timezone').iterator(chunk_size=5000)
+        with self._lock:
+            self.last_minute = int(now.timestamp()) // 60
+            for user_id, local_time, tz_name in rows:
+                self._schedule(user_id, local_time, tz_name, now)
+        logging.info(f"Reminder wheel loaded with {len(self.wheel)} users")
+
+    def _schedule(self, user_id, local_time, tz_name, now):
+        try:
+            due = next_occurrence(local_time, tz_name, now)
+        except (KeyError, ValueError):
+            logging.warning(f"Skipping reminder for user {user_id}: bad time zone {tz_name}")
+            self.unschedule(user_id)
+            return
+        self.schedule_of[user_id] = (local_time, tz_name)
+        self.wheel.schedule(user_id, int(due.timestamp()) // 60)
+
+    def unschedule(self, user_id):
+        self.schedule_of.pop(user_id, None)
+        self.wheel.unschedule(user_id)
+
+    def remove(self, user_id):
+        with self._lock:
+            self.unschedule(user_id)
+
+    def update(self, preference, now=None):
+        """Apply one changed preference"""
+        with self._lock:
+            if preference.notification_enabled and preference.daily_reminder is not None:
+                self._schedule(preference.user_id, preference.daily_reminder, preference.timezone,
+                               now or timezone.now())
+            else:
+                self.unschedule(preference.user_id)
+
+    def sync(self, now=None):
+        """Apply preferences changed since the last sync (by any process)"""
+        now = now or timezone.now()
+        # Overlap a little so a row saved while the last sync ran is not missed
+        changed = UserPreference.objects.filter(updated_at__gte=self.synced_at - timedelta(seconds=5))
+        self.synced_at = now
+        for preference in changed.only('user_id', 'daily_reminder', 'timezone', 'notification_enabled').iterator():
+            self.update(preference, now)
+
+    def tick(self, now=None):
+        """Send every reminder due since the previous tick; returns how many were sent"""
+        now = now or timezone.now()
+        minute = int(now.timestamp()) // 60
+        with self._lock:
+            if self.last_minute is None:
+                self.last_minute = minute - 1
+            due = self.wheel.pop_due(self.last_minute, minute)
+            self.last_minute = minute
+            for user_id, _ in due:
+                local_time, tz_name = self.schedule_of[user_id]
+                self._schedule(user_id, local_time, tz_name, now)
+
+        self.ticks += 1
+        if due:
+            # Lag of the most overdue reminder behind its minute
+            self.last_tick_lag_seconds = now.timestamp() - 60 * min(due_minute for _, due_minute in due)
+            self.max_tick_lag_seconds = max(self.max_tick_lag_seconds, self.last_tick_lag_seconds)
+
+        sent = 0
+        for start in range(0, len(due), self.batch_size):
+            batch = due[start:start + self.batch_size]
+            # Skip users deleted or switched off since they were scheduled
+            enabled = set(UserPreference.objects.filter(
+                user_id__in=[user_id for user_id, _ in batch], notification_enabled=True
+            ).values_list('user_id', flat=True))
+            reminders = [Reminder(user_id, datetime.fromtimestamp(60 * due_minute, dt_timezone.utc))
+                         for user_id, due_minute in batch if user_id in enabled]
+            if not reminders:
+                continue
+            self.dispatcher.send(reminders)
+            sent += len(reminders)
+            self.batches += 1
+            self.max_batch_size = max(self.max_batch_size, len(reminders))
+        self.dispatched += sent
+        return sent
+
+    def metrics(self):
+        return {
+            'scheduled_users': len(self.wheel),
+            'ticks': self.ticks,
+            'dispatched': self.dispatched,
+            'batches': self.batches,
+            'max_batch_size': self.max_batch_size,
+            'last_tick_lag_seconds': self.last_tick_lag_seconds,
+            'max_tick_lag_seconds': self.max_tick_lag_seconds,
+        }
+
+    def run_forever(self, sync_interval=60):
+        self.load()
+        last_sync = time.monotonic()
+        while True:
+            # Wake just after each minute boundary
+            time.sleep(60 - time.time() % 60 + 0.05)
+            try:
+                self.tick()
+            except Exception as e:
+                logging.error(f"Reminder tick failed: {str(e)}")
+            # Sync after the tick: rescheduling a preference saved just before its reminder
+            # minute would otherwise move it to tomorrow before it fired
+            if time.monotonic() - last_sync >= sync_interval:
+                self.sync()
+                last_sync = time.monotonic()
+
+
+# The scheduler running in this process, if any; post_save keeps it current
+active_scheduler = None
+
+
+def preference_saved(sender, instance, **kwargs):
+    scheduler = active_scheduler
+    if scheduler is not None:
+        transaction.on_commit(lambda: scheduler.update(instance))
+
+
+def preference_deleted(sender, instance, **kwargs):
+    scheduler = active_scheduler
+    if scheduler is not None:
+        transaction.on_commit(lambda: scheduler.remove(instance.user_id))
@@ -0,0 +1,139 @@
+"""Full-text search over the exercise catalog.
+
+The index lives in the database so it stays in step with every write,
+including bulk updates:
+
+- SQLite: an external-content FTS5 table over name, description,
+  instructions and benefits, maintained by triggers.
+- Postgres: a generated, weighted `tsvector` column with a GIN index.
+
+Queries match every word, the last ones as prefixes, and are ranked by
+relevance with matches in the name weighted highest. Other backends fall
+back to unranked `icontains` filtering.
+
+On SQLite, a migration that makes Django rebuild the exercise table (most
+AlterField/RemoveField operations) drops the triggers; it must run
+`install_search_index` again afterwards.
+"""
+import re
+
+from django.db import connection
+from django.db.models import Q
+
+EXERCISE_TABLE = 'breathing_breathingexercise'
+FTS_TABLE = 'breathing_exercise_fts'
+SEARCH_FIELDS = ['name', 'description', 'instructions', 'benefits']
+# Relative weight of a match in each field, in SEARCH_FIELDS order
+FTS_WEIGHTS = [10.0, 2.0, 1.0, 1.0]
+PG_WEIGHTS = ['A', 'B', 'C', 'C']
+MAX_TERMS = 8
+
+WORD = re.compile(r'\w+', re.UNICODE)
+
+
+def _sqlite_columns(prefix):
+    return ', '.join(f'{prefix}{field}' for field in SEARCH_FIELDS)
+
+
+SQLITE_INSTALL = [
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+    f"{_sqlite_columns('')}, content='{EXERCISE_TABLE}', content_rowid='id', "
+    f"tokenize='porter unicode61 remove_diacritics 2', prefix='2 3')",
+    f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON {EXERCISE_TABLE} BEGIN "
+    f"INSERT INTO {FTS_TABLE}(rowid, {_sqlite_columns('')}) VALUES (new.id, {_sqlite_columns('new.')}); END",
+    f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON {EXERCISE_TABLE} BEGIN "
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, {_sqlite_columns('')}) "
+    f"VALUES ('delete', old.id, {_sqlite_columns('old.')}); END",
+    f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au AFTER UPDATE ON {EXERCISE_TABLE} BEGIN "
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, {_sqlite_columns('')}) "
+    f"VALUES ('delete', old.id, {_sqlite_columns('old.')}); "
+    f"INSERT INTO {FTS_TABLE}(rowid, {_sqlite_columns('')}) VALUES (new.id, {_sqlite_columns('new.')}); END",
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')",
+]
+
+SQLITE_UNINSTALL = [
+    f"DROP TRIGGER IF EXISTS {FTS_TABLE}_ai",
+    f"DROP TRIGGER IF EXISTS {FTS_TABLE}_ad",
+    f"DROP TRIGGER IF EXISTS {FTS_TABLE}_au",
+    f"DROP TABLE IF EXISTS {FTS_TABLE}",
+]
+
+PG_VECTOR = ' || '.join(
+    f"setweight(to_tsvector('english', coalesce({field}, '')), '{weight}')"
+    for field, weight in zip(SEARCH_FIELDS, PG_WEIGHTS)
+)
+
+POSTGRES_INSTALL = [
+    f"ALTER TABLE {EXERCISE_TABLE} ADD COLUMN IF NOT EXISTS search_vector tsvector "
+    f"GENERATED ALWAYS AS ({PG_VECTOR}) STORED",
+    f"CREATE INDEX IF NOT EXISTS {EXERCISE_TABLE}_search_gin ON {EXERCISE_TABLE} USING GIN (search_vector)",
+]
+
+POSTGRES_UNINSTALL = [
+    f"DROP INDEX IF EXISTS {EXERCISE_TABLE}_search_gin",
+    f"ALTER TABLE {EXERCISE_TABLE} DROP COLUMN IF EXISTS search_vector",
+]
+
+
+def install_search_index(apps, schema_editor):
+    """Migration operation: create the backend's full-text index and fill it"""
+    statements = {'sqlite': SQLITE_INSTALL, 'postgresql': POSTGRES_INSTALL}.get(schema_editor.connection.vendor, [])
+    for statement in statements:
+        schema_editor.execute(statement)
+
+
+def uninstall_search_index(apps, schema_editor):
+    statements = {'sqlite': SQLITE_UNINSTALL, 'postgresql': POSTGRES_UNINSTALL}.get(schema_editor.connection.vendor, [])
+    for statement in statements:
+        schema_editor.execute(statement)
+
+
+def search_terms(query):
+    """Words of a user query, lowercased and capped so one request cannot build a huge match expression"""
+    return [word.lower() for word in WORD.findall(query)][:MAX_TERMS]
+
+
+def fts5_query(terms):
+    # Quoting each word keeps FTS5 operators (AND, NEAR, column filters) out of user input
+    return ' '.join(f'"{term}"*' for term in terms)
+
+
+def tsquery(terms):
+    return ' & '.join(f'{term}:*' for term in terms)
+
+
+def search_exercises(queryset, query):
+    """Filter `queryset` to exercises matching every word of `query`, best matches first.
+
+    The result has a `rank` attribute where the backend supports ranking
+    (lower is better on SQLite's bm25, higher on Postgres' ts_rank).
+    """
+    terms = search_terms(query)
+    if not terms:
+        return queryset.none()
+
+    if connection.vendor == 'sqlite':
+        weights = ', '.join(str(weight) for weight in FTS_WEIGHTS)
+        return queryset.extra(
+            select={'rank': f'bm25({FTS_TABLE}, {weights})'},
+            tables=[FTS_TABLE],
+            where=[f'{FTS_TABLE}.rowid = {EXERCISE_TABLE}.id', f'{FTS_TABLE} MATCH %s'],
+            params=[fts5_query(terms)],
+            order_by=['rank', 'id'],
+        )
+
+    if connection.vendor == 'postgresql':
+        return queryset.extra(
+            select={'rank': "ts_rank(search_vector, to_tsquery('english', %s))"},
+            select_params=[tsquery(terms)],
+            where=["search_vector @@ to_tsquery('english', %s)"],
+            params=[tsquery(terms)],
+            order_by=['-rank', 'id'],
+        )
+
+    for term in terms:
+        queryset = queryset.filter(
+            Q(name__icontains=term) | Q(description__icontains=term)
+            | Q(instructions__icontains=term) | Q(benefits__icontains=term)
+        )
+    return queryset.order_by('id')
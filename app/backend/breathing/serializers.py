@@ -1,6 +1,6 @@
 from rest_framework import serializers
 from django.contrib.auth import get_user_model
-from .models import BreathingExercise, UserSession, UserPreference, BreathingMetrics
+from .models import BreathingExercise, UserSession, UserPreference, BreathingMetrics, PracticeDay, SessionTelemetry
 
 User = get_user_model()
 
@@ -23,6 +23,12 @@ class UserSessionSerializer(serializers.ModelSerializer):
         model = UserSession
         fields = '__all__'
 
+class SessionTelemetrySerializer(serializers.ModelSerializer):
+    class Meta:
+        model = SessionTelemetry
+        exclude = ['id', 'data']
+        read_only_fields = [field.name for field in SessionTelemetry._meta.fields]
+
 class UserPreferenceSerializer(serializers.ModelSerializer):
     favorite_exercises = BreathingExerciseSerializer(many=True, read_only=True)
 
@@ -31,6 +37,14 @@ class UserPreferenceSerializer(serializers.ModelSerializer):
         fields = '__all__'
         read_only_fields = ('user',)
 
+class PracticeDaySerializer(serializers.ModelSerializer):
+    practiced = serializers.BooleanField(read_only=True)
+    goal_met = serializers.BooleanField(read_only=True)
+
+    class Meta:
+        model = PracticeDay
+        fields = ['date', 'minutes', 'sessions_completed', 'goal_minutes', 'goal_met', 'practiced', 'streak']
+
 class BreathingMetricsSerializer(serializers.ModelSerializer):
     bolt_score_change = serializers.IntegerField(read_only=True)
     mbt_steps_change = serializers.IntegerField(read_only=True)
@@ -43,11 +57,23 @@ class BreathingMetricsSerializer(serializers.ModelSerializer):
         fields = '__all__'
         read_only_fields = ('user', 'date', 'time', 'created_at', 'updated_at')
 
+    def _user_summary(self, obj):
+        """Per-user aggregates, computed once per response rather than once per row"""
+        # A list serializer's children share the root's context, so this caches across rows
+        summaries = self.context.setdefault('user_summaries', {})
+        if obj.user_id not in summaries:
+            summaries[obj.user_id] = {
+                'weekly_bolt_average': BreathingMetrics.get_weekly_average(obj.user_id, 'bolt_score'),
+                'weekly_mbt_average': BreathingMetrics.get_weekly_average(obj.user_id, 'mbt_steps'),
+                'monthly_progress': BreathingMetrics.get_monthly_progress(obj.user_id),
+            }
+        return summaries[obj.user_id]
+
     def get_weekly_bolt_average(self, obj):
-        return BreathingMetrics.get_weekly_average(obj.user, 'bolt_score')
+        return self._user_summary(obj)['weekly_bolt_average']
 
     def get_weekly_mbt_average(self, obj):
-        return BreathingMetrics.get_weekly_average(obj.user, 'mbt_steps')
+        return self._user_summary(obj)['weekly_mbt_average']
 
     def get_monthly_progress(self, obj):
-        return BreathingMetrics.get_monthly_progress(obj.user) 
\ No newline at end of file
+        return self._user_summary(obj)['monthly_progress'] 
\ No newline at end of file
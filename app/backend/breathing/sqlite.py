@@ -0,0 +1,26 @@
+"""SQLite performance profile, applied to every new connection.
+
+With the `production` profile (the default; SQLITE_PROFILE=off keeps
+SQLite's own defaults) each connection runs the pragmas in
+settings.SQLITE_PRAGMAS:
+
+- journal_mode=WAL: readers no longer block the writer or each other
+- synchronous=NORMAL: fsync at checkpoints rather than every commit, which
+  is durable against application crashes and safe with WAL
+- busy_timeout: wait for the write lock instead of failing with
+  "database is locked"
+- cache_size / mmap_size: keep hot pages in memory
+"""
+from django.conf import settings
+
+
+def configure_connection(sender, connection, **kwargs):
+    """connection_created receiver"""
+    if connection.vendor != 'sqlite':
+        return
+    pragmas = getattr(settings, 'SQLITE_PRAGMAS', {})
+    if not pragmas:
+        return
+    with connection.cursor() as cursor:
+        for name, value in pragmas.items():
+            cursor.execute(f'PRAGMA {name} = {value}')
@@ -0,0 +1,153 @@
+"""Synthetic users, exercises, sessions and metrics for benchmarks.
+
+Everything is written with bulk_create in batches, so millions of rows
+take minutes rather than hours. bulk_create skips save() and signals, so
+afterwards the practice ledger is rebuilt for each user and the catalog
+version is bumped. auto_now_add is switched off while the history is
+written, so that metrics and sessions keep their back-dated timestamps.
+"""
+import random
+from contextlib import contextmanager
+from datetime import datetime, time, timedelta
+
+from django.contrib.auth.hashers import make_password
+from django.db import transaction
+from django.utils import timezone
+
+from . import catalog, ledger
+from .models import BreathingExercise, BreathingMetrics, User, UserPreference, UserSession
+
+TECHNIQUES = [
+    'Box Breathing', 'Alternate Nostril Breathing', 'Coherent Breathing', '4-7-8 Breathing',
+    'Reduced Breathing', 'Power Breathing', 'Humming Bee Breath', 'Breath Hold Walk',
+]
+WORDS = [
+    'calm', 'focus', 'recovery', 'endurance', 'sleep', 'stress', 'nasal', 'diaphragm', 'relaxation',
+    'resilience', 'exhale', 'inhale', 'rhythm', 'tolerance', 'performance', 'morning', 'evening',
+]
+TIMEZONES = ['UTC', 'Europe/Berlin', 'Europe/London', 'America/New_York', 'America/Los_Angeles', 'Asia/Tokyo']
+MOODS = [value for value, _ in UserSession.MOOD_CHOICES]
+
+
+@contextmanager
+def backdated(model, *field_names):
+    """Let bulk_create keep the given auto_now_add fields as set on the instances"""
+    fields = [model._meta.get_field(name) for name in field_names]
+    for field in fields:
+        field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field in fields:
+            field.auto_now_add = True
+
+
+def _sentence(rng, words):
+    return ' '.join(rng.choice(WORDS) for _ in range(words)).capitalize() + '.'
+
+
+def _in_batches(model, rows, batch_size):
+    """bulk_create an iterable of instances `batch_size` at a time; returns how many were written"""
+    batch, written = [], 0
+    for row in rows:
+        batch.append(row)
+        if len(batch) == batch_size:
+            model.objects.bulk_create(batch)
+            written += len(batch)
+            batch = []
+    if batch:
+        model.objects.bulk_create(batch)
+        written += len(batch)
+    return written
+
+
+def _metrics(rng, user_id, first_day, days, per_day):
+    bolt, mbt = rng.randint(12, 25), rng.randint(40, 70)
+    for offset in range(days):
+        day = first_day + timedelta(days=offset)
+        for k in range(per_day):
+            # A slow random walk with a slight upward trend, like a user who keeps practising
+            bolt = min(60, max(5, bolt + rng.choice([-2, -1, 0, 0, 1, 1, 2])))
+            mbt = min(150, max(20, mbt + rng.choice([-3, -1, 0, 1, 1, 3])))
+            measured = timezone.make_aware(datetime.combine(day, time(7 + 12 * k % 24, rng.randint(0, 59))))
+            yield BreathingMetrics(
+                user_id=user_id, date=day, time=measured.time(), created_at=measured,
+                bolt_score=bolt, mbt_steps=mbt,
+                stress_level=rng.randint(1, 10), hours_slept=round(rng.uniform(5, 9), 1),
+                notes=rng.choice(['', '', 'Morning, before coffee', 'After a run']),
+            )
+
+
+def _sessions(rng, user_id, exercises, start, span_seconds, count):
+    for _ in range(count):
+        started = start + timedelta(seconds=rng.randrange(span_seconds))
+        minutes = rng.randint(3, 30)
+        completed = rng.random() < 0.85
+        yield UserSession(
+            user_id=user_id, exercise_id=rng.choice(exercises), start_time=started,
+            end_time=started + timedelta(minutes=minutes) if completed else None,
+            duration_minutes=minutes if completed else None, completed=completed,
+            mood_before=rng.choice(MOODS), mood_after=rng.choice(MOODS) if completed else None,
+            energy_level=rng.randint(1, 10), focus_level=rng.randint(1, 10),
+        )
+
+
+def generate(users=10, exercises=30, sessions_per_user=300, years=2, metrics_per_day=1, seed=0,
+             prefix='synthetic', batch_size=2000):
+    """Write a synthetic data set and return the row counts by model name"""
+    rng = random.Random(seed)
+    today = timezone.localdate()
+    days = 365 * years
+    first_day = today - timedelta(days=days - 1)
+    counts = {}
+
+    with transaction.atomic():
+        password = make_password(None)
+        User.objects.bulk_create([
+            User(username=f'{prefix}-{i}', firebase_uid=f'{prefix}-{i}', email=f'{prefix}-{i}@example.com',
+                 password=password, experience_level=rng.choice(['beginner', 'intermediate', 'advanced']))
+            for i in range(users)
+        ], batch_size=batch_size)
+        user_ids = list(User.objects.filter(username__startswith=f'{prefix}-').values_list('pk', flat=True))
+        counts['users'] = len(user_ids)
+
+        BreathingExercise.objects.bulk_create([
+            BreathingExercise(
+                name=f'{rng.choice(TECHNIQUES)} {i + 1}', description=_sentence(rng, 12),
+                difficulty=rng.choice(['beginner', 'intermediate', 'advanced']),
+                duration_minutes=rng.choice([3, 5, 10, 15, 20, 30]),
+                instructions=_sentence(rng, 30), benefits=_sentence(rng, 10),
+            )
+            for i in range(exercises)
+        ], batch_size=batch_size)
+        exercise_ids = list(BreathingExercise.objects.order_by('-pk').values_list('pk', flat=True)[:exercises])
+        counts['exercises'] = len(exercise_ids)
+
+        UserPreference.objects.bulk_create([
+            UserPreference(user_id=user_id, timezone=rng.choice(TIMEZONES),
+                           daily_reminder=time(rng.randint(6, 21), rng.choice([0, 15, 30, 45])),
+                           practice_goal_minutes=rng.choice([5, 10, 15, 20]))
+            for user_id in user_ids
+        ], batch_size=batch_size)
+        Favorite = UserPreference.favorite_exercises.through
+        preferences = UserPreference.objects.filter(user_id__in=user_ids).values_list('pk', flat=True)
+        counts['favorites'] = _in_batches(Favorite, (
+            Favorite(userpreference_id=preference_id, breathingexercise_id=exercise_id)
+            for preference_id in preferences
+            for exercise_id in rng.sample(exercise_ids, min(3, len(exercise_ids)))
+        ), batch_size)
+
+        start = timezone.make_aware(datetime.combine(first_day, time.min))
+        with backdated(UserSession, 'start_time'), backdated(BreathingMetrics, 'date', 'time', 'created_at'):
+            counts['sessions'] = _in_batches(UserSession, (
+                session for user_id in user_ids
+                for session in _sessions(rng, user_id, exercise_ids, start, days * 86400, sessions_per_user)
+            ), batch_size)
+            counts['metrics'] = _in_batches(BreathingMetrics, (
+                metric for user_id in user_ids
+                for metric in _metrics(rng, user_id, first_day, days, metrics_per_day)
+            ), batch_size)
+
+        counts['practice_days'] = sum(ledger.rebuild(user_id) for user_id in user_ids)
+        catalog.bump_version_on_commit()
+    return counts
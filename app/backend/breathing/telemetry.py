@@ -0,0 +1,290 @@
+"""Breath telemetry of a session: phase events and an optional sensor signal.
+
+The phone uploads a session's telemetry in numbered chunks, each with
+- `phase_times_ms`: when each phase started, in milliseconds since the
+  session started, with the matching `phases` names (PHASES, where `hold`
+  means whichever hold follows, and `end` closes the last phase), and/or
+- `signal`: consecutive sensor samples at the upload's `sample_rate_hz`.
+
+Chunks are stored as they arrive (a retried chunk replaces itself) and put
+together when the upload is completed. At that point the summary features
+(cycle lengths, phase durations, adherence to the prescribed pattern and
+the signal's breathing rate) are computed once, and the samples are stored
+in SessionTelemetry.data instead of one row per sample.
+
+Every array is stored as its first value plus the differences between
+neighbours, narrowed to the smallest integer type that holds them, split
+into byte planes and deflated. Timestamps at a steady rhythm and a slowly
+changing signal have small differences whose high bytes are all zero: half
+an hour of a noisy 25 Hz signal takes about 50 kB, against 360 kB as
+float64 rows. Signal samples are quantized to multiples of the upload's
+signal_resolution first.
+"""
+import struct
+import zlib
+
+import numpy as np
+from django.db import transaction
+from django.utils import timezone
+
+from .models import SessionTelemetry, TelemetryChunk
+
+PHASES = ('inhale', 'first_hold', 'exhale', 'second_hold', 'end')
+# The prescribed duration of each phase, named as in the render app's patterns
+PATTERN_KEYS = ('inhaleDuration', 'firstHoldDuration', 'exhaleDuration', 'secondHoldDuration')
+INHALE, FIRST_HOLD, EXHALE, SECOND_HOLD, END = range(len(PHASES))
+HOLD = -1
+
+MAX_CHUNK_SAMPLES = 60_000
+MAX_CHUNKS = 1_000
+# Largest magnitude of a stored (quantized) value; beyond it float64 no longer holds exact integers
+MAX_QUANTIZED = 2 ** 53
+ADHERENCE_TOLERANCE = 0.2
+# Breathing rates the signal's spectrum is searched for, in breaths per minute
+SIGNAL_RATE_RANGE = (2, 60)
+
+_SECTION = struct.Struct('<BIq')
+_WIDTHS = ((1, np.int8), (2, np.int16), (4, np.int32), (8, np.int64))
+
+
+def _pack_section(values):
+    values = np.asarray(values, dtype=np.int64)
+    if len(values) == 0:
+        return _SECTION.pack(0, 0, 0)
+    deltas = np.diff(values)
+    low, high = (int(deltas.min()), int(deltas.max())) if len(deltas) else (0, 0)
+    width, dtype = next((w, t) for w, t in _WIDTHS if np.iinfo(t).min <= low and high <= np.iinfo(t).max)
+    planes = deltas.astype(np.dtype(dtype).newbyteorder('<')).view(np.uint8).reshape(-1, width).T
+    return _SECTION.pack(width, len(values), int(values[0])) + planes.tobytes()
+
+
+def pack(arrays):
+    """Delta-encode and compress integer arrays into one blob"""
+    return zlib.compress(b''.join(_pack_section(values) for values in arrays))
+
+
+def unpack(blob):
+    """The int64 arrays a blob from pack() holds, in order"""
+    raw = zlib.decompress(bytes(blob))
+    arrays, offset = [], 0
+    while offset < len(raw):
+        width, count, first = _SECTION.unpack_from(raw, offset)
+        offset += _SECTION.size
+        if count == 0:
+            arrays.append(np.empty(0, dtype=np.int64))
+            continue
+        size = (count - 1) * width
+        dtype = np.dtype(dict(_WIDTHS)[width]).newbyteorder('<')
+        planes = np.frombuffer(raw, dtype=np.uint8, count=size, offset=offset).reshape(width, count - 1)
+        offset += size
+        deltas = np.ascontiguousarray(planes.T).view(dtype).ravel()
+        values = np.empty(count, dtype=np.int64)
+        values[0] = first
+        np.cumsum(deltas, dtype=np.int64, out=values[1:])
+        values[1:] += first
+        arrays.append(values)
+    return arrays
+
+
+def phase_codes(names):
+    """PHASES indices for phase names, with HOLD for a bare `hold`"""
+    lookup = {name: code for code, name in enumerate(PHASES)}
+    lookup['hold'] = HOLD
+    try:
+        return np.array([lookup[name] for name in names], dtype=np.int64)
+    except (KeyError, TypeError):
+        raise ValueError(f"phases must be names from {', '.join(PHASES)} or hold")
+
+
+def resolve_holds(codes):
+    """Replace HOLD with the first hold after an inhale and with the second hold otherwise"""
+    holds = np.flatnonzero(codes == HOLD)
+    if len(holds):
+        # Index of the last named phase at or before each event
+        known = np.where(codes == HOLD, -1, np.arange(len(codes)))
+        np.maximum.accumulate(known, out=known)
+        previous = np.full(len(codes), -1)
+        previous[1:] = known[:-1]
+        before = np.where(previous[holds] >= 0, codes[np.maximum(previous[holds], 0)], SECOND_HOLD)
+        codes[holds] = np.where(before == INHALE, FIRST_HOLD, SECOND_HOLD)
+    return codes
+
+
+def parse_chunk(data, signal_resolution):
+    """(phase times, phase codes, quantized signal) from an uploaded chunk, or ValueError"""
+    if not isinstance(data, dict):
+        raise ValueError("A chunk must be an object with phase_times_ms, phases and/or signal")
+    times, names, signal = (data.get(name, []) for name in ('phase_times_ms', 'phases', 'signal'))
+    if not all(isinstance(values, list) for values in (times, names, signal)):
+        raise ValueError("phase_times_ms, phases and signal must be lists")
+    if len(times) != len(names):
+        raise ValueError("phase_times_ms and phases must have the same length")
+    if len(times) + len(signal) > MAX_CHUNK_SAMPLES:
+        raise ValueError(f"A chunk holds at most {MAX_CHUNK_SAMPLES} samples")
+    try:
+        times = np.asarray(times, dtype=np.float64)
+        signal = np.asarray(signal, dtype=np.float64)
+    except (TypeError, ValueError):
+        raise ValueError("phase_times_ms and signal must be lists of numbers")
+    if times.ndim != 1 or signal.ndim != 1 or not (np.isfinite(times).all() and np.isfinite(signal).all()):
+        raise ValueError("phase_times_ms and signal must be lists of numbers")
+    if (times < 0).any() or (np.diff(times) < 0).any():
+        raise ValueError("phase_times_ms must be non-negative and in order")
+    times, signal = np.rint(times), np.rint(signal / signal_resolution)
+    if (times >= MAX_QUANTIZED).any():
+        raise ValueError(f"phase_times_ms must be below {MAX_QUANTIZED}")
+    if (np.abs(signal) >= MAX_QUANTIZED).any():
+        raise ValueError(f"signal values must be below {MAX_QUANTIZED} times the signal resolution in magnitude")
+    return times.astype(np.int64), phase_codes(names), signal.astype(np.int64)
+
+
+def _mean(values):
+    return round(float(values.mean()), 3) if len(values) else None
+
+
+def _signal_rate(signal, sample_rate_hz):
+    """Dominant breathing rate of the signal in breaths per minute, from its spectrum"""
+    if sample_rate_hz is None or len(signal) < 2:
+        return None
+    spectrum = np.abs(np.fft.rfft(signal - signal.mean()))
+    frequencies = np.fft.rfftfreq(len(signal), 1 / sample_rate_hz) * 60
+    band = (frequencies >= SIGNAL_RATE_RANGE[0]) & (frequencies <= SIGNAL_RATE_RANGE[1])
+    if not band.any() or not spectrum[band].any():
+        return None
+    return round(float(frequencies[band][np.argmax(spectrum[band])]), 2)
+
+
+def summarize(times, codes, signal, pattern, sample_rate_hz=None):
+    """Summary features of a session's telemetry, measured against the prescribed `pattern`"""
+    # Each phase lasts until the next one starts, so the last event only closes the one before it
+    durations = np.diff(times) / 1000
+    measured = codes[:-1]
+    phased = measured != END
+    durations, measured = durations[phased], measured[phased]
+
+    counts = np.bincount(measured, minlength=END)[:END]
+    totals = np.bincount(measured, weights=durations, minlength=END)[:END]
+    cycles = np.diff(times[codes == INHALE]) / 1000
+
+    prescribed = np.array([float(pattern[key]) for key in PATTERN_KEYS])
+    expected = prescribed[measured]
+    errors = np.abs(durations - expected)
+    # Phases the pattern leaves out (zero seconds) only count against adherence if they happen
+    within = np.where(expected > 0, errors <= ADHERENCE_TOLERANCE * expected, durations == 0)
+    error_totals = np.bincount(measured, weights=errors, minlength=END)[:END]
+
+    return {
+        'duration_seconds': round(float(times[-1] - times[0]) / 1000, 3) if len(times) else 0.0,
+        'phase_count': int(len(measured)),
+        'cycle_count': int(len(cycles)),
+        'cycle_seconds_mean': _mean(cycles),
+        'cycle_seconds_std': round(float(cycles.std()), 3) if len(cycles) else None,
+        'breaths_per_minute': round(60 / float(cycles.mean()), 2) if len(cycles) and cycles.mean() > 0 else None,
+        'phase_seconds_mean': {
+            PHASES[code]: round(float(totals[code] / counts[code]), 3) if counts[code] else None for code in range(END)
+        },
+        'adherence': round(float(within.mean()), 4) if len(within) else None,
+        'phase_error_seconds': {
+            PHASES[code]: round(float(error_totals[code] / counts[code]), 3) if counts[code] else None
+            for code in range(END)
+        },
+        'cycle_error_seconds': _mean(np.abs(cycles - prescribed.sum())),
+        'signal_samples': int(len(signal)),
+        'signal_seconds': round(len(signal) / sample_rate_hz, 3) if sample_rate_hz and len(signal) else None,
+        'signal_breaths_per_minute': _signal_rate(signal, sample_rate_hz),
+    }
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def validate_pattern(pattern):
+    if not isinstance(pattern, dict):
+        raise ValueError(f"pattern must be an object with {', '.join(PATTERN_KEYS)}")
+    durations = [pattern.get(key) for key in PATTERN_KEYS]
+    if any(not _is_number(d) or not 0 <= d < 3600 for d in durations):
+        raise ValueError(f"pattern needs {', '.join(PATTERN_KEYS)} in seconds")
+    if sum(durations) <= 0:
+        raise ValueError("pattern needs at least one non-zero duration")
+    return dict(zip(PATTERN_KEYS, durations))
+
+
+def start_upload(session, pattern, sample_rate_hz=None, signal_resolution=None):
+    """Create the session's telemetry, or reset it to receive a new upload"""
+    pattern = validate_pattern(pattern)
+    if sample_rate_hz is not None and not (_is_number(sample_rate_hz) and 0 < sample_rate_hz <= 1000):
+        raise ValueError("sample_rate_hz must be a number between 0 and 1000")
+    if signal_resolution is not None and not (_is_number(signal_resolution) and signal_resolution > 0):
+        raise ValueError("signal_resolution must be a positive number")
+    with transaction.atomic():
+        telemetry, _ = SessionTelemetry.objects.select_for_update().get_or_create(
+            session=session, defaults={'pattern': pattern}
+        )
+        telemetry.chunks.all().delete()
+        telemetry.pattern = pattern
+        telemetry.sample_rate_hz = sample_rate_hz
+        telemetry.signal_resolution = signal_resolution or SessionTelemetry.DEFAULT_SIGNAL_RESOLUTION
+        telemetry.data = None
+        telemetry.phase_count = telemetry.signal_count = telemetry.stored_bytes = 0
+        telemetry.summary = None
+        telemetry.completed_at = None
+        telemetry.save()
+    return telemetry
+
+
+def store_chunk(telemetry, index, data):
+    """Validate and store one chunk; returns its stored size in bytes"""
+    if telemetry.completed_at is not None:
+        raise ValueError("This upload is complete; start a new one to replace it")
+    if not 0 <= index < MAX_CHUNKS:
+        raise ValueError(f"Chunk index must be between 0 and {MAX_CHUNKS - 1}")
+    blob = pack(parse_chunk(data, telemetry.signal_resolution))
+    TelemetryChunk.objects.update_or_create(telemetry=telemetry, index=index, defaults={'data': blob})
+    return len(blob)
+
+
+def complete_upload(telemetry):
+    """Put the chunks together, compute the summary once and store the samples as one blob
+
+    Bare holds are resolved only now, since the inhale before one may be in the previous chunk.
+    """
+    with transaction.atomic():
+        telemetry = SessionTelemetry.objects.select_for_update().get(pk=telemetry.pk)
+        chunks = list(telemetry.chunks.order_by('index').values_list('index', 'data'))
+        if not chunks:
+            raise ValueError("No chunks were uploaded")
+        indices = [index for index, _ in chunks]
+        if indices != list(range(len(chunks))):
+            missing = sorted(set(range(indices[-1] + 1)) - set(indices))
+            raise ValueError(f"Missing chunks: {', '.join(map(str, missing))}")
+
+        parts = [unpack(data) for _, data in chunks]
+        times, codes, signal = (np.concatenate([part[i] for part in parts]) for i in range(3))
+        codes = resolve_holds(codes)
+        if (np.diff(times) < 0).any():
+            raise ValueError("phase_times_ms must be in order across chunks")
+
+        telemetry.summary = summarize(times, codes, signal * telemetry.signal_resolution,
+                                      telemetry.pattern, telemetry.sample_rate_hz)
+        telemetry.data = pack([times, codes, signal])
+        telemetry.phase_count = len(times)
+        telemetry.signal_count = len(signal)
+        telemetry.stored_bytes = len(telemetry.data)
+        telemetry.completed_at = timezone.now()
+        telemetry.save()
+        telemetry.chunks.all().delete()
+    return telemetry
+
+
+def samples(telemetry):
+    """The stored phase events and signal, decoded"""
+    if telemetry.data is None:
+        return None
+    times, codes, signal = unpack(telemetry.data)
+    return {
+        'phase_times_ms': times.tolist(),
+        'phases': [PHASES[code] for code in codes],
+        # Rounded so a resolution of 0.001 gives 0.3 back rather than 0.30000000000000004
+        'signal': np.round(signal * telemetry.signal_resolution, 9).tolist(),
+    }
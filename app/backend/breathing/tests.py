@@ -1,3 +1,1019 @@
-from django.test import TestCase
+import cProfile
+import gzip
+import os
+import pstats
+import random
+import tempfile
+import threading
+import time as time_module
+from datetime import date, datetime, time, timedelta, timezone as dt_timezone
+from unittest import skipUnless
 
-# Create your tests here.
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, connection
+from django.db.models import Max, Min
+from django.test import Client, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+
+import msgpack
+import numpy as np
+
+from . import (
+    benchmarks, db_router, instrumentation, ledger, profiling, progress, reminders, synthetic, telemetry, write_queue,
+)
+from .downsample import lttb_indices
+from .middleware import accepted_encodings, brotli
+from .models import BreathingExercise, BreathingMetrics, PracticeDay, User, UserPreference, UserSession
+from .renderers import ORJSONRenderer
+from .serializers import BreathingMetricsSerializer
+
+
+class QueryBudgetMixin:
+    """Assertions that keep an endpoint's query count independent of its result size.
+
+    `assertQueryBudget` requests `url` once, calls `grow()` to add rows to the
+    response, requests it again and fails if the second request ran more
+    queries than the first (an N+1) or either exceeded `max_queries`.
+    """
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200, response.content)
+        return response, [query['sql'] for query in queries.captured_queries]
+
+    def assertQueryBudget(self, url, grow, max_queries=None):
+        small_response, small = self.count_queries(url)
+        grow()
+        large_response, large = self.count_queries(url)
+
+        self.assertNotEqual(small_response.content, large_response.content,
+                            f"grow() did not change the response of {url}")
+        self.assertLessEqual(
+            len(large), len(small),
+            f"{url} ran {len(small)} queries before and {len(large)} after adding rows:\n" + "\n".join(large)
+        )
+        if max_queries is not None:
+            self.assertLessEqual(len(large), max_queries,
+                                 f"{url} ran {len(large)} queries, over its budget of {max_queries}:\n" + "\n".join(large))
+        return large_response
+
+
+def make_user(name):
+    return User.objects.create_user(username=name, email=f'{name}@example.com', firebase_uid=name)
+
+
+def make_exercise(name):
+    return BreathingExercise.objects.create(
+        name=name, description='', duration_minutes=5, instructions='', benefits=''
+    )
+
+
+def make_metric(user, bolt_score, mbt_steps, days_ago=0):
+    metric = BreathingMetrics.objects.create(user=user, bolt_score=bolt_score, mbt_steps=mbt_steps)
+    if days_ago:
+        # `date` is auto_now_add, so backdate it after the insert
+        BreathingMetrics.objects.filter(pk=metric.pk).update(date=timezone.now().date() - timedelta(days=days_ago))
+    return metric
+
+
+class EndpointQueryBudgetTests(QueryBudgetMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = make_user('athlete')
+        self.other_user = make_user('other')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.exercises = [make_exercise(f'Exercise {i}') for i in range(5)]
+
+    def test_exercise_list(self):
+        def grow():
+            # Catalog responses are cached until the write commits and bumps the version
+            with self.captureOnCommitCallbacks(execute=True):
+                for i in range(5):
+                    make_exercise(f'Extra {i}')
+
+        self.assertQueryBudget(reverse('exercise-list'), grow, max_queries=1)
+
+    def test_session_list(self):
+        UserSession.objects.create(user=self.user, exercise=self.exercises[0])
+
+        def grow():
+            for exercise in self.exercises:
+                UserSession.objects.create(user=self.user, exercise=exercise)
+            UserSession.objects.create(user=self.other_user, exercise=self.exercises[0])
+
+        response = self.assertQueryBudget(reverse('session-list'), grow, max_queries=1)
+        self.assertEqual(len(response.json()), 6)
+        self.assertEqual({row['exercise_name'] for row in response.json()}, {e.name for e in self.exercises})
+        self.assertEqual({row['username'] for row in response.json()}, {'athlete'})
+
+    def test_preference_list(self):
+        preference = UserPreference.objects.create(user=self.user)
+        preference.favorite_exercises.add(self.exercises[0])
+
+        response = self.assertQueryBudget(reverse('preference-list'),
+                                          lambda: preference.favorite_exercises.add(*self.exercises[1:]),
+                                          max_queries=2)
+        self.assertEqual(len(response.json()[0]['favorite_exercises']), 5)
+
+    def test_my_preferences(self):
+        preference = UserPreference.objects.create(user=self.user)
+        preference.favorite_exercises.add(self.exercises[0])
+
+        self.assertQueryBudget(reverse('preference-my-preferences'),
+                               lambda: preference.favorite_exercises.add(*self.exercises[1:]),
+                               max_queries=2)
+
+    def test_metrics_list(self):
+        make_metric(self.user, 20, 50, days_ago=3)
+
+        def grow():
+            for days_ago, score in [(2, 22), (1, 25), (0, 24)]:
+                make_metric(self.user, score, 50 + score, days_ago=days_ago)
+
+        response = self.assertQueryBudget(reverse('metrics-list'), grow)
+        changes = [row['bolt_score_change'] for row in response.json()]
+        self.assertEqual(changes, [-1, 3, 2, None])
+
+    def test_annotated_changes_match_per_row_lookup(self):
+        for days_ago, score in [(5, 20), (3, 26), (3, 27), (1, 21)]:
+            make_metric(self.user, score, score * 2, days_ago=days_ago)
+        make_metric(self.other_user, 90, 90, days_ago=2)
+
+        annotated = BreathingMetrics.objects.filter(user=self.user).with_previous_scores()
+        for metric in annotated:
+            plain = BreathingMetrics.objects.get(pk=metric.pk)
+            self.assertEqual(metric.bolt_score_change, plain.bolt_score_change)
+            self.assertEqual(metric.mbt_steps_change, plain.mbt_steps_change)
+
+
+class CatalogCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.exercise = make_exercise('Box Breathing')
+
+    def test_revalidation_is_a_304_without_queries(self):
+        response = self.client.get(reverse('exercise-list'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()[0]['name'], 'Box Breathing')
+        self.assertFalse(response['ETag'].startswith('W/'))
+
+        with self.assertNumQueries(0):
+            cached = self.client.get(reverse('exercise-list'))
+            not_modified = self.client.get(reverse('exercise-list'), HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(cached.content, response.content)
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(not_modified.content, b'')
+        self.assertEqual(not_modified['ETag'], response['ETag'])
+
+        by_date = self.client.get(reverse('exercise-list'), HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(by_date.status_code, 304)
+
+    def test_detail(self):
+        url = reverse('exercise-detail', args=[self.exercise.pk])
+        response = self.client.get(url)
+        self.assertEqual(response.json()['name'], 'Box Breathing')
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+        self.assertEqual(self.client.get(reverse('exercise-detail', args=[self.exercise.pk + 1])).status_code, 404)
+
+    def test_write_bumps_version(self):
+        response = self.client.get(reverse('exercise-list'))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.exercise.name = 'Square Breathing'
+            self.exercise.save()
+
+        changed = self.client.get(reverse('exercise-list'), HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(changed.status_code, 200)
+        self.assertNotEqual(changed['ETag'], response['ETag'])
+        self.assertEqual(changed.json()[0]['name'], 'Square Breathing')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.exercise.delete()
+        self.assertEqual(self.client.get(reverse('exercise-list'), HTTP_IF_NONE_MATCH=changed['ETag']).json(), [])
+
+
+class ExerciseSearchTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.box = BreathingExercise.objects.create(
+            name='Box Breathing', description='Four equal sides', difficulty='beginner', duration_minutes=5,
+            instructions='Inhale, hold, exhale, hold', benefits='Calms the nervous system')
+        self.wim = BreathingExercise.objects.create(
+            name='Power Breathing', description='Thirty deep breaths then a breath hold', difficulty='advanced',
+            duration_minutes=15, instructions='Breathe deeply', benefits='Energizing')
+        self.nasal = BreathingExercise.objects.create(
+            name='Alternate Nostril', description='Balancing breathwork', difficulty='intermediate',
+            duration_minutes=10, instructions='Close one nostril', benefits='Calm focus before competition')
+
+    def search(self, **params):
+        response = self.client.get(reverse('exercise-search'), params)
+        self.assertEqual(response.status_code, 200, response.content)
+        return [row['name'] for row in response.json()]
+
+    def test_ranked_prefix_matching(self):
+        # Name matches outrank matches in the other fields
+        results = self.search(q='breath')
+        self.assertEqual(set(results[:2]), {'Box Breathing', 'Power Breathing'})
+        self.assertEqual(results[2], 'Alternate Nostril')
+        self.assertCountEqual(self.search(q='calm'), ['Box Breathing', 'Alternate Nostril'])
+        self.assertEqual(self.search(q='nost clo'), ['Alternate Nostril'])
+        self.assertEqual(self.search(q='calm energ'), [])
+
+    def test_filters(self):
+        self.assertEqual(self.search(q='breath', difficulty='advanced'), ['Power Breathing'])
+        self.assertEqual(self.search(min_duration=6, max_duration=12), ['Alternate Nostril'])
+        self.assertEqual(self.client.get(reverse('exercise-search'), {'difficulty': 'expert'}).status_code, 400)
+        self.assertEqual(self.client.get(reverse('exercise-search'), {'limit': 0}).status_code, 400)
+
+    def test_query_syntax_is_not_interpreted(self):
+        # Operators are searched for as plain words, which every result must contain
+        self.assertEqual(self.search(q='"box" OR name:power NEAR('), [])
+        self.assertEqual(self.search(q='box)* -'), ['Box Breathing'])
+
+    def test_index_follows_writes(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.box.name = 'Square Breathing'
+            self.box.save()
+            BreathingExercise.objects.filter(pk=self.wim.pk).update(benefits='Resilience')
+            self.nasal.delete()
+        self.assertEqual(self.search(q='square'), ['Square Breathing'])
+        self.assertEqual(self.search(q='box'), [])
+        self.assertEqual(self.search(q='resilience'), ['Power Breathing'])
+        self.assertEqual(self.search(q='nostril'), [])
+
+
+@skipUnless(settings.DATABASE_REPLICAS, "needs a replica: run with --settings=breathmanu.test_settings")
+class ReplicaRoutingTests(TestCase):
+    databases = {'default', *settings.DATABASE_REPLICAS}
+
+    def setUp(self):
+        cache.clear()
+        self.user = make_user('athlete')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        # The two databases do not replicate, so give each a different BOLT score
+        make_metric(self.user, 20, 50)
+        User.objects.using('replica_1').create(pk=self.user.pk, username='athlete', firebase_uid='athlete')
+        BreathingMetrics.objects.using('replica_1').create(user_id=self.user.pk, bolt_score=30, mbt_steps=50)
+
+    def latest_bolt_score(self):
+        response = self.client.get(reverse('metrics-progress-summary'))
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()['latest_bolt_score']
+
+    def test_analytics_read_from_replica(self):
+        self.assertEqual(self.latest_bolt_score(), 30)
+        response = self.client.get(reverse('metrics-chart-data'), {'period': 'month'})
+        self.assertEqual(response.json()['datasets'][0]['data'], [30.0])
+
+    def test_other_endpoints_read_from_primary(self):
+        response = self.client.get(reverse('metrics-list'))
+        self.assertEqual([row['bolt_score'] for row in response.json()], [20])
+
+    def test_own_write_pins_reads_to_primary(self):
+        response = self.client.post(reverse('metrics-list'), {'bolt_score': 25, 'mbt_steps': 60})
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertEqual(self.latest_bolt_score(), 25)
+
+        cache.clear()  # the stickiness window has passed
+        self.assertEqual(self.latest_bolt_score(), 30)
+
+    def test_failed_write_does_not_pin(self):
+        response = self.client.post(reverse('metrics-list'), {'bolt_score': 500, 'mbt_steps': 60})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.latest_bolt_score(), 30)
+
+
+@override_settings(SQLITE_WRITE_QUEUE=True)
+class WriteQueueTests(TransactionTestCase):
+    def setUp(self):
+        self.user = make_user('athlete')
+
+    def save_metric(self, bolt_score, user):
+        serializer = BreathingMetricsSerializer(data={'bolt_score': bolt_score, 'mbt_steps': 10})
+        serializer.is_valid(raise_exception=True)
+        return write_queue.save(serializer, user=user)
+
+    def test_concurrent_saves_are_coalesced(self):
+        queue = write_queue.get_queue()
+        batches_before = queue.batches
+        results = {}
+        start = threading.Barrier(20)
+
+        def worker(n):
+            start.wait()
+            try:
+                results[n] = self.save_metric(n, None if n == 3 else self.user)
+            except Exception as e:
+                results[n] = e
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker, args=(n,)) for n in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        # The save without a user fails on its own; everything else in its batch commits
+        self.assertIsInstance(results.pop(3), IntegrityError)
+        self.assertEqual(sorted(metric.bolt_score for metric in results.values()), [n for n in range(20) if n != 3])
+        self.assertTrue(all(metric.pk for metric in results.values()))
+        self.assertEqual(BreathingMetrics.objects.count(), 19)
+        self.assertLess(queue.batches - batches_before, 19)
+
+
+def make_session(user, exercise, days_ago, minutes, completed=True):
+    session = UserSession.objects.create(user=user, exercise=exercise)
+    # `start_time` is auto_now_add, so backdate it before the session is completed
+    start = timezone.now() - timedelta(days=days_ago)
+    UserSession.objects.filter(pk=session.pk).update(start_time=start)
+    session.refresh_from_db()
+    session.end_time = start + timedelta(minutes=minutes)
+    session.completed = completed
+    session.save()
+    return session
+
+
+class PracticeLedgerTests(TestCase):
+    def setUp(self):
+        self.user = make_user('athlete')
+        self.exercise = make_exercise('Box Breathing')
+        UserPreference.objects.create(user=self.user, practice_goal_minutes=15)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def today(self):
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('practice-today'))
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def streaks(self):
+        return {row.date: row.streak for row in PracticeDay.objects.filter(user=self.user)}
+
+    def test_streak_survives_until_the_day_ends(self):
+        for days_ago in (4, 2, 1):
+            make_session(self.user, self.exercise, days_ago, 10)
+        self.assertEqual(self.today()['current_streak'], 2)
+        self.assertEqual(self.today()['minutes'], 0)
+
+        make_session(self.user, self.exercise, 0, 10)
+        make_session(self.user, self.exercise, 0, 7)
+        status = self.today()
+        self.assertEqual((status['current_streak'], status['minutes'], status['sessions_completed']), (3, 17, 2))
+        self.assertTrue(status['goal_met'])
+
+    def test_filling_a_gap_renumbers_the_run_after_it(self):
+        for days_ago in (4, 2, 1, 0):
+            make_session(self.user, self.exercise, days_ago, 10)
+        gap = make_session(self.user, self.exercise, 3, 10)
+        self.assertEqual(self.today()['current_streak'], 5)
+
+        gap.delete()
+        self.assertEqual(self.today()['current_streak'], 3)
+        make_session(self.user, self.exercise, 3, 10, completed=False)
+        self.assertEqual(self.today()['current_streak'], 3)
+
+    def test_incremental_ledger_matches_rebuild(self):
+        for days_ago, minutes in [(9, 5), (8, 20), (8, 3), (6, 15), (5, 1), (4, 30), (1, 12), (0, 4)]:
+            make_session(self.user, self.exercise, days_ago, minutes)
+        make_session(self.user, self.exercise, 7, 10, completed=False)
+        make_session(self.user, self.exercise, 5, 0).delete()
+
+        incremental = list(PracticeDay.objects.filter(user=self.user).values_list(
+            'date', 'minutes', 'sessions_completed', 'streak'))
+        ledger.rebuild(self.user.pk)
+        rebuilt = list(PracticeDay.objects.filter(user=self.user).values_list(
+            'date', 'minutes', 'sessions_completed', 'streak'))
+        self.assertEqual(rebuilt, incremental)
+
+    def test_complete_action_counts_the_session(self):
+        session = UserSession.objects.create(user=self.user, exercise=self.exercise)
+        UserSession.objects.filter(pk=session.pk).update(start_time=timezone.now() - timedelta(minutes=20))
+        response = self.client.post(reverse('session-complete', args=[session.pk]))
+        self.assertEqual(response.status_code, 200)
+        status = self.today()
+        self.assertEqual((status['minutes'], status['current_streak'], status['goal_met']), (20, 1, True))
+
+    def test_calendar(self):
+        for days_ago, minutes in [(3, 20), (2, 5), (0, 15)]:
+            make_session(self.user, self.exercise, days_ago, minutes)
+        today = timezone.localdate()
+        response = self.client.get(reverse('practice-list'),
+                                   {'start': (today - timedelta(days=3)).isoformat(), 'end': today.isoformat()})
+        body = response.json()
+        self.assertEqual([day['minutes'] for day in body['days']], [20, 5, 15])
+        self.assertEqual([day['streak'] for day in body['days']], [1, 2, 1])
+        self.assertEqual(body['goal_hit_rate'], 0.5)
+        self.assertEqual(self.client.get(reverse('practice-list'), {'start': 'yesterday'}).status_code, 400)
+
+    def test_days_follow_the_users_time_zone(self):
+        UserPreference.objects.filter(user=self.user).update(timezone='America/New_York')
+        session = UserSession.objects.create(user=self.user, exercise=self.exercise)
+        # 01:30 UTC on 10 March is still the evening of 9 March in New York
+        start = datetime(2026, 3, 10, 1, 30, tzinfo=dt_timezone.utc)
+        UserSession.objects.filter(pk=session.pk).update(start_time=start)
+        session.refresh_from_db()
+        session.end_time = start + timedelta(minutes=20)
+        session.completed = True
+        session.save()
+        days = lambda: list(PracticeDay.objects.filter(user=self.user).values_list('date', 'minutes'))
+        self.assertEqual(days(), [(date(2026, 3, 9), 20)])
+        self.assertEqual(ledger.today_status(self.user.pk, today=date(2026, 3, 9))['minutes'], 20)
+
+        ledger.rebuild(self.user.pk)
+        self.assertEqual(days(), [(date(2026, 3, 9), 20)])
+
+        preference = UserPreference.objects.get(user=self.user)
+        response = self.client.patch(reverse('preference-detail', args=[preference.pk]), {'timezone': 'UTC'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(days(), [(date(2026, 3, 10), 20)])
+
+
+def reference_lttb(points, threshold):
+    """Straightforward single-series LTTB, as published"""
+    every = (len(points) - 2) / (threshold - 2)
+    kept, a = [0], 0
+    for i in range(threshold - 2):
+        start, end = int(i * every) + 1, int((i + 1) * every) + 1
+        next_end = min(int((i + 2) * every) + 1, len(points))
+        next_bucket = points[end:next_end]
+        avg_x = sum(p[0] for p in next_bucket) / len(next_bucket)
+        avg_y = sum(p[1] for p in next_bucket) / len(next_bucket)
+        ax, ay = points[a]
+        areas = [abs((ax - avg_x) * (y - ay) - (ax - x) * (avg_y - ay)) for x, y in points[start:end]]
+        a = start + areas.index(max(areas))
+        kept.append(a)
+    return kept + [len(points) - 1]
+
+
+class DownsampleTests(TestCase):
+    def test_matches_reference_lttb(self):
+        rng = random.Random(7)
+        for n, threshold in [(10, 3), (101, 10), (1000, 97), (5000, 500)]:
+            x = sorted(rng.uniform(0, 1e6) for _ in range(n))
+            y = [rng.gauss(30, 8) for _ in range(n)]
+            self.assertEqual(lttb_indices(x, [y], threshold).tolist(), reference_lttb(list(zip(x, y)), threshold))
+
+    def test_short_series_are_kept(self):
+        self.assertEqual(lttb_indices([1, 2, 3], [[5, 6, 7]], 10).tolist(), [0, 1, 2])
+        self.assertEqual(lttb_indices([], [[]], 10).tolist(), [])
+
+    def test_raw_chart_data(self):
+        user = make_user('athlete')
+        client = APIClient()
+        client.force_authenticate(user)
+        db_router.pin_to_primary(user.pk)  # read our own writes even when a replica is configured
+        today = timezone.now().date()
+        BreathingMetrics.objects.bulk_create([
+            BreathingMetrics(user=user, bolt_score=20 + (i % 7), mbt_steps=60, date=today)
+            for i in range(300)
+        ])
+        # bulk_create still applies auto_now_add, so spread the measurements out afterwards
+        for offset, pk in enumerate(BreathingMetrics.objects.filter(user=user).order_by('pk').values_list('pk', flat=True)):
+            BreathingMetrics.objects.filter(pk=pk).update(date=today - timedelta(days=300 - offset))
+            if offset == 150:
+                BreathingMetrics.objects.filter(pk=pk).update(bolt_score=99)
+
+        response = client.get(reverse('metrics-chart-data'), {'period': 'raw', 'max_points': 50})
+        body = response.json()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((body['total_points'], body['downsampled']), (300, True))
+        self.assertEqual(len(body['labels']), 50)
+        self.assertEqual(body['labels'], sorted(body['labels']))
+        self.assertEqual(len(body['datasets'][0]['data']), 50)
+        self.assertIn(99, body['datasets'][0]['data'])  # LTTB keeps the spike
+
+        everything = client.get(reverse('metrics-chart-data'), {'period': 'raw', 'max_points': 5000}).json()
+        self.assertEqual(len(everything['labels']), 300)
+        self.assertFalse(everything['downsampled'])
+        self.assertEqual(client.get(reverse('metrics-chart-data'), {'period': 'raw', 'max_points': 2}).status_code, 400)
+
+
+
+class DashboardTests(TestCase):
+    def setUp(self):
+        self.user = make_user('athlete')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        db_router.pin_to_primary(self.user.pk)  # read our own writes even when a replica is configured
+        rng = random.Random(3)
+        today = timezone.now().date()
+        BreathingMetrics.objects.bulk_create([
+            BreathingMetrics(user=self.user, bolt_score=rng.randint(10, 60), mbt_steps=rng.randint(30, 120))
+            for _ in range(400)
+        ])
+        # Spread the rows over three years, several per day, each day's times in creation order
+        pks = BreathingMetrics.objects.filter(user=self.user).order_by('pk').values_list('pk', flat=True)
+        for i, pk in enumerate(pks):
+            BreathingMetrics.objects.filter(pk=pk).update(date=today - timedelta(days=1100 - (i // 2) * 11 // 2),
+                                                          time=time(8 + i % 2))
+        make_metric(make_user('other'), 99, 99)
+
+    def get(self, name, **params):
+        response = self.client.get(reverse(f'metrics-{name}'), params)
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()
+
+    def test_matches_the_separate_endpoints(self):
+        with self.assertNumQueries(1):
+            dashboard = self.get('dashboard', period='quarter', weeks=10, months=18)
+
+        summary = self.get('progress-summary')
+        for key, value in summary.items():
+            self.assertEqual(dashboard[key], value, key)
+        self.assertEqual(dashboard['weekly_stats'], self.get('weekly-stats', weeks=10))
+        self.assertEqual(dashboard['monthly_stats'], self.get('monthly-stats', months=18))
+        self.assertEqual(dashboard['quarterly_stats'], self.get('quarterly-stats'))
+        self.assertEqual(dashboard['yearly_stats'], self.get('yearly-stats'))
+        self.assertEqual(dashboard['chart'], self.get('chart-data', period='quarter'))
+        self.assertTrue(all(dashboard[key] for key in progress.PERIODS.values()))
+
+    def test_empty_and_invalid(self):
+        BreathingMetrics.objects.filter(user=self.user).delete()
+        dashboard = self.get('dashboard')
+        self.assertIsNone(dashboard['latest_bolt_score'])
+        self.assertIsNone(dashboard['monthly_progress'])
+        self.assertEqual((dashboard['weekly_bolt_average'], dashboard['yearly_stats']), (0, []))
+        self.assertEqual(dashboard['chart']['labels'], [])
+
+        for params in [{'period': 'raw'}, {'weeks': 0}, {'years': 'two'}, {'years': 10 ** 6}, {'weeks': 5219}]:
+            self.assertEqual(self.client.get(reverse('metrics-dashboard'), params).status_code, 400)
+        self.assertEqual(self.client.get(reverse('metrics-dashboard'), progress.MAX_SPANS).status_code, 200)
+
+
+class ResponseFormatTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = make_user('athlete')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        db_router.pin_to_primary(self.user.pk)  # read our own writes even when a replica is configured
+        make_metric(self.user, 20, 50)
+        make_metric(self.user, 24, 55)
+
+    def test_orjson_matches_the_stdlib_renderer(self):
+        data = self.client.get(reverse('metrics-list')).data
+        self.assertIsNotNone(data[0]['monthly_progress']['start_date'])  # a date object, not a string
+        self.assertEqual(ORJSONRenderer().render(data), JSONRenderer().render(data))
+
+    def test_messagepack(self):
+        for url in [reverse('metrics-list'), reverse('metrics-dashboard'), reverse('exercise-list')]:
+            as_json = self.client.get(url).json()
+            response = self.client.get(url, HTTP_ACCEPT='application/msgpack')
+            self.assertEqual(response['Content-Type'], 'application/msgpack')
+            self.assertEqual(msgpack.unpackb(response.content), as_json)
+
+        response = self.client.post(reverse('metrics-list'), msgpack.packb({'bolt_score': 30, 'mbt_steps': 60}),
+                                    content_type='application/msgpack')
+        self.assertEqual(response.status_code, 201, response.content)
+        response = self.client.post(reverse('metrics-list'), b'\x93\x01', content_type='application/msgpack')
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post(reverse('metrics-list'), b'{"bolt_score": ', content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_catalog_caches_each_format_separately(self):
+        make_exercise('Box Breathing')
+        as_json = self.client.get(reverse('exercise-list'))
+        as_msgpack = self.client.get(reverse('exercise-list'), HTTP_ACCEPT='application/msgpack')
+        self.assertNotEqual(as_json['ETag'], as_msgpack['ETag'])
+        self.assertEqual(msgpack.unpackb(as_msgpack.content), as_json.json())
+        revalidated = self.client.get(reverse('exercise-list'), HTTP_ACCEPT='application/msgpack',
+                                      HTTP_IF_NONE_MATCH=as_msgpack['ETag'])
+        self.assertEqual(revalidated.status_code, 304)
+
+
+@override_settings(COMPRESSION_MIN_SIZE=200)
+class CompressionTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        for i in range(10):
+            make_exercise(f'Exercise {i}')
+        self.url = reverse('exercise-list')
+
+    def test_accepted_encodings(self):
+        self.assertEqual(accepted_encodings('gzip, br;q=0.5, *;q=0'), {'gzip': 1.0, 'br': 0.5, '*': 0.0})
+        self.assertEqual(accepted_encodings('GZIP ; q = 0.8,,'), {'gzip': 0.8})
+
+    def test_gzip(self):
+        plain = self.client.get(self.url)
+        self.assertFalse(plain.has_header('Content-Encoding'))
+        self.assertIn('Accept-Encoding', plain['Vary'])
+
+        response = self.client.get(self.url, HTTP_ACCEPT_ENCODING='gzip;q=1, br;q=0')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(response.content), plain.content)
+        self.assertEqual(int(response['Content-Length']), len(response.content))
+        self.assertEqual(response['ETag'], 'W/' + plain['ETag'])
+        # The weakened tag still revalidates
+        revalidated = self.client.get(self.url, HTTP_ACCEPT_ENCODING='gzip', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(revalidated.status_code, 304)
+
+        self.assertFalse(self.client.get(self.url, HTTP_ACCEPT_ENCODING='gzip;q=0').has_header('Content-Encoding'))
+        with override_settings(COMPRESSION_MIN_SIZE=10 ** 6):
+            self.assertFalse(self.client.get(self.url, HTTP_ACCEPT_ENCODING='gzip').has_header('Content-Encoding'))
+
+    @skipUnless(brotli, "needs the brotli package")
+    def test_brotli_preferred(self):
+        plain = self.client.get(self.url)
+        response = self.client.get(self.url, HTTP_ACCEPT_ENCODING='gzip, deflate, br')
+        self.assertEqual(response['Content-Encoding'], 'br')
+        self.assertEqual(brotli.decompress(response.content), plain.content)
+        self.assertEqual(self.client.get(self.url, HTTP_ACCEPT_ENCODING='gzip, br;q=0.5')['Content-Encoding'], 'gzip')
+
+
+class SyntheticDataTests(TestCase):
+    def test_generate(self):
+        counts = synthetic.generate(users=3, exercises=8, sessions_per_user=20, years=2, metrics_per_day=2,
+                                    batch_size=100)
+        self.assertEqual((counts['users'], counts['exercises'], counts['sessions']), (3, 8, 60))
+        self.assertEqual(counts['metrics'], 3 * 730 * 2)
+        user = User.objects.get(username='synthetic-0')
+        dates = BreathingMetrics.objects.filter(user=user).aggregate(first=Min('date'), last=Max('date'))
+        self.assertEqual(dates['last'], timezone.localdate())
+        self.assertEqual((dates['last'] - dates['first']).days, 729)
+        self.assertLess(UserSession.objects.filter(user=user).aggregate(first=Min('start_time'))['first'],
+                        timezone.now() - timedelta(days=30))
+        self.assertEqual(PracticeDay.objects.count(), counts['practice_days'])
+        self.assertGreater(counts['practice_days'], 0)
+        self.assertTrue(BreathingMetrics._meta.get_field('date').auto_now_add)  # restored after backdating
+
+
+@override_settings(DATABASE_ROUTERS=[])  # the test replica is empty: keep every read on the primary
+class ApiBenchmarkTests(TestCase):
+
+    def test_endpoints_stay_within_the_baseline_query_counts(self):
+        synthetic.generate(users=2, exercises=10, sessions_per_user=20, years=1, metrics_per_day=1)
+        user = User.objects.get(username='synthetic-0')
+        results = benchmarks.run(user, repeat=1, warmup=1)
+        baseline = benchmarks.load_baseline()
+        self.assertEqual({result.endpoint for result in results}, set(baseline))
+        self.assertEqual(benchmarks.compare(results, baseline), [])
+
+    def test_compare(self):
+        baseline = {'metrics-list': {'p50_ms': 10.0, 'p95_ms': 20.0, 'queries': 3}}
+        result = benchmarks.Result('metrics-list', 200, 12.0, 29.0, 4)
+        self.assertEqual(len(benchmarks.compare([result], baseline)), 1)
+        self.assertEqual(len(benchmarks.compare([result], baseline, latency_tolerance=0.5)), 1)
+        self.assertEqual(len(benchmarks.compare([result], baseline, latency_tolerance=0.4)), 2)
+        self.assertEqual(benchmarks.compare([benchmarks.Result('new', 200, 1.0, 1.0, 9)], baseline), [])
+
+
+def scraped_value(text, series):
+    """Value of one series in a Prometheus text exposition, or 0 if it is absent"""
+    for line in text.splitlines():
+        if line.startswith(series + ' '):
+            return float(line.rsplit(' ', 1)[1])
+    return 0
+
+
+class InstrumentationTests(TestCase):
+    databases = {'default', *settings.DATABASE_REPLICAS}
+
+    def setUp(self):
+        self.user = make_user('athlete')
+        self.client = APIClient(raise_request_exception=False)
+        self.client.force_authenticate(self.user)
+
+    def scrape(self):
+        response = self.client.get(reverse('prometheus-metrics'))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        return response.content.decode()
+
+    def test_histogram_exposition(self):
+        histogram = instrumentation.Histogram('test_seconds', 'Test', ['view'], buckets=(0.1, 1))
+        self.addCleanup(instrumentation.REGISTRY.remove, histogram)
+        for value in (0.05, 0.5, 5):
+            histogram.observe(value, 'say "hi"')
+        self.assertEqual(histogram.render().splitlines(), [
+            '# HELP test_seconds Test',
+            '# TYPE test_seconds histogram',
+            'test_seconds_bucket{view="say \\"hi\\"",le="0.1"} 1',
+            'test_seconds_bucket{view="say \\"hi\\"",le="1"} 2',
+            'test_seconds_bucket{view="say \\"hi\\"",le="+Inf"} 3',
+            'test_seconds_sum{view="say \\"hi\\""} 5.55',
+            'test_seconds_count{view="say \\"hi\\""} 3',
+        ])
+        with self.assertRaises(ValueError):
+            histogram.observe(1)
+
+    def test_requests_are_recorded_by_route(self):
+        requests = 'http_requests_total{route="metrics-chart-data",method="GET",status="200"}'
+        queries = 'http_request_db_queries_count{route="metrics-chart-data"}'
+        no_queries = 'http_request_db_queries_bucket{route="metrics-chart-data",le="0"}'
+        before = self.scrape()
+        for _ in range(2):
+            self.assertEqual(self.client.get(reverse('metrics-chart-data')).status_code, 200)
+        self.client.get('/no-such-page/')
+        after = self.scrape()
+
+        self.assertEqual(scraped_value(after, requests) - scraped_value(before, requests), 2)
+        self.assertEqual(scraped_value(after, queries) - scraped_value(before, queries), 2)
+        # Both requests queried the database
+        self.assertEqual(scraped_value(after, no_queries), scraped_value(before, no_queries))
+        self.assertGreater(scraped_value(after, 'http_request_duration_seconds_sum{route="metrics-chart-data",method="GET"}'), 0)
+        self.assertIn('http_requests_total{route="unmatched",method="GET",status="404"}', after)
+        self.assertIn('http_requests_in_flight 1', after)  # the scrape itself
+
+    def test_firebase_verification_is_timed(self):
+        failures = 'firebase_token_verification_seconds_count{outcome="failure"}'
+        before = scraped_value(self.scrape(), failures)
+        response = self.client.get(reverse('metrics-chart-data'), HTTP_AUTHORIZATION='Bearer not-a-token')
+        self.assertGreaterEqual(response.status_code, 400)
+        self.assertEqual(scraped_value(self.scrape(), failures) - before, 1)
+
+    @override_settings(METRICS_ALLOWED_IPS=['10.0.0.1'])
+    def test_scrapes_are_limited_to_allowed_addresses(self):
+        self.assertEqual(self.client.get(reverse('prometheus-metrics')).status_code, 403)
+        self.assertEqual(self.client.get(reverse('prometheus-metrics'), REMOTE_ADDR='10.0.0.1').status_code, 200)
+
+
+class RequestProfilingTests(TestCase):
+    databases = {'default', *settings.DATABASE_REPLICAS}
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings_override = override_settings(PROFILING_SECRET='test-secret', REQUEST_PROFILE_DIR=directory.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        self.admin = make_user('admin')
+        self.admin.is_staff = True
+        self.admin.save()
+        self.admin_client = APIClient()
+        self.admin_client.force_authenticate(self.admin)
+        self.client = APIClient()
+        self.client.force_authenticate(make_user('athlete'))
+        self.chart_url = reverse('metrics-chart-data')
+
+    def token_for(self, path, **data):
+        response = self.admin_client.post(reverse('request-profile-token'), dict(data, path=path), format='json')
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()['token']
+
+    def test_signed_request_is_profiled(self):
+        token = self.token_for(self.chart_url)
+        self.assertFalse(self.client.get(self.chart_url).has_header('X-Profile-Id'))
+        response = self.client.get(self.chart_url, {'period': 'year'}, HTTP_X_PROFILE_TOKEN=token)
+        self.assertEqual(response.status_code, 200)
+        profile_id = response['X-Profile-Id']
+
+        listed = self.admin_client.get(reverse('request-profile-list')).json()
+        self.assertEqual([profile['id'] for profile in listed], [profile_id])
+        detail = self.admin_client.get(reverse('request-profile-detail', args=[profile_id]), {'sort': 'tottime'}).json()
+        self.assertEqual((detail['route'], detail['status'], detail['trigger']), ('metrics-chart-data', 200, 'token'))
+        self.assertEqual(detail['query_string'], 'period=year')
+        self.assertGreater(detail['db_queries'], 0)
+        self.assertIn('get_chart_data', self.admin_client.get(
+            reverse('request-profile-detail', args=[profile_id]), {'limit': 500}).json()['summary'])
+
+        download = self.admin_client.get(reverse('request-profile-download', args=[profile_id]))
+        path = os.path.join(settings.REQUEST_PROFILE_DIR, 'downloaded.prof')
+        with open(path, 'wb') as f:
+            f.write(b''.join(download.streaming_content))
+        self.assertGreater(pstats.Stats(path).total_calls, 0)
+
+    def test_invalid_tokens_are_ignored(self):
+        other_path = self.token_for(reverse('metrics-weekly-stats'))
+        expired = f'{int(time_module.time()) - 1}.{profiling._signature(int(time_module.time()) - 1, self.chart_url)}'
+        for token in [other_path, expired, 'garbage', self.token_for(self.chart_url)[:-1]]:
+            self.assertFalse(self.client.get(self.chart_url, HTTP_X_PROFILE_TOKEN=token).has_header('X-Profile-Id'))
+        with override_settings(PROFILING_SECRET=''):
+            self.assertFalse(self.client.get(self.chart_url, HTTP_X_PROFILE_TOKEN=other_path).has_header('X-Profile-Id'))
+        self.assertEqual(profiling.get_store().list(), [])
+
+    def test_staff_header(self):
+        make_exercise('Box Breathing')
+        staff = Client()
+        staff.force_login(self.admin)
+        self.assertTrue(staff.get(reverse('exercise-list'), HTTP_X_PROFILE='1').has_header('X-Profile-Id'))
+        athlete = Client()
+        athlete.force_login(User.objects.get(username='athlete'))
+        self.assertFalse(athlete.get(reverse('exercise-list'), HTTP_X_PROFILE='1').has_header('X-Profile-Id'))
+
+    def test_admin_only(self):
+        self.assertEqual(self.client.get(reverse('request-profile-list')).status_code, 403)
+        self.assertEqual(self.client.post(reverse('request-profile-token'), {'path': '/'}).status_code, 403)
+        self.assertEqual(self.admin_client.get(reverse('request-profile-detail', args=['nope'])).status_code, 404)
+        self.assertEqual(self.admin_client.post(reverse('request-profile-token'), {'path': 'relative'}).status_code, 400)
+
+    def test_store_keeps_the_newest(self):
+        store = profiling.ProfileStore(settings.REQUEST_PROFILE_DIR, max_profiles=2)
+        ids = []
+        for _ in range(3):
+            profile = cProfile.Profile()
+            profile.enable()
+            profile.disable()
+            ids.append(store.save(profile, {}))
+        self.assertEqual(sorted(profile['id'] for profile in store.list()), sorted(ids)[1:])
+
+
+class TelemetryTests(TestCase):
+    PATTERN = {'inhaleDuration': 4, 'firstHoldDuration': 2, 'exhaleDuration': 6, 'secondHoldDuration': 0}
+
+    def setUp(self):
+        self.user = make_user('athlete')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.session = UserSession.objects.create(user=self.user, exercise=make_exercise('Box Breathing'))
+        self.url = reverse('session-telemetry', args=[self.session.pk])
+
+    def chunk_url(self, index):
+        return reverse('session-telemetry-chunk', args=[self.session.pk, index])
+
+    def phase_events(self, cycles):
+        """Events that follow PATTERN exactly, naming both holds `hold` as the app does"""
+        times, names = [], []
+        for cycle in range(cycles):
+            start = cycle * 12000
+            times += [start, start + 4000, start + 6000]
+            names += ['inhale', 'hold', 'exhale']
+        return times + [cycles * 12000], names + ['end']
+
+    def test_codec_round_trip(self):
+        rng = np.random.default_rng(0)
+        arrays = [
+            np.array([], dtype=np.int64), np.array([7]), np.arange(0, 10 ** 6, 40),
+            rng.integers(-1000, 1000, 5000).cumsum(), np.array([-2 ** 62, 2 ** 62, 0]),
+        ]
+        for original, decoded in zip(arrays, telemetry.unpack(telemetry.pack(arrays))):
+            np.testing.assert_array_equal(decoded, original)
+        # Steady 40 ms steps need one byte per delta before compression and almost nothing after
+        self.assertLess(len(telemetry.pack([np.arange(0, 10 ** 6, 40)])), 200)
+
+    def test_bare_holds_follow_the_phase_before(self):
+        codes = telemetry.resolve_holds(telemetry.phase_codes(['hold', 'inhale', 'hold', 'exhale', 'hold', 'inhale']))
+        self.assertEqual([telemetry.PHASES[code] for code in codes],
+                         ['second_hold', 'inhale', 'first_hold', 'exhale', 'second_hold', 'inhale'])
+
+    def test_chunked_upload(self):
+        response = self.client.post(self.url, {'pattern': self.PATTERN, 'sample_rate_hz': 25}, format='json')
+        self.assertEqual(response.status_code, 201, response.content)
+
+        times, names = self.phase_events(20)
+        # Six breaths a minute for the four minutes, split across the chunks
+        signal = np.round(np.sin(2 * np.pi * 0.1 * np.arange(25 * 240) / 25), 3).tolist()
+        chunks = [
+            {'phase_times_ms': times[:31], 'phases': names[:31], 'signal': signal[:3000]},
+            {'phase_times_ms': times[31:], 'phases': names[31:], 'signal': signal[3000:]},
+        ]
+        # Out of order, and the first chunk twice as a client retrying would
+        for index in [1, 0, 0]:
+            response = self.client.put(self.chunk_url(index), chunks[index], format='json')
+            self.assertEqual(response.status_code, 200, response.content)
+        response = self.client.post(reverse('session-telemetry-complete', args=[self.session.pk]))
+        self.assertEqual(response.status_code, 200, response.content)
+
+        summary = response.json()['summary']
+        self.assertEqual((summary['phase_count'], summary['cycle_count']), (60, 19))
+        self.assertEqual(summary['cycle_seconds_mean'], 12.0)
+        self.assertEqual(summary['breaths_per_minute'], 5.0)
+        self.assertEqual(summary['adherence'], 1.0)
+        self.assertEqual(summary['phase_seconds_mean'],
+                         {'inhale': 4.0, 'first_hold': 2.0, 'exhale': 6.0, 'second_hold': None})
+        self.assertEqual(summary['signal_seconds'], 240.0)
+        self.assertEqual(summary['signal_breaths_per_minute'], 6.0)
+        self.assertLess(response.json()['stored_bytes'], 8 * len(signal) / 4)
+        self.assertFalse(self.session.telemetry.chunks.exists())
+
+        samples = self.client.get(self.url, {'samples': 'true'}).json()['samples']
+        self.assertEqual(samples['phase_times_ms'], times)
+        self.assertEqual(samples['phases'][:4], ['inhale', 'first_hold', 'exhale', 'inhale'])
+        self.assertEqual(samples['signal'], signal)
+
+    def test_adherence_counts_phases_off_the_pattern(self):
+        times, names = self.phase_events(2)
+        times[2] = 4500  # a half second hold instead of two, and a 7.5 second exhale instead of six
+        summary = telemetry.summarize(np.array(times), telemetry.resolve_holds(telemetry.phase_codes(names)),
+                                      np.array([]), self.PATTERN)
+        self.assertAlmostEqual(summary['adherence'], 4 / 6, places=4)
+        self.assertEqual(summary['phase_error_seconds']['first_hold'], 0.75)
+        self.assertIsNone(summary['signal_breaths_per_minute'])
+
+    def test_rejected_uploads(self):
+        self.assertEqual(self.client.put(self.chunk_url(0), {}, format='json').status_code, 404)
+        self.assertEqual(self.client.post(self.url, {'pattern': {'inhaleDuration': 4}}, format='json').status_code, 400)
+        self.assertEqual(self.client.post(self.url, {'pattern': self.PATTERN, 'sample_rate_hz': '25'},
+                                          format='json').status_code, 400)
+        self.client.post(self.url, {'pattern': self.PATTERN}, format='json')
+
+        for chunk in [{'phase_times_ms': [0, 1000], 'phases': ['inhale']},
+                      {'phase_times_ms': [1000, 0], 'phases': ['inhale', 'exhale']},
+                      {'phase_times_ms': [0], 'phases': ['sigh']},
+                      {'signal': 'not a list'},
+                      {'signal': [1e30]},
+                      {'signal': [-1e13]},
+                      {'phase_times_ms': [0, 1e300], 'phases': ['inhale', 'end']}]:
+            self.assertEqual(self.client.put(self.chunk_url(0), chunk, format='json').status_code, 400, chunk)
+
+        self.client.put(self.chunk_url(0), {'phase_times_ms': [0], 'phases': ['inhale']}, format='json')
+        self.client.put(self.chunk_url(2), {'phase_times_ms': [9000], 'phases': ['end']}, format='json')
+        complete_url = reverse('session-telemetry-complete', args=[self.session.pk])
+        response = self.client.post(complete_url)
+        self.assertEqual(response.json(), {'error': 'Missing chunks: 1'})
+        self.client.put(self.chunk_url(1), {'phase_times_ms': [4000], 'phases': ['exhale']}, format='json')
+        self.assertEqual(self.client.post(complete_url).status_code, 200)
+        self.assertEqual(self.client.put(self.chunk_url(3), {}, format='json').status_code, 400)
+
+        other = APIClient()
+        other.force_authenticate(make_user('someone-else'))
+        self.assertEqual(other.get(self.url).status_code, 404)
+
+class RecordingDispatcher:
+    def __init__(self):
+        self.batches = []
+
+    def send(self, reminders):
+        self.batches.append(list(reminders))
+
+
+def utc(*args):
+    return datetime(*args, tzinfo=dt_timezone.utc)
+
+
+class ReminderSchedulerTests(TestCase):
+    def setUp(self):
+        self.dispatcher = RecordingDispatcher()
+        self.scheduler = reminders.ReminderScheduler(dispatcher=self.dispatcher, batch_size=2)
+
+    def add_user(self, name, reminder, tz='UTC', enabled=True):
+        user = make_user(name)
+        UserPreference.objects.create(user=user, daily_reminder=reminder, timezone=tz, notification_enabled=enabled)
+        return user
+
+    def sent_users(self):
+        return sorted(reminder.user_id for batch in self.dispatcher.batches for reminder in batch)
+
+    def test_next_occurrence_follows_dst(self):
+        # New York springs forward on 2026-03-08: 07:30 local moves from 12:30 to 11:30 UTC
+        self.assertEqual(reminders.next_occurrence(time(7, 30), 'America/New_York', utc(2026, 3, 7, 0)),
+                         utc(2026, 3, 7, 12, 30))
+        self.assertEqual(reminders.next_occurrence(time(7, 30), 'America/New_York', utc(2026, 3, 7, 13)),
+                         utc(2026, 3, 8, 11, 30))
+
+    def test_ticks_send_due_reminders_in_batches(self):
+        early = [self.add_user(f'early{i}', time(7, 30)) for i in range(3)]
+        berlin = self.add_user('berlin', time(8, 30), tz='Europe/Berlin')  # 06:30 UTC in October
+        self.add_user('later', time(9, 0))
+        self.add_user('muted', time(7, 30), enabled=False)
+        self.scheduler.load(now=utc(2026, 10, 19, 6, 0))
+        self.assertEqual(len(self.scheduler.wheel), 5)
+
+        self.assertEqual(self.scheduler.tick(now=utc(2026, 10, 19, 6, 30, 1)), 1)
+        self.assertEqual(self.sent_users(), [berlin.pk])
+        self.assertEqual(self.scheduler.tick(now=utc(2026, 10, 19, 7, 0, 1)), 0)
+
+        # Late tick: catches up on every minute it missed
+        self.assertEqual(self.scheduler.tick(now=utc(2026, 10, 19, 7, 30, 20)), 3)
+        self.assertEqual([len(batch) for batch in self.dispatcher.batches], [1, 2, 1])
+        self.assertEqual(self.sent_users(), sorted([berlin.pk] + [user.pk for user in early]))
+        metrics = self.scheduler.metrics()
+        self.assertEqual((metrics['dispatched'], metrics['max_batch_size']), (4, 2))
+        self.assertAlmostEqual(metrics['last_tick_lag_seconds'], 20)
+
+        # Fired reminders come back around the next day
+        self.assertEqual(self.scheduler.tick(now=utc(2026, 10, 20, 7, 30, 1)), 5)
+
+    def test_saved_preferences_update_the_wheel(self):
+        reminders.active_scheduler = self.scheduler
+        self.addCleanup(setattr, reminders, 'active_scheduler', None)
+        self.scheduler.load(now=utc(2026, 10, 19, 6, 0))
+
+        user = make_user('athlete')
+        with self.captureOnCommitCallbacks(execute=True):
+            preference = UserPreference.objects.create(user=user, daily_reminder=time(7, 0))
+        self.assertIn(user.pk, self.scheduler.schedule_of)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            preference.notification_enabled = False
+            preference.save()
+        self.assertEqual(len(self.scheduler.wheel), 0)
+
+    def test_sync_picks_up_changes_from_other_processes(self):
+        self.scheduler.load(now=timezone.now() - timedelta(minutes=1))
+        user = self.add_user('athlete', time(7, 0))  # no active scheduler in this process
+        self.assertNotIn(user.pk, self.scheduler.schedule_of)
+        self.scheduler.sync()
+        self.assertIn(user.pk, self.scheduler.schedule_of)
+
+    def test_preferences_deleted_after_scheduling_are_not_sent(self):
+        gone = self.add_user('gone', time(7, 30))
+        kept = self.add_user('kept', time(7, 30))
+        self.scheduler.load(now=utc(2026, 10, 19, 6, 0))
+        UserPreference.objects.filter(user=gone).delete()
+        self.scheduler.tick(now=utc(2026, 10, 19, 7, 30))
+        self.assertEqual(self.sent_users(), [kept.pk])
@@ -1,11 +1,23 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import UserViewSet, BreathingExerciseViewSet, UserSessionViewSet
+from .views import (
+    UserViewSet,
+    BreathingExerciseViewSet,
+    UserSessionViewSet,
+    UserPreferenceViewSet,
+    BreathingMetricsViewSet,
+    PracticeViewSet,
+    RequestProfileViewSet
+)
 
 router = DefaultRouter()
 router.register(r'users', UserViewSet, basename='user')
 router.register(r'exercises', BreathingExerciseViewSet, basename='exercise')
 router.register(r'sessions', UserSessionViewSet, basename='session')
+router.register(r'preferences', UserPreferenceViewSet, basename='preference')
+router.register(r'metrics', BreathingMetricsViewSet, basename='metrics')
+router.register(r'practice', PracticeViewSet, basename='practice')
+router.register(r'admin/profiles', RequestProfileViewSet, basename='request-profile')
 
 urlpatterns = [
     path('', include(router.urls)),
@@ -1,66 +1,287 @@
 from rest_framework import viewsets, permissions, status
 from rest_framework.decorators import action, api_view, permission_classes
 from rest_framework.response import Response
+from django.http import FileResponse, HttpResponse, HttpResponseNotModified
+from django.db import transaction
 from django.utils import timezone
+from datetime import date, timedelta
 from django.contrib.auth import get_user_model
-from .models import BreathingExercise, UserSession, UserPreference, BreathingMetrics
+import hashlib
+from . import catalog, db_router, ledger, profiling, progress, telemetry, write_queue
+from .search import search_exercises, search_terms
+from .models import BreathingExercise, UserSession, UserPreference, BreathingMetrics, PracticeDay, SessionTelemetry
 from .serializers import (
     BreathingExerciseSerializer,
     UserSessionSerializer,
     UserPreferenceSerializer,
     UserSerializer,
-    BreathingMetricsSerializer
+    BreathingMetricsSerializer,
+    PracticeDaySerializer,
+    SessionTelemetrySerializer
 )
 
 User = get_user_model()
 
+SEARCH_DEFAULT_LIMIT = 50
+SEARCH_MAX_LIMIT = 200
+
+# Columns a session list needs: the session itself plus the two related names it shows
+SESSION_LIST_FIELDS = [
+    'id', 'start_time', 'end_time', 'duration_minutes', 'mood_before', 'mood_after', 'notes',
+    'energy_level', 'focus_level', 'completed', 'user', 'user__username', 'exercise', 'exercise__name',
+]
+
+def exercise_filters(params):
+    """ORM filters from the difficulty, min_duration and max_duration query parameters"""
+    filters = {}
+    difficulty = params.get('difficulty')
+    if difficulty:
+        choices = [value for value, _ in BreathingExercise.DIFFICULTY_CHOICES]
+        if difficulty not in choices:
+            raise ValueError(f"Invalid difficulty. Choose from: {', '.join(choices)}")
+        filters['difficulty'] = difficulty
+    for param, lookup in [('min_duration', 'duration_minutes__gte'), ('max_duration', 'duration_minutes__lte')]:
+        if params.get(param):
+            try:
+                filters[lookup] = int(params[param])
+            except ValueError:
+                raise ValueError(f"{param} must be a whole number of minutes")
+    return filters
+
+def search_limit(params):
+    try:
+        limit = int(params.get('limit', SEARCH_DEFAULT_LIMIT))
+    except ValueError:
+        limit = 0
+    if not 1 <= limit <= SEARCH_MAX_LIMIT:
+        raise ValueError(f"limit must be between 1 and {SEARCH_MAX_LIMIT}")
+    return limit
+
 class BreathingExerciseViewSet(viewsets.ModelViewSet):
     queryset = BreathingExercise.objects.all()
     serializer_class = BreathingExerciseSerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
 
+    def list(self, request, *args, **kwargs):
+        return self.catalog_response(
+            request, 'list',
+            lambda: self.get_serializer(self.filter_queryset(self.get_queryset()), many=True).data
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        pk = kwargs[self.lookup_url_kwarg or self.lookup_field]
+        return self.catalog_response(request, f'detail:{pk}', lambda: self.get_serializer(self.get_object()).data, pk)
+
+    @action(detail=False, methods=['get'])
+    def search(self, request):
+        """Ranked full-text search over the catalog, with optional difficulty and duration filters"""
+        params = request.query_params
+        try:
+            filters = exercise_filters(params)
+            limit = search_limit(params)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        terms = search_terms(params.get('q', ''))
+
+        def build():
+            queryset = BreathingExercise.objects.filter(**filters)
+            queryset = search_exercises(queryset, ' '.join(terms)) if terms else queryset.order_by('id')
+            return self.get_serializer(queryset[:limit], many=True).data
+
+        # Equivalent queries share one cached payload and ETag
+        normalized = repr((terms, sorted(filters.items()), limit))
+        variant = 'search-' + hashlib.blake2b(normalized.encode(), digest_size=8).hexdigest()
+        return self.catalog_response(request, variant, build, variant)
+
+    def catalog_response(self, request, key, build_data, variant=None):
+        """Serve the cached payload for this catalog version, or a 304 if the client already has it"""
+        renderer = request.accepted_renderer
+        if renderer.format not in ('json', 'msgpack'):
+            # The browsable API renders per request
+            return Response(build_data())
+        if renderer.format != 'json':
+            # Each format is its own representation, with its own payload and ETag
+            key = f'{key}:{renderer.format}'
+            variant = f'{variant}-{renderer.format}' if variant else renderer.format
+        version = catalog.get_version()
+        if catalog.is_not_modified(request, version, variant):
+            response = HttpResponseNotModified()
+        else:
+            payload = catalog.get_payload(version, key, lambda: renderer.render(build_data()))
+            response = HttpResponse(payload, content_type=renderer.media_type)
+        response['ETag'] = catalog.etag(version, variant)
+        response['Last-Modified'] = catalog.last_modified(version)
+        # Clients may keep the catalog but must revalidate it on every use
+        response['Cache-Control'] = 'no-cache'
+        response['Vary'] = 'Accept'
+        return response
+
 class UserSessionViewSet(viewsets.ModelViewSet):
     serializer_class = UserSessionSerializer
     permission_classes = [permissions.IsAuthenticated]
 
     def get_queryset(self):
-        return UserSession.objects.filter(user=self.request.user)
+        queryset = UserSession.objects.filter(user=self.request.user).select_related('user', 'exercise')
+        if self.action == 'list':
+            queryset = queryset.only(*SESSION_LIST_FIELDS)
+        return queryset
 
     def perform_create(self, serializer):
-        serializer.save(user=self.request.user)
+        write_queue.save(serializer, user=self.request.user)
 
     @action(detail=True, methods=['post'])
     def complete(self, request, pk=None):
         session = self.get_object()
         session.end_time = timezone.now()
+        session.completed = True
         session.save()
         return Response({'status': 'session completed'})
 
+    @action(detail=True, methods=['get', 'post'], url_path='telemetry', url_name='telemetry')
+    def session_telemetry(self, request, pk=None):
+        """
+        POST starts (or restarts) a chunked telemetry upload with the prescribed `pattern`
+        and optional `sample_rate_hz`; GET returns the summary, and the decoded samples with ?samples=true
+        """
+        session = self.get_object()
+        if request.method == 'POST':
+            try:
+                record = telemetry.start_upload(session, request.data.get('pattern'),
+                                                request.data.get('sample_rate_hz'),
+                                                request.data.get('signal_resolution'))
+            except ValueError as e:
+                return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+            data = SessionTelemetrySerializer(record).data
+            data.update(max_chunks=telemetry.MAX_CHUNKS, max_chunk_samples=telemetry.MAX_CHUNK_SAMPLES)
+            return Response(data, status=status.HTTP_201_CREATED)
+
+        try:
+            record = session.telemetry
+        except SessionTelemetry.DoesNotExist:
+            return Response({'error': 'This session has no telemetry'}, status=status.HTTP_404_NOT_FOUND)
+        data = SessionTelemetrySerializer(record).data
+        if request.query_params.get('samples') == 'true':
+            data['samples'] = telemetry.samples(record)
+        return Response(data)
+
+    @action(detail=True, methods=['put'], url_path=r'telemetry/chunks/(?P<index>[0-9]+)',
+            url_name='telemetry-chunk')
+    def telemetry_chunk(self, request, index, pk=None):
+        """Store chunk `index` (phase_times_ms, phases, signal) of the upload; re-sending a chunk replaces it"""
+        record = SessionTelemetry.objects.filter(session=self.get_object()).first()
+        if record is None:
+            return Response({'error': 'Start the telemetry upload first'}, status=status.HTTP_404_NOT_FOUND)
+        try:
+            stored_bytes = telemetry.store_chunk(record, int(index), request.data)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({'index': int(index), 'stored_bytes': stored_bytes})
+
+    @action(detail=True, methods=['post'], url_path='telemetry/complete', url_name='telemetry-complete')
+    def complete_telemetry(self, request, pk=None):
+        """Assemble the uploaded chunks and compute the summary"""
+        record = SessionTelemetry.objects.filter(session=self.get_object()).first()
+        if record is None:
+            return Response({'error': 'Start the telemetry upload first'}, status=status.HTTP_404_NOT_FOUND)
+        try:
+            record = telemetry.complete_upload(record)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(SessionTelemetrySerializer(record).data)
+
+class PracticeViewSet(viewsets.GenericViewSet):
+    """Daily practice ledger (see ledger.py): calendar, goal hit rate and today's streak"""
+    serializer_class = PracticeDaySerializer
+    permission_classes = [permissions.IsAuthenticated]
+    max_calendar_days = 366
+
+    def get_queryset(self):
+        return PracticeDay.objects.filter(user=self.request.user)
+
+    def list(self, request):
+        """Ledger rows between ?start= and ?end= (ISO dates, default the last 30 days)"""
+        today = timezone.localdate(timezone=ledger.user_timezone(request.user.pk))
+        try:
+            end = date.fromisoformat(request.query_params.get('end', today.isoformat()))
+            start = date.fromisoformat(request.query_params.get('start', (end - timedelta(days=29)).isoformat()))
+        except ValueError:
+            return Response({'error': 'start and end must be dates (YYYY-MM-DD)'}, status=status.HTTP_400_BAD_REQUEST)
+        days = (end - start).days + 1
+        if not 1 <= days <= self.max_calendar_days:
+            return Response({'error': f'The range must cover 1 to {self.max_calendar_days} days'},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        rows = list(self.get_queryset().filter(date__gte=start, date__lte=end))
+        return Response({
+            'start': start,
+            'end': end,
+            'days': self.get_serializer(rows, many=True).data,
+            'practice_days': sum(1 for row in rows if row.practiced),
+            'total_minutes': sum(row.minutes for row in rows),
+            # Days without a row count as missed
+            'goal_hit_rate': sum(1 for row in rows if row.goal_met) / days,
+        })
+
+    @action(detail=False, methods=['get'])
+    def today(self, request):
+        return Response(ledger.today_status(request.user.pk))
+
 class UserPreferenceViewSet(viewsets.ModelViewSet):
     serializer_class = UserPreferenceSerializer
     permission_classes = [permissions.IsAuthenticated]
 
     def get_queryset(self):
-        return UserPreference.objects.filter(user=self.request.user)
+        return UserPreference.objects.filter(user=self.request.user).prefetch_related('favorite_exercises')
 
     def perform_create(self, serializer):
-        serializer.save(user=self.request.user)
+        with transaction.atomic():
+            preference = serializer.save(user=self.request.user)
+            if preference.timezone != 'UTC':
+                ledger.rebuild(preference.user_id)
+
+    def perform_update(self, serializer):
+        old_timezone = serializer.instance.timezone
+        with transaction.atomic():
+            preference = serializer.save()
+            # Practice days are counted in this time zone
+            if preference.timezone != old_timezone:
+                ledger.rebuild(preference.user_id)
 
     @action(detail=False, methods=['get'])
     def my_preferences(self, request):
-        preference, created = UserPreference.objects.get_or_create(user=request.user)
+        preference, created = self.get_queryset().get_or_create(user=request.user)
         serializer = self.get_serializer(preference)
         return Response(serializer.data)
 
 class BreathingMetricsViewSet(viewsets.ModelViewSet):
     serializer_class = BreathingMetricsSerializer
     permission_classes = [permissions.IsAuthenticated]
+    # Read-only aggregates that can be served from a replica (see db_router.py)
+    replica_actions = {
+        'progress_summary', 'chart_data', 'weekly_stats', 'monthly_stats', 'quarterly_stats', 'yearly_stats',
+        'dashboard',
+    }
+
+    def dispatch(self, request, *args, **kwargs):
+        token = db_router.read_from_replica(False)
+        try:
+            return super().dispatch(request, *args, **kwargs)
+        finally:
+            db_router.reset_reads(token)
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        if self.action in self.replica_actions and not db_router.is_pinned(request.user.pk):
+            db_router.read_from_replica()
 
     def get_queryset(self):
-        return BreathingMetrics.objects.filter(user=self.request.user)
+        queryset = BreathingMetrics.objects.filter(user=self.request.user)
+        if self.action in ('list', 'retrieve'):
+            queryset = queryset.with_previous_scores()
+        return queryset
 
     def perform_create(self, serializer):
-        serializer.save(user=self.request.user)
+        write_queue.save(serializer, user=self.request.user)
 
     @action(detail=False, methods=['get'])
     def progress_summary(self, request):
@@ -83,15 +304,45 @@ class BreathingMetricsViewSet(viewsets.ModelViewSet):
     def chart_data(self, request):
         """Get data formatted for charts"""
         period = request.query_params.get('period', 'month')
-        if period not in ['week', 'month', 'quarter', 'year']:
+        if period not in ['week', 'month', 'quarter', 'year', 'raw']:
             return Response(
-                {'error': 'Invalid period. Choose from: week, month, quarter, year'},
+                {'error': 'Invalid period. Choose from: week, month, quarter, year, raw'},
                 status=status.HTTP_400_BAD_REQUEST
             )
+        try:
+            max_points = int(request.query_params.get('max_points', 500))
+        except ValueError:
+            max_points = 0
+        if not 3 <= max_points <= 5000:
+            return Response({'error': 'max_points must be between 3 and 5000'}, status=status.HTTP_400_BAD_REQUEST)
 
-        data = BreathingMetrics.get_chart_data(request.user, period)
+        data = BreathingMetrics.get_chart_data(request.user, period, max_points=max_points)
         return Response(data)
 
+    @action(detail=False, methods=['get'])
+    def dashboard(self, request):
+        """Progress summary, weekly/monthly/quarterly/yearly stats and one chart from a single query"""
+        period = request.query_params.get('period', 'month')
+        if period not in progress.PERIODS:
+            return Response(
+                {'error': f"Invalid period. Choose from: {', '.join(progress.PERIODS)}"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        spans = {}
+        for name, default in progress.DEFAULT_SPANS.items():
+            try:
+                spans[name] = int(request.query_params.get(name, default))
+            except ValueError:
+                spans[name] = 0
+            if spans[name] < 1:
+                return Response({'error': f'{name} must be a positive whole number'},
+                                status=status.HTTP_400_BAD_REQUEST)
+            if spans[name] > progress.MAX_SPANS[name]:
+                return Response({'error': f'{name} may be at most {progress.MAX_SPANS[name]}'},
+                                status=status.HTTP_400_BAD_REQUEST)
+
+        return Response(progress.build_dashboard(request.user, period=period, **spans))
+
     @action(detail=False, methods=['get'])
     def weekly_stats(self, request):
         """Get weekly statistics"""
@@ -120,6 +371,58 @@ class BreathingMetricsViewSet(viewsets.ModelViewSet):
         data = BreathingMetrics.get_yearly_stats(request.user, years=years)
         return Response(data)
 
+class RequestProfileViewSet(viewsets.ViewSet):
+    """Request profiles recorded by profiling.ProfilingMiddleware, for admins"""
+    permission_classes = [permissions.IsAdminUser]
+    lookup_value_regex = '[0-9A-Za-z-]+'
+    summary_sorts = ('cumulative', 'tottime', 'calls')
+
+    def list(self, request):
+        return Response(profiling.get_store().list())
+
+    def retrieve(self, request, pk=None):
+        """Metadata plus the top functions; ?sort=cumulative|tottime|calls, ?limit="""
+        sort = request.query_params.get('sort', 'cumulative')
+        if sort not in self.summary_sorts:
+            return Response({'error': f"sort must be one of: {', '.join(self.summary_sorts)}"},
+                            status=status.HTTP_400_BAD_REQUEST)
+        try:
+            limit = max(1, min(int(request.query_params.get('limit', 40)), 500))
+        except ValueError:
+            return Response({'error': 'limit must be a whole number'}, status=status.HTTP_400_BAD_REQUEST)
+        store = profiling.get_store()
+        try:
+            return Response(dict(store.get(pk), summary=store.summary(pk, limit=limit, sort=sort)))
+        except KeyError:
+            return Response({'error': 'No such profile'}, status=status.HTTP_404_NOT_FOUND)
+
+    @action(detail=True, methods=['get'])
+    def download(self, request, pk=None):
+        """The raw pstats file, for snakeviz, speedscope or pstats"""
+        try:
+            path = profiling.get_store().profile_path(pk)
+        except KeyError:
+            return Response({'error': 'No such profile'}, status=status.HTTP_404_NOT_FOUND)
+        return FileResponse(open(path, 'rb'), as_attachment=True, filename=f'{pk}.prof',
+                            content_type='application/octet-stream')
+
+    @action(detail=False, methods=['post'])
+    def token(self, request):
+        """An X-Profile-Token for requests to `path` over the next `ttl` seconds"""
+        path = request.data.get('path')
+        if not path or not str(path).startswith('/'):
+            return Response({'error': 'path must be an absolute URL path, e.g. /api/metrics/chart_data/'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        try:
+            ttl = int(request.data.get('ttl', 600))
+        except (TypeError, ValueError):
+            return Response({'error': 'ttl must be a number of seconds'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            token, expires = profiling.sign_token(path, ttl)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({'header': 'X-Profile-Token', 'token': token, 'path': path, 'expires': expires})
+
 class UserViewSet(viewsets.ModelViewSet):
     serializer_class = UserSerializer
     permission_classes = [permissions.IsAuthenticated]
@@ -0,0 +1,92 @@
+"""In-process write-coalescing queue for SQLite.
+
+SQLite has one writer at a time, and each autocommit INSERT pays for its
+own lock acquisition and commit. With SQLITE_WRITE_QUEUE=true, request
+threads hand their saves to a single writer thread instead. The writer
+runs whatever has queued up (up to `max_batch` saves, waiting at most
+`max_delay` seconds for more) in one transaction, each save in its own
+savepoint so one failing save does not roll back the others, and hands
+every caller its own result or exception.
+
+Callers block until their save has committed, so a response is never sent
+for a write that is not durable yet.
+"""
+import logging
+import queue
+import threading
+from concurrent.futures import Future
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+
+
+class WriteQueue:
+    def __init__(self, max_batch=64, max_delay=0.002):
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.batches = 0
+        self.writes = 0
+        self._jobs = queue.SimpleQueue()
+        self._thread = threading.Thread(target=self._run, name='sqlite-writer', daemon=True)
+        self._thread.start()
+
+    def submit(self, save):
+        """Run `save()` on the writer thread and return its result once committed"""
+        future = Future()
+        self._jobs.put((save, future))
+        return future.result()
+
+    def _next_batch(self):
+        batch = [self._jobs.get()]
+        while len(batch) < self.max_batch:
+            try:
+                batch.append(self._jobs.get(timeout=self.max_delay))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            close_old_connections()
+            results = []
+            try:
+                with transaction.atomic():
+                    for save, future in batch:
+                        try:
+                            with transaction.atomic():
+                                results.append((future, save(), None))
+                        except Exception as e:
+                            results.append((future, None, e))
+            except Exception as e:
+                # The commit itself failed: none of the batch was written
+                logging.error(f"Write batch of {len(batch)} failed: {str(e)}")
+                results = [(future, None, e) for _, future in batch]
+
+            self.batches += 1
+            self.writes += len(batch)
+            for future, result, error in results:
+                if error is None:
+                    future.set_result(result)
+                else:
+                    future.set_exception(error)
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_queue():
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            _queue = WriteQueue()
+        return _queue
+
+
+def save(serializer, **kwargs):
+    """serializer.save(**kwargs), through the write queue when SQLITE_WRITE_QUEUE is enabled"""
+    # Inside a transaction the save has to be part of it, not committed separately
+    if not getattr(settings, 'SQLITE_WRITE_QUEUE', False) or transaction.get_connection().in_atomic_block:
+        return serializer.save(**kwargs)
+    return get_queue().submit(lambda: serializer.save(**kwargs))
@@ -0,0 +1,24 @@
+"""
+Settings for running the test suite against a primary and a read replica.
+
+Two local SQLite files stand in for the two servers; nothing replicates
+between them, so tests can tell which one a query read from.
+
+    python manage.py test --settings=breathmanu.test_settings
+"""
+
+from .settings import *  # noqa: F401,F403
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / 'db.sqlite3',
+        'TEST': {'NAME': BASE_DIR / 'test_primary.sqlite3'},
+    },
+    'replica_1': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / 'db_replica.sqlite3',
+        'TEST': {'NAME': BASE_DIR / 'test_replica.sqlite3'},
+    },
+}
+DATABASE_REPLICAS = ['replica_1']
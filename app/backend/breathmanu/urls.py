@@ -1,9 +1,11 @@
 from django.contrib import admin
 from django.urls import path, include
 from rest_framework.authtoken import views as auth_views
+from breathing.instrumentation import metrics_view
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/', include('breathing.urls')),
     path('api-auth/', include('rest_framework.urls')),
+    path('metrics', metrics_view, name='prometheus-metrics'),
 ] 
\ No newline at end of file
@@ -1,11 +1,21 @@
-from flask import Flask, send_file, render_template, request, jsonify
+from flask import Flask, Request, Response, abort, send_file, render_template, request, jsonify
 import os
 import logging
+import io
+import hmac
 import json
-from customized_breathing import draw_scene
-from werkzeug.utils import secure_filename
+import re
+import secrets
+import time
+import multiprocessing
+from render_config import FRAME_RATE, PREVIEW_FPS, PREVIEW_SCALE
+from profile_store import TOKEN_HEADER, ProfileStore, sign_token
+from render_pool import RenderPool
+from render_profiling import RenderMetrics
+from render_cost import AdmissionController, AdmissionRejected, estimate_render_cost, image_pixels, load_coefficients
+from upload_store import UploadRejected, UploadStore
+from werkzeug.exceptions import RequestEntityTooLarge
 import traceback
-from PIL import Image
 
 app = Flask(__name__)
 logging.basicConfig(level=logging.DEBUG)
@@ -15,171 +25,236 @@ UPLOAD_FOLDER = 'uploads'
 BALL_IMAGES_FOLDER = 'uploads/ball_images'
 BACKGROUND_IMAGES_FOLDER = 'uploads/background_images'
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
+PREVIEW_FORMATS = {'webp': 'image/webp', 'gif': 'image/gif'}
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['BALL_IMAGES_FOLDER'] = BALL_IMAGES_FOLDER
 app.config['BACKGROUND_IMAGES_FOLDER'] = BACKGROUND_IMAGES_FOLDER
 
-# Create necessary directories
-os.makedirs(BALL_IMAGES_FOLDER, exist_ok=True)
-os.makedirs(BACKGROUND_IMAGES_FOLDER, exist_ok=True)
+# Every /generate renders to its own file, served from /video/<id> until it is
+# RENDER_OUTPUT_MAX_AGE seconds old; concurrent renders never share an output
+app.config['RENDER_OUTPUT_DIR'] = os.environ.get(
+    'RENDER_OUTPUT_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'renders'))
+app.config['RENDER_OUTPUT_MAX_AGE'] = int(os.environ.get('RENDER_OUTPUT_MAX_AGE', 3600))
+VIDEO_ID = re.compile(r'^[0-9a-f]{32}$')
+
+# Render instrumentation: /metrics exports aggregated RenderReports in Prometheus
+# text format, and setting RENDER_PROFILE_DIR dumps a cProfile file per render job
+app.config['EXPORT_METRICS'] = os.environ.get('EXPORT_METRICS', 'true').lower() == 'true'
+app.config['RENDER_PROFILE_DIR'] = os.environ.get('RENDER_PROFILE_DIR')
+render_metrics = RenderMetrics()
+
+# On-demand profiling of single renders (see profile_store.py): a signed
+# X-Profile-Token header or an admin-armed counter picks the renders to profile
+profile_store = ProfileStore.from_environ()
+app.config['ADMIN_TOKEN'] = os.environ.get('ADMIN_TOKEN')
+
+# Admission control: every render is costed up front (see render_cost.py) and
+# charged against a per-client budget and a global in-flight CPU budget
+admission = AdmissionController.from_environ()
+render_cost_coefficients = load_coefficients()
+
+# Renders run in a pool of pre-warmed worker processes (see render_pool.py), so
+# this process never imports matplotlib, scipy or OpenCV. RENDER_WORKERS=0
+# renders in-process instead.
+render_pool = RenderPool.from_environ()
+
+# Uploads are stored by content digest (see upload_store.py). File parts are
+# streamed into the store and hashed while the multipart body is parsed.
+upload_store = UploadStore.from_environ({'ball': BALL_IMAGES_FOLDER, 'background': BACKGROUND_IMAGES_FOLDER})
+# Two images plus the form fields; larger bodies are refused before parsing
+app.config['MAX_CONTENT_LENGTH'] = 2 * upload_store.max_bytes + 1024 * 1024
+
+class UploadRequest(Request):
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        incoming = upload_store.open_incoming()
+        self.__dict__.setdefault('incoming_files', []).append(incoming)
+        return incoming
+
+    def close(self):
+        super().close()
+        # Also drops parts that never reached request.files because parsing was aborted
+        for incoming in self.__dict__.get('incoming_files', ()):
+            incoming.close()
+
+app.request_class = UploadRequest
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-def convert_to_png_with_transparency(input_path):
-    try:
-        if not os.path.exists(input_path):
-            logging.error(f"Input file does not exist: {input_path}")
-            return None
-
-        # Open the image
-        with Image.open(input_path) as img:
-            # Convert to RGBA
-            if img.mode in ['RGB', 'L']:
-                # For RGB or grayscale images, create transparency around non-white pixels
-                if img.mode == 'L':
-                    img = img.convert('RGB')
-                
-                # Convert to RGBA
-                img = img.convert('RGBA')
-                
-                # Get image data
-                data = img.getdata()
-                
-                # Create new data with transparency
-                new_data = []
-                for item in data:
-                    # If pixel is white-ish, make it transparent
-                    if item[0] > 240 and item[1] > 240 and item[2] > 240:
-                        new_data.append((255, 255, 255, 0))
-                    else:
-                        new_data.append(item)
-                
-                img.putdata(new_data)
-            elif img.mode != 'RGBA':
-                img = img.convert('RGBA')
-            
-            # Generate output path
-            output_path = os.path.splitext(input_path)[0] + '.png'
-            
-            # Save as PNG with transparency
-            try:
-                img.save(output_path, 'PNG')
-                
-                # Verify the file was saved
-                if os.path.exists(output_path):
-                    logging.info(f"Successfully saved PNG file: {output_path}")
-                    return output_path
-                else:
-                    logging.error(f"Failed to save PNG file: {output_path}")
-                    return None
-                    
-            except Exception as e:
-                logging.error(f"Error saving PNG file: {str(e)}")
-                return None
-                
-    except Exception as e:
-        logging.error(f"Error converting image to PNG: {str(e)}")
-        return None
+def render_options(customization):
+    """Save any uploaded images and build the draw_scene styling arguments shared by /generate and /preview"""
+    background_image = None
+    ball_image = None
+    
+    # Check if files were actually uploaded
+    if 'backgroundImage' in request.files:
+        background_file = request.files['backgroundImage']
+        if background_file and background_file.filename:
+            logging.info(f"Processing background image: {background_file.filename}")
+            if not allowed_file(background_file.filename):
+                raise UploadRejected(415, f"Invalid file type: {background_file.filename}")
+            background_image = upload_store.put(background_file, 'background')
+            logging.info(f"Background image saved to: {background_image}")
+    
+    if 'ballImage' in request.files:
+        ball_file = request.files['ballImage']
+        if ball_file and ball_file.filename:
+            logging.info(f"Processing ball image: {ball_file.filename}")
+            if not allowed_file(ball_file.filename):
+                raise UploadRejected(415, f"Invalid file type: {ball_file.filename}")
+            ball_image = upload_store.put(ball_file, 'ball')
+            logging.info(f"Ball image saved to: {ball_image}")
+    
+    return {
+        'line_color': customization.get('lineColor', '#0000ff'),
+        'text_color': customization.get('textColor', '#000000'),
+        'background_image': background_image,
+        'ball_image': ball_image,
+    }
 
-def save_uploaded_file(file, folder):
-    if not file:
-        logging.warning(f"No file provided for folder: {folder}")
+def profile_path_for(kind='render'):
+    if not app.config['RENDER_PROFILE_DIR']:
         return None
-        
-    if not allowed_file(file.filename):
-        logging.warning(f"Invalid file type: {file.filename}")
+    return os.path.join(app.config['RENDER_PROFILE_DIR'],
+                        f"{kind}-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}.prof")
+
+def on_demand_profile(kind):
+    """(profile id, trigger, path) if this request should be profiled on its own, else None"""
+    trigger = profile_store.trigger(request.headers.get(TOKEN_HEADER), request.path)
+    if trigger is None:
         return None
-        
+    profile_id, path = profile_store.reserve(kind)
+    return profile_id, trigger, path
+
+def record_profile(profile, report, estimate):
+    profile_id, trigger, _ = profile
+    if report.profile_path is None:
+        return  # the worker could not write it; already logged there
     try:
-        filename = secure_filename(file.filename)
-        filepath = os.path.join(app.config[folder], filename)
-        
-        # Ensure the directory exists
-        os.makedirs(os.path.dirname(filepath), exist_ok=True)
-        
-        # Save the file
-        file.save(filepath)
-        logging.info(f"Successfully saved file to: {filepath}")
-        
-        # Convert to PNG with transparency if it's a ball image
-        if folder == 'BALL_IMAGES_FOLDER':
-            png_path = convert_to_png_with_transparency(filepath)
-            if png_path and os.path.exists(png_path):
-                logging.info(f"Successfully converted and saved PNG file: {png_path}")
-                # Only remove the original if it's different and the conversion was successful
-                if filepath != png_path and os.path.exists(filepath):
-                    try:
-                        os.remove(filepath)
-                        logging.info(f"Removed original file: {filepath}")
-                    except Exception as e:
-                        logging.warning(f"Could not remove original file {filepath}: {str(e)}")
-                filepath = png_path
-            else:
-                logging.error("Failed to convert image to PNG")
-                return None
-        
-        # Final verification
-        if os.path.exists(filepath):
-            file_size = os.path.getsize(filepath)
-            logging.info(f"Final verification: File exists at {filepath}, size: {file_size} bytes")
-            return filepath
-        else:
-            logging.error(f"Final verification failed: File does not exist at {filepath}")
-            return None
-            
-    except Exception as e:
-        logging.error(f"Error saving file: {str(e)}")
-        logging.error(f"Traceback: {traceback.format_exc()}")
-        return None
+        profile_store.save_metadata(profile_id, dict(
+            report._asdict(),
+            created_at=time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            trigger=trigger,
+            method=request.method,
+            path=request.path,
+            remote_addr=request.remote_addr,
+            form=sorted(request.form.keys()),
+            files=sorted(request.files.keys()),
+            estimate=estimate._asdict() if estimate else None,
+        ))
+        logging.info(f"Stored {trigger} render profile {profile_id}")
+    except OSError as e:
+        logging.error(f"Could not store render profile metadata: {str(e)}")
+
+def video_path(video_id):
+    return os.path.join(app.config['RENDER_OUTPUT_DIR'], f'{video_id}.mp4')
+
+def prune_videos():
+    """Delete rendered videos (and leftover partial renders) older than RENDER_OUTPUT_MAX_AGE"""
+    cutoff = time.time() - app.config['RENDER_OUTPUT_MAX_AGE']
+    try:
+        entries = list(os.scandir(app.config['RENDER_OUTPUT_DIR']))
+    except FileNotFoundError:
+        return
+    for entry in entries:
+        try:
+            if entry.name.endswith('.mp4') and entry.stat().st_mtime < cutoff:
+                os.remove(entry.path)
+        except FileNotFoundError:
+            pass
+
+def log_report(kind, report):
+    logging.info("%s report: total %.2fs, stages %s, %d frames (p95 %.3fs), encoder %.1f fps, peak RSS %s MB (encoder %s MB)",
+                 kind, report.total_seconds, {k: round(v, 3) for k, v in report.stages.items()},
+                 report.frame_count, report.frame_time_p95, report.encoder_fps, report.peak_rss_mb,
+                 report.encoder_peak_rss_mb)
+
+def estimate_request(patterns, scale=1.0, fps=FRAME_RATE):
+    """Cost of rendering `patterns` with the uploaded images, read from headers before anything is saved"""
+    background_pixels = 0
+    background_file = request.files.get('backgroundImage')
+    if background_file and background_file.filename:
+        background_pixels = image_pixels(background_file.stream)
+    return estimate_render_cost(patterns, background_pixels=background_pixels, scale=scale, fps=fps,
+                                coefficients=render_cost_coefficients)
+
+def admission_error(error):
+    response = jsonify({"status": "error", "message": str(error), "estimate": error.estimate._asdict()})
+    response.status_code = error.status_code
+    if error.retry_after:
+        response.headers['Retry-After'] = str(error.retry_after)
+    return response
 
-def generate_animation(patterns, customization):
+def upload_error(error):
+    if isinstance(error, RequestEntityTooLarge):
+        return jsonify({"status": "error", "message": "Upload is too large"}), 413
+    logging.warning(f"Rejected upload: {str(error)}")
+    return jsonify({"status": "error", "message": str(error)}), error.status_code
+
+def generate_animation(patterns, customization, profile=None, estimate=None):
     logging.info("Generating animation with patterns: %s", patterns)
     
     try:
-        # Handle image uploads
-        background_image = None
-        ball_image = None
-        
-        # Check if files were actually uploaded
-        if 'backgroundImage' in request.files:
-            background_file = request.files['backgroundImage']
-            if background_file and background_file.filename:
-                logging.info(f"Processing background image: {background_file.filename}")
-                background_image = save_uploaded_file(background_file, 'BACKGROUND_IMAGES_FOLDER')
-                if not background_image:
-                    raise ValueError("Failed to save background image")
-                logging.info(f"Background image saved to: {background_image}")
+        options = render_options(customization)
         
-        if 'ballImage' in request.files:
-            ball_file = request.files['ballImage']
-            if ball_file and ball_file.filename:
-                logging.info(f"Processing ball image: {ball_file.filename}")
-                ball_image = save_uploaded_file(ball_file, 'BALL_IMAGES_FOLDER')
-                if not ball_image:
-                    raise ValueError("Failed to save ball image")
-                logging.info(f"Ball image saved to: {ball_image}")
+        # Render to a temporary name and rename on success, so /video/<id> never serves a partial file
+        prune_videos()
+        os.makedirs(app.config['RENDER_OUTPUT_DIR'], exist_ok=True)
+        video_id = secrets.token_hex(16)
+        output_path = video_path(video_id)
+        options['output_path'] = f'{output_path[:-4]}.tmp.mp4'
         
         # Generate animation with custom parameters
-        success = draw_scene(
-            patterns=patterns,
-            line_color=customization.get('lineColor', '#0000ff'),
-            text_color=customization.get('textColor', '#000000'),
-            background_image=background_image,
-            ball_image=ball_image
-        )
+        profile_path = profile[2] if profile else profile_path_for()
+        try:
+            success, report = render_pool.render('video', patterns, options, profile_path)
+            if success:
+                os.replace(options['output_path'], output_path)
+        finally:
+            if os.path.exists(options['output_path']):
+                os.remove(options['output_path'])
+        if profile:
+            record_profile(profile, report, estimate)
+        
+        render_metrics.observe(report)
+        log_report("Render", report)
         
         if not success:
             raise Exception("Failed to generate animation")
         
-        logging.info("Animation generated successfully")
-        return True
+        logging.info(f"Animation {video_id} generated successfully")
+        return report, video_id
+    except UploadRejected:
+        raise
     except Exception as e:
         error_message = str(e)
         logging.error("Error generating animation: %s", error_message)
         logging.error("Traceback: %s", traceback.format_exc())
         raise Exception(f"Error generating animation: {error_message}")
 
+def generate_preview(patterns, customization, image_format, profile=None, estimate=None):
+    logging.info("Generating preview with patterns: %s", patterns)
+    
+    try:
+        options = render_options(customization)
+        options['image_format'] = image_format
+        profile_path = profile[2] if profile else profile_path_for('preview')
+        data, report = render_pool.render('preview', patterns, options, profile_path)
+        if profile:
+            record_profile(profile, report, estimate)
+        log_report("Preview", report)
+        
+        if data is None:
+            raise Exception("Failed to generate preview")
+        return data
+    except UploadRejected:
+        raise
+    except Exception as e:
+        error_message = str(e)
+        logging.error("Error generating preview: %s", error_message)
+        logging.error("Traceback: %s", traceback.format_exc())
+        raise Exception(f"Error generating preview: {error_message}")
+
 @app.route('/')
 def index():
     logging.debug("Serving index page")
@@ -196,21 +271,146 @@ def generate():
         patterns = json.loads(request.form['patterns'])
         customization = json.loads(request.form['customization'])
         
-        generate_animation(patterns, customization)
-        return jsonify({"status": "success"})
+        try:
+            estimate = estimate_request(patterns)
+        except ValueError as e:
+            return jsonify({"status": "error", "message": f"Invalid patterns: {str(e)}"}), 400
+        admission.acquire(request.remote_addr, estimate)
+        profile = on_demand_profile('video')
+        try:
+            report, video_id = generate_animation(patterns, customization, profile, estimate)
+        finally:
+            admission.release(estimate)
+        logging.info(f"Render took {report.total_seconds:.1f}s, estimated {estimate.cpu_seconds:.1f}s")
+        body = {"status": "success", "video_id": video_id, "video_url": f"/video/{video_id}",
+                "report": report._asdict(), "estimate": estimate._asdict()}
+        if profile:
+            body["profile_id"] = profile[0]
+        response = jsonify(body)
+        if profile:
+            response.headers['X-Profile-Id'] = profile[0]
+        return response
+    except AdmissionRejected as e:
+        logging.warning(f"Rejected render from {request.remote_addr}: {str(e)}")
+        return admission_error(e)
+    except (UploadRejected, RequestEntityTooLarge) as e:
+        return upload_error(e)
     except Exception as e:
         error_message = str(e)
         logging.error("Error in /generate endpoint: %s", error_message)
         logging.error("Traceback: %s", traceback.format_exc())
         return jsonify({"status": "error", "message": error_message}), 500
 
-@app.route('/video')
-def video():
-    video_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'animation.mp4')
-    logging.debug(f"Attempting to serve video from: {video_path}")
-    if not os.path.exists(video_path):
+@app.route('/preview', methods=['POST'])
+def preview():
+    try:
+        patterns = json.loads(request.form['patterns'])
+        customization = json.loads(request.form['customization'])
+        image_format = request.form.get('format', 'webp').lower()
+        if image_format not in PREVIEW_FORMATS:
+            return jsonify({"status": "error", "message": f"Unsupported preview format: {image_format}"}), 400
+        if not patterns:
+            return jsonify({"status": "error", "message": "Add at least one pattern to preview"}), 400
+        
+        try:
+            estimate = estimate_request([dict(patterns[0], numReps=1)], scale=PREVIEW_SCALE, fps=PREVIEW_FPS)
+        except ValueError as e:
+            return jsonify({"status": "error", "message": f"Invalid patterns: {str(e)}"}), 400
+        admission.acquire(request.remote_addr, estimate)
+        profile = on_demand_profile('preview')
+        try:
+            data = generate_preview(patterns, customization, image_format, profile, estimate)
+        finally:
+            admission.release(estimate)
+        response = send_file(io.BytesIO(data), mimetype=PREVIEW_FORMATS[image_format])
+        if profile:
+            response.headers['X-Profile-Id'] = profile[0]
+        return response
+    except AdmissionRejected as e:
+        return admission_error(e)
+    except (UploadRejected, RequestEntityTooLarge) as e:
+        return upload_error(e)
+    except Exception as e:
+        error_message = str(e)
+        logging.error("Error in /preview endpoint: %s", error_message)
+        return jsonify({"status": "error", "message": error_message}), 500
+
+@app.route('/video/<video_id>')
+def video(video_id):
+    path = video_path(video_id) if VIDEO_ID.match(video_id) else None
+    logging.debug(f"Attempting to serve video from: {path}")
+    if path is None or not os.path.exists(path):
         return jsonify({"status": "error", "message": "Animation file not found"}), 404
-    return send_file(video_path, mimetype='video/mp4')
+    return send_file(path, mimetype='video/mp4')
+
+@app.route('/metrics')
+def metrics():
+    if not app.config['EXPORT_METRICS']:
+        return jsonify({"status": "error", "message": "Metrics export is disabled"}), 404
+    return Response(render_metrics.render_prometheus(), mimetype='text/plain; version=0.0.4')
+
+def require_admin():
+    """404 unless ADMIN_TOKEN is set and sent as X-Admin-Token"""
+    expected = app.config['ADMIN_TOKEN']
+    if not expected or not hmac.compare_digest(request.headers.get('X-Admin-Token', ''), expected):
+        abort(404)
+
+@app.route('/admin/profiles')
+def list_profiles():
+    require_admin()
+    return jsonify({"profiles": profile_store.list(), "armed": profile_store.armed})
+
+@app.route('/admin/profiles/<profile_id>')
+def profile_detail(profile_id):
+    require_admin()
+    sort = request.args.get('sort', 'cumulative')
+    if sort not in ('cumulative', 'tottime', 'calls'):
+        return jsonify({"status": "error", "message": "sort must be cumulative, tottime or calls"}), 400
+    try:
+        limit = int(request.args.get('limit', 40))
+        return jsonify(dict(profile_store.get(profile_id),
+                            summary=profile_store.summary(profile_id, limit=limit, sort=sort)))
+    except KeyError:
+        return jsonify({"status": "error", "message": "Profile not found"}), 404
+    except ValueError:
+        return jsonify({"status": "error", "message": "limit must be an integer"}), 400
+
+@app.route('/admin/profiles/<profile_id>/download')
+def download_profile(profile_id):
+    require_admin()
+    try:
+        path = profile_store.profile_path(profile_id)
+    except KeyError:
+        return jsonify({"status": "error", "message": "Profile not found"}), 404
+    return send_file(path, mimetype='application/octet-stream', as_attachment=True,
+                     download_name=f'{profile_id}.prof')
+
+@app.route('/admin/profiles/arm', methods=['POST'])
+def arm_profiles():
+    """Profile the next `count` renders (0 disarms)"""
+    require_admin()
+    try:
+        count = int(request.form.get('count', 1))
+    except ValueError:
+        return jsonify({"status": "error", "message": "count must be an integer"}), 400
+    return jsonify({"armed": profile_store.arm(count)})
+
+@app.route('/admin/profiles/token', methods=['POST'])
+def profile_token():
+    """An X-Profile-Token for `path`, to hand to whoever can reproduce the slow render"""
+    require_admin()
+    try:
+        token, expires = sign_token(profile_store.secret, request.form.get('path', '/generate'),
+                                    int(request.form.get('ttl', 600)))
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    return jsonify({"token": token, "header": TOKEN_HEADER, "expires": expires})
+
+# Start warming the render workers at import so the first request finds them ready.
+# Pool workers import this module too, and `python app.py` with the debug reloader
+# runs it in a watcher process that never serves requests; neither should fork a pool.
+if multiprocessing.parent_process() is None and (__name__ != '__main__' or os.environ.get('WERKZEUG_RUN_MAIN') == 'true'):
+    render_pool.start_in_background()
 
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5001, debug=True) 
\ No newline at end of file
@@ -0,0 +1,216 @@
+"""Batch rendering of whole exercise libraries.
+
+A manifest lists the pattern sets to render; jobs are spread over a process
+pool whose workers decode each ball/background image once and keep the
+timeline and sprite caches warm across jobs. Outputs are content-addressed,
+so re-running a manifest only renders what changed, and one failing job is
+reported without aborting the rest of the batch.
+
+    python batch_render.py library.json --output-dir renders --workers 4 --report batch-report.json
+
+Manifest format (image paths are relative to the manifest file):
+
+    {
+      "defaults": {"lineColor": "#0000ff", "textColor": "#000000",
+                   "ballImage": "uploads/ball_images/nymera_ball_transparent.png"},
+      "jobs": [
+        {"name": "box-breathing", "patterns": [{"name": "Box", "numReps": 4, "inhaleDuration": 4,
+          "firstHoldDuration": 4, "exhaleDuration": 4, "secondHoldDuration": 4}],
+         "backgroundImage": "uploads/background_images/Warmup_Cover.jpg"}
+      ]
+    }
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+import sys
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from customized_breathing import draw_scene, file_digest, load_ball_sprite, pattern_key, resize_image, warm_renderer
+from render_profiling import RenderProfiler
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_BALL_IMAGE = os.path.join(BASE_DIR, 'uploads', 'ball_images', 'nymera_ball_transparent.png')
+
+# Bump when the renderer output changes so content-addressed outputs are not reused
+OUTPUT_VERSION = 1
+
+BatchJob = namedtuple('BatchJob', ['name', 'patterns', 'line_color', 'text_color', 'ball_image', 'background_image'])
+BatchResult = namedtuple('BatchResult', ['name', 'status', 'output_path', 'digest', 'seconds', 'error', 'stages'])
+
+
+def load_manifest(path):
+    """Read a manifest file into BatchJobs, resolving image paths relative to it"""
+    with open(path) as f:
+        manifest = json.load(f)
+    root = os.path.dirname(os.path.abspath(path))
+    defaults = manifest.get('defaults', {})
+
+    def resolve(image):
+        if not image:
+            return None
+        return image if os.path.isabs(image) else os.path.join(root, image)
+
+    jobs = []
+    for index, entry in enumerate(manifest['jobs']):
+        settings = dict(defaults, **entry)
+        jobs.append(BatchJob(
+            name=settings.get('name', f'job-{index}'),
+            patterns=settings['patterns'],
+            line_color=settings.get('lineColor', '#0000ff'),
+            text_color=settings.get('textColor', '#000000'),
+            ball_image=resolve(settings.get('ballImage')) or DEFAULT_BALL_IMAGE,
+            background_image=resolve(settings.get('backgroundImage')),
+        ))
+    return jobs
+
+
+def job_digest(job):
+    """Content address of a job: everything that affects the rendered pixels"""
+    key = {
+        'version': OUTPUT_VERSION,
+        'patterns': [list(pattern_key(pattern)) for pattern in job.patterns],
+        'line_color': job.line_color.lower(),
+        'text_color': job.text_color.lower(),
+        'ball': file_digest(job.ball_image),
+        'background': file_digest(job.background_image) if job.background_image else None,
+    }
+    return hashlib.blake2b(json.dumps(key, sort_keys=True).encode(), digest_size=16).hexdigest()
+
+
+def output_path_for(output_dir, digest):
+    return os.path.join(output_dir, digest[:2], f'{digest}.mp4')
+
+
+def _init_worker(ball_images, background_images):
+    """Warm a pool worker: imports, font cache and the decoded images every job will share"""
+    logging.basicConfig(level=logging.INFO)
+    logging.getLogger('matplotlib').setLevel(logging.ERROR)
+    warm_renderer()
+
+    for path in ball_images:
+        try:
+            load_ball_sprite(path, file_digest(path))
+        except Exception as e:
+            logging.warning(f"Could not preload ball image {path}: {str(e)}")
+    for path in background_images:
+        try:
+            resize_image(path, 1080, None, file_digest(path))
+        except Exception as e:
+            logging.warning(f"Could not preload background image {path}: {str(e)}")
+
+
+def _render_job(job, output_path):
+    """Render one job in a pool worker and return a plain dict (picklable)"""
+    started = time.perf_counter()
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    # Encode to a temporary name and rename, so an interrupted job never leaves a
+    # truncated file at its content address
+    temp_path = f'{output_path[:-4]}.tmp-{os.getpid()}.mp4'
+    profiler = RenderProfiler()
+    try:
+        success = draw_scene(job.patterns, line_color=job.line_color, text_color=job.text_color,
+                             background_image=job.background_image, ball_image=job.ball_image,
+                             profiler=profiler, output_path=temp_path)
+        if not success:
+            raise RuntimeError("draw_scene reported a failed render")
+        os.replace(temp_path, output_path)
+        return {'status': 'rendered', 'error': None, 'seconds': time.perf_counter() - started,
+                'stages': profiler.report.stages}
+    except Exception as e:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        return {'status': 'failed', 'error': str(e), 'seconds': time.perf_counter() - started,
+                'stages': profiler.report.stages if profiler.report else {}}
+
+
+def render_batch(jobs, output_dir, workers=None, force=False):
+    """Render every BatchJob into `output_dir` and return one BatchResult per job, in job order.
+
+    Jobs whose content address already exists are reported as 'cached' unless
+    `force` is set. Failures are captured per job and never stop the batch.
+    """
+    results = [None] * len(jobs)
+    pending = {}
+    pending_digests = set()
+    for index, job in enumerate(jobs):
+        try:
+            digest = job_digest(job)
+        except Exception as e:
+            results[index] = BatchResult(job.name, 'failed', None, None, 0.0, f"Invalid job: {str(e)}", {})
+            continue
+        path = output_path_for(output_dir, digest)
+        if not force and os.path.exists(path):
+            results[index] = BatchResult(job.name, 'cached', path, digest, 0.0, None, {})
+        elif digest in pending_digests:
+            # Same content as an earlier job in this batch: render it once
+            results[index] = BatchResult(job.name, 'cached', path, digest, 0.0, None, {})
+        else:
+            pending[index] = digest
+            pending_digests.add(digest)
+
+    if pending:
+        ball_images = sorted({jobs[index].ball_image for index in pending})
+        background_images = sorted({jobs[index].background_image for index in pending
+                                    if jobs[index].background_image})
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(ball_images, background_images)) as pool:
+            futures = {
+                pool.submit(_render_job, jobs[index], output_path_for(output_dir, digest)): index
+                for index, digest in pending.items()
+            }
+            for future in as_completed(futures):
+                index = futures[future]
+                job, digest = jobs[index], pending[index]
+                try:
+                    outcome = future.result()
+                except Exception as e:  # worker crashed
+                    outcome = {'status': 'failed', 'error': f"Worker error: {str(e)}", 'seconds': 0.0, 'stages': {}}
+                path = output_path_for(output_dir, digest) if outcome['status'] == 'rendered' else None
+                results[index] = BatchResult(job.name, outcome['status'], path, digest,
+                                             outcome['seconds'], outcome['error'], outcome['stages'])
+                logging.info(f"[{job.name}] {outcome['status']} in {outcome['seconds']:.2f}s"
+                             + (f": {outcome['error']}" if outcome['error'] else ''))
+
+    # Duplicates of a job rendered in this batch share its outcome
+    for index, result in enumerate(results):
+        if result.status == 'cached' and result.digest in pending_digests and not os.path.exists(result.output_path):
+            results[index] = result._replace(status='failed', output_path=None,
+                                             error="Duplicate of a job that failed to render")
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Render a manifest of breathing exercises in one batch")
+    parser.add_argument('manifest', help="JSON manifest of jobs")
+    parser.add_argument('--output-dir', default=os.path.join(BASE_DIR, 'renders'))
+    parser.add_argument('--workers', type=int, default=None, help="process pool size (default: CPU count)")
+    parser.add_argument('--force', action='store_true', help="re-render jobs whose output already exists")
+    parser.add_argument('--report', help="write per-job results to this JSON file")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    started = time.perf_counter()
+    results = render_batch(load_manifest(args.manifest), args.output_dir, args.workers, args.force)
+    elapsed = time.perf_counter() - started
+
+    for result in results:
+        print(f"{result.status:<9} {result.seconds:7.2f}s  {result.name}  "
+              f"{result.output_path or result.error}")
+    counts = {status: sum(1 for result in results if result.status == status)
+              for status in ('rendered', 'cached', 'failed')}
+    print(f"{len(results)} jobs in {elapsed:.1f}s: {counts['rendered']} rendered, "
+          f"{counts['cached']} cached, {counts['failed']} failed")
+
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump({'elapsed_seconds': elapsed, 'jobs': [result._asdict() for result in results]}, f, indent=2)
+    return 1 if counts['failed'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
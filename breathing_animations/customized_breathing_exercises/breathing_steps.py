@@ -0,0 +1,37 @@
+"""Breathing steps of a pattern, shared by the renderer and the group room service.
+
+Kept free of heavy imports so group_rooms.py can compile a room's timeline
+without loading matplotlib, scipy or OpenCV.
+"""
+from collections import namedtuple
+
+BreathingStep = namedtuple('BreathingStep', ['name', 'duration', 'y_start', 'y_end'])
+
+MAX_SCREEN_HEIGHT = 5
+
+def create_breathing_steps(pattern):
+    return [
+        BreathingStep(name="inhale", duration=pattern["inhaleDuration"], y_start=0, y_end=0),
+        BreathingStep(name="hold", duration=pattern["firstHoldDuration"], y_start=0, y_end=0),
+        BreathingStep(name="exhale", duration=pattern["exhaleDuration"], y_start=0, y_end=0),
+        BreathingStep(name="hold", duration=pattern["secondHoldDuration"], y_start=0, y_end=0),
+    ]
+
+def assign_y_coordinates(steps, max_screen_height):
+    max_duration = max(step.duration for step in steps if step.duration > 0)
+    height_scale = max_screen_height / max_duration
+    result = []
+    prev_y_end = 0
+    
+    for i, step in enumerate(steps):
+        if step.name == "inhale":
+            y_end = min(step.duration * height_scale, max_screen_height)
+            result.append(BreathingStep(name=step.name, duration=step.duration, y_start=0, y_end=y_end))
+            prev_y_end = y_end
+        elif step.name == "exhale":
+            result.append(BreathingStep(name=step.name, duration=step.duration, y_start=prev_y_end, y_end=0))
+            prev_y_end = 0
+        elif step.name == "hold":
+            result.append(BreathingStep(name=step.name, duration=step.duration, y_start=prev_y_end, y_end=prev_y_end))
+    
+    return result
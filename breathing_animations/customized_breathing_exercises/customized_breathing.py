@@ -2,11 +2,12 @@ import matplotlib
 matplotlib.use('Agg')  # Set the backend to non-interactive 'Agg'
 import matplotlib.pyplot as plt
 import numpy as np
-import matplotlib.animation as animation
 from matplotlib.image import imread
 from matplotlib.offsetbox import OffsetImage, AnnotationBbox
 from scipy.ndimage import rotate
 import math
+import subprocess
+import time
 import warnings
 import colorsys
 import os
@@ -15,17 +16,29 @@ import logging
 from functools import lru_cache
 from collections import namedtuple
 import cv2  # Add OpenCV for faster image processing
+import hashlib
+import io
+from render_profiling import RenderProfiler, peak_rss_mb
+from render_config import FRAME_RATE, FRAME_RING_SLOTS, PREVIEW_SCALE, PREVIEW_FPS
+from frame_ring import RingProducer
+from breathing_steps import MAX_SCREEN_HEIGHT, BreathingStep, assign_y_coordinates, create_breathing_steps
 
 # Define named tuples for better performance and hashability
-BreathingStep = namedtuple('BreathingStep', ['name', 'duration', 'y_start', 'y_end'])
+Timeline = namedtuple('Timeline', ['steps', 'total_width', 'x_line', 'y_line'])
 
 # Suppress matplotlib warnings about clipping
 warnings.filterwarnings("ignore", category=UserWarning, module="matplotlib.image")
 
 # Animation parameters
-FRAME_RATE = 25
 FRAME_INTERVAL = int(1000 / FRAME_RATE)
-MAX_SCREEN_HEIGHT = 5
+
+# Pre-composited static layers (figure face + background image), memory-mapped per render
+BASE_LAYER_DIR = os.environ.get('BASE_LAYER_DIR',
+                                os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cache', 'base_layers'))
+# Bump when the static layer's appearance changes so stale layers are not reused
+BASE_LAYER_VERSION = 1
+# Least recently used layers beyond this count are deleted (about 8 MB each at full size)
+BASE_LAYER_MAX_FILES = int(os.environ.get('BASE_LAYER_MAX_FILES', 64))
 
 @lru_cache(maxsize=128)
 def hex_to_rgb(hex_color):
@@ -34,9 +47,21 @@ def hex_to_rgb(hex_color):
     rgb = tuple(int(hex_color[i:i+2], 16) for i in (0, 2, 4))
     return tuple(x/255.0 for x in rgb)  # Normalize to [0,1] range
 
+def file_digest(path):
+    """Content hash of a file, used to key caches on what an image contains rather than its name"""
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
 @lru_cache(maxsize=32)
-def resize_image(image_path, target_width, target_height=None):
-    """Resize image while maintaining aspect ratio and transparency using OpenCV for better performance"""
+def resize_image(image_path, target_width, target_height=None, digest=None):
+    """Resize image while maintaining aspect ratio and transparency using OpenCV for better performance
+
+    `digest` is only part of the cache key: pass file_digest(image_path) so a
+    file overwritten under the same name is not served from the cache.
+    """
     try:
         # Read image with OpenCV
         img = cv2.imread(image_path, cv2.IMREAD_UNCHANGED)
@@ -71,32 +96,45 @@ def resize_image(image_path, target_width, target_height=None):
         logging.error(f"Error in resize_image: {str(e)}")
         return None
 
-def create_breathing_steps(pattern):
-    return [
-        BreathingStep(name="inhale", duration=pattern["inhaleDuration"], y_start=0, y_end=0),
-        BreathingStep(name="hold", duration=pattern["firstHoldDuration"], y_start=0, y_end=0),
-        BreathingStep(name="exhale", duration=pattern["exhaleDuration"], y_start=0, y_end=0),
-        BreathingStep(name="hold", duration=pattern["secondHoldDuration"], y_start=0, y_end=0),
-    ]
+def base_layer_key(background_digest, width, height, facecolor):
+    """Cache key of a static layer: background content, output size and figure face colour"""
+    key = f'{BASE_LAYER_VERSION}:{matplotlib.__version__}:{background_digest}:{width}x{height}:{tuple(facecolor)}'
+    return hashlib.blake2b(key.encode(), digest_size=16).hexdigest()
 
-def assign_y_coordinates(steps, max_screen_height):
-    max_duration = max(step.duration for step in steps if step.duration > 0)
-    height_scale = max_screen_height / max_duration
-    result = []
-    prev_y_end = 0
-    
-    for i, step in enumerate(steps):
-        if step.name == "inhale":
-            y_end = min(step.duration * height_scale, max_screen_height)
-            result.append(BreathingStep(name=step.name, duration=step.duration, y_start=0, y_end=y_end))
-            prev_y_end = y_end
-        elif step.name == "exhale":
-            result.append(BreathingStep(name=step.name, duration=step.duration, y_start=prev_y_end, y_end=0))
-            prev_y_end = 0
-        elif step.name == "hold":
-            result.append(BreathingStep(name=step.name, duration=step.duration, y_start=prev_y_end, y_end=prev_y_end))
-    
-    return result
+def load_base_layer(key):
+    """Memory-map a cached RGBA uint8 static layer, or return None"""
+    path = os.path.join(BASE_LAYER_DIR, f'{key}.npy')
+    try:
+        layer = np.load(path, mmap_mode='r')
+        os.utime(path)  # mtime records last use for pruning
+        return layer
+    except (OSError, ValueError):
+        return None
+
+def store_base_layer(key, pixels):
+    """Write a static layer to the cache (atomically) and return it memory-mapped"""
+    path = os.path.join(BASE_LAYER_DIR, f'{key}.npy')
+    try:
+        os.makedirs(BASE_LAYER_DIR, exist_ok=True)
+        temp_path = f'{path}.{os.getpid()}.tmp'
+        with open(temp_path, 'wb') as f:
+            np.save(f, pixels)
+        os.replace(temp_path, path)
+        prune_base_layers()
+        return np.load(path, mmap_mode='r')
+    except OSError as e:
+        logging.error(f"Could not cache base layer {key}: {str(e)}")
+        return pixels
+
+def prune_base_layers(max_files=BASE_LAYER_MAX_FILES):
+    """Delete the least recently used cached layers beyond `max_files`"""
+    entries = [entry for entry in os.scandir(BASE_LAYER_DIR) if entry.name.endswith('.npy')]
+    entries.sort(key=lambda entry: entry.stat().st_mtime, reverse=True)
+    for entry in entries[max_files:]:
+        try:
+            os.remove(entry.path)
+        except FileNotFoundError:
+            pass
 
 def generate_line_coordinates(steps, cycles):
     x_line = []
@@ -112,6 +150,62 @@ def generate_line_coordinates(steps, cycles):
                 y_line.append(step.y_end)
     return np.array(x_line), y_line
 
+def pattern_key(pattern):
+    """Hashable form of the pattern fields that shape the animation"""
+    return (pattern["numReps"], pattern["inhaleDuration"], pattern["firstHoldDuration"],
+            pattern["exhaleDuration"], pattern["secondHoldDuration"])
+
+@lru_cache(maxsize=64)
+def compile_timeline(pattern_keys):
+    """Expand pattern keys into the session's steps and breathing curve"""
+    patterns = [dict(zip(("numReps", "inhaleDuration", "firstHoldDuration", "exhaleDuration", "secondHoldDuration"), key))
+                for key in pattern_keys]
+    total_width = sum(sum(step.duration for step in create_breathing_steps(pattern)) * pattern["numReps"]
+                      for pattern in patterns)
+    all_steps = []
+    for pattern in patterns:
+        steps = create_breathing_steps(pattern)
+        steps = assign_y_coordinates(steps, MAX_SCREEN_HEIGHT)
+        for _ in range(pattern["numReps"]):
+            all_steps.extend(steps)
+    x_line, y_line = generate_line_coordinates(all_steps, 1)
+    y_line = np.array(y_line, dtype=float)
+    # Shared between renders through the cache, so make sure nobody mutates them
+    x_line.flags.writeable = False
+    y_line.flags.writeable = False
+    return Timeline(steps=tuple(all_steps), total_width=total_width, x_line=x_line, y_line=y_line)
+
+def build_timeline(patterns):
+    return compile_timeline(tuple(pattern_key(pattern) for pattern in patterns))
+
+def load_ball_sprite(image_path, digest=None):
+    """Ball image at sprite resolution, normalized to [0,1]"""
+    ball_img = resize_image(image_path, 200, 200, digest)
+    if ball_img is None:
+        raise ValueError("Failed to resize ball image")
+    # Ensure proper normalization
+    if ball_img.max() > 1.0:
+        ball_img = ball_img / 255.0
+    return ball_img
+
+@lru_cache(maxsize=4)
+def rotated_sprites(image_path, digest, count):
+    """Rotation table of `count` ball sprites covering one full turn.
+
+    Keyed on the file digest, so previews and re-renders with the same ball
+    reuse the table instead of redoing the scipy rotations.
+    """
+    ball_img = load_ball_sprite(image_path, digest)
+    ball_rotations = []
+    for angle in np.linspace(0, -360, count):
+        img_rotated = rotate(ball_img, angle, reshape=False)
+        if img_rotated.shape[-1] == 4:
+            rgb = np.clip(img_rotated[..., :3], 0, 1)
+            alpha = img_rotated[..., 3]
+            img_rotated = np.dstack((rgb, alpha))
+        ball_rotations.append(img_rotated)
+    return tuple(ball_rotations)
+
 @lru_cache(maxsize=1024)
 def get_y_at_time(t, cycle_duration, steps_tuple):
     t_cycle = t % cycle_duration
@@ -127,141 +221,375 @@ def get_y_at_time(t, cycle_duration, steps_tuple):
         current_time = step_end
     return steps_tuple[-1].y_end
 
-def draw_scene(patterns, line_color='#0000ff', text_color='#000000', background_image=None, ball_image=None):
+class LineWindow:
+    """Visible slice of the breathing curve at a given playback time.
+
+    The curve's x coordinates are cumulative step boundaries and therefore
+    sorted, so the vertices on screen are found with np.searchsorted and the
+    per-frame cost stays constant however long the session is. Vertices come
+    in (step start, step end) pairs as produced by generate_line_coordinates.
+    """
+
+    def __init__(self, x_line, y_line, half_width, margin=0.1):
+        self.x = np.asarray(x_line, dtype=float)
+        self.y = np.asarray(y_line, dtype=float)
+        self.half_width = half_width + margin
+        # Countdown lookup: end time of every drawn (non-zero) step
+        self.step_ends = self.x[1::2]
+
+    def y_at(self, t, side='right'):
+        """Height of the curve at time t (same interpolation as get_y_at_time)
+
+        Where the curve drops vertically at t, side='right' gives the height
+        after the drop and side='left' the height before it.
+        """
+        j = int(np.searchsorted(self.x, t, side=side)) - 1
+        if j < 0:
+            return self.y[0]
+        if j % 2 or j + 1 >= len(self.x):
+            return self.y[j]
+        duration = self.x[j + 1] - self.x[j]
+        if duration <= 0:
+            return self.y[j]
+        return self.y[j] + (self.y[j + 1] - self.y[j]) * (t - self.x[j]) / duration
+
+    def visible(self, t):
+        """Return the x and y vertices of the curve within t +/- half_width, clipped at the window edges"""
+        x_start = max(t - self.half_width, self.x[0])
+        x_end = min(t + self.half_width, self.x[-1])
+        # Keep every vertex on an edge, so a vertical drop exactly at the edge is drawn, and start
+        # before / end after any such drop
+        lo = int(np.searchsorted(self.x, x_start, side='left'))
+        hi = int(np.searchsorted(self.x, x_end, side='right'))
+        xs = np.empty(hi - lo + 2)
+        ys = np.empty(hi - lo + 2)
+        xs[0], xs[-1] = x_start, x_end
+        xs[1:-1] = self.x[lo:hi]
+        ys[1:-1] = self.y[lo:hi]
+        ys[0] = self.y_at(x_start, side='left')
+        ys[-1] = self.y_at(x_end, side='right')
+        return xs, ys
+
+    def remaining_in_step(self, t):
+        """Seconds left in the step playing at time t, or None past the last step"""
+        index = int(np.searchsorted(self.step_ends, t, side='right'))
+        if index >= len(self.step_ends):
+            return None
+        return self.step_ends[index] - t
+
+def ffmpeg_command(width, height, fps, output_path):
+    """ffmpeg invocation that reads raw RGBA frames from stdin and writes H.264 to `output_path`"""
+    return [
+        matplotlib.rcParams['animation.ffmpeg_path'],
+        '-f', 'rawvideo', '-vcodec', 'rawvideo',
+        '-s', f'{width}x{height}', '-pix_fmt', 'rgba', '-framerate', str(fps),
+        '-loglevel', 'error',
+        '-i', 'pipe:',
+        '-vcodec', 'h264', '-pix_fmt', 'yuv420p',
+        '-preset', 'ultrafast', '-crf', '23', '-threads', 'auto',
+        '-y', output_path,
+    ]
+
+class FFmpegPipe:
+    """Frame sink that streams raw RGBA frames into ffmpeg for H.264 encoding.
+
+    Frame sinks are opened with the canvas size once the figure exists, then
+    receive one RGBA buffer per frame. draw_scene accepts any object with the
+    same open/write/close/abort methods, e.g. the golden-frame recorder.
+    After close(), `metrics` holds ffmpeg's peak RSS.
+    """
+
+    def __init__(self, output_path):
+        self.output_path = output_path
+        self.frame_bytes = 0
+        self.metrics = None
+        self._proc = None
+
+    def open(self, width, height, fps):
+        self.frame_bytes = width * height * 4
+        self._proc = subprocess.Popen(ffmpeg_command(width, height, fps, self.output_path), stdin=subprocess.PIPE,
+                                      stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+
+    def write(self, frame):
+        try:
+            self._proc.stdin.write(frame)
+        except BrokenPipeError:
+            self.close()
+            raise
+
+    def close(self):
+        # ffmpeg's peak after it was sent every frame; flushing the last ones adds little with -preset ultrafast
+        self.metrics = {'encoder_peak_rss_mb': peak_rss_mb(self._proc.pid)}
+        _, err = self._proc.communicate()
+        if self._proc.returncode:
+            raise RuntimeError(f"ffmpeg exited with {self._proc.returncode}: {err.decode(errors='replace')}")
+
+    def abort(self):
+        if self._proc is not None and self._proc.poll() is None:
+            self._proc.kill()
+            self._proc.communicate()
+
+class FFmpegRingSink:
+    """Frame sink that hands frames to an encoder process through a shared-memory ring (see frame_ring.py).
+
+    write() returns as soon as the frame is copied into a free slot, so the
+    next frame renders while the encoder process feeds ffmpeg. After close(),
+    `metrics` holds per-side throughput and wait times and the encoder's peak RSS.
+    """
+
+    def __init__(self, output_path, slots=FRAME_RING_SLOTS):
+        self.output_path = output_path
+        self.slots = slots
+        self.frame_bytes = 0
+        self.metrics = None
+        self._producer = None
+
+    def open(self, width, height, fps):
+        self.frame_bytes = width * height * 4
+        self._producer = RingProducer(self.frame_bytes, self.slots,
+                                      ffmpeg_command(width, height, fps, self.output_path))
+
+    def write(self, frame):
+        self._producer.write(frame)
+
+    def close(self):
+        self.metrics = self._producer.close()
+
+    def abort(self):
+        if self._producer is not None:
+            self._producer.abort()
+
+def video_sink(output_path):
+    """The default MP4 sink for draw_scene"""
+    if FRAME_RING_SLOTS > 0:
+        return FFmpegRingSink(output_path)
+    return FFmpegPipe(output_path)
+
+class AnimatedImageSink:
+    """Frame sink that collects frames into an animated WebP or GIF held in memory"""
+
+    def __init__(self, image_format='webp'):
+        self.image_format = image_format
+        self.frame_bytes = 0
+        self.data = None
+        self._frames = []
+
+    def open(self, width, height, fps):
+        self.size = (width, height)
+        self.frame_bytes = width * height * 4
+        self._duration_ms = int(round(1000 / fps))
+
+    def write(self, frame):
+        self._frames.append(Image.frombuffer('RGBA', self.size, frame, 'raw', 'RGBA', 0, 1).convert('RGB'))
+
+    def close(self):
+        buffer = io.BytesIO()
+        options = {'quality': 70, 'method': 0} if self.image_format == 'webp' else {'optimize': False}
+        self._frames[0].save(buffer, format=self.image_format.upper(), save_all=True,
+                             append_images=self._frames[1:], duration=self._duration_ms, loop=0, **options)
+        self.data = buffer.getvalue()
+        self._frames = []
+
+    def abort(self):
+        self._frames = []
+
+def warm_renderer():
+    """Pay the one-off font cache, glyph and Agg setup costs by drawing a throwaway full-size figure"""
+    dpi = 200
+    fig, ax = plt.subplots(figsize=(1080 / dpi, 1920 / dpi), dpi=dpi)
+    ax.axis('off')
+    ax.plot([0, 1], [0, 1], linewidth=2)
+    ax.add_artist(AnnotationBbox(OffsetImage(np.zeros((8, 8, 4), dtype=np.float32), zoom=0.2), (0.5, 0.5),
+                                 frameon=False, pad=0.0))
+    ax.text(0.5, 0.5, '0123456789s', fontsize=12, fontweight='bold')
+    fig.canvas.draw()
+    fig.canvas.buffer_rgba()
+    plt.close(fig)
+
+def draw_preview(patterns, line_color='#0000ff', text_color='#000000', background_image=None, ball_image=None,
+                 image_format='webp', profiler=None):
+    """Render one cycle of the first pattern as a small animated image and return its bytes, or None on failure"""
+    if not patterns:
+        return None
+    preview_patterns = [dict(patterns[0], numReps=1)]
+    sink = AnimatedImageSink(image_format)
+    success = draw_scene(preview_patterns, line_color=line_color, text_color=text_color,
+                         background_image=background_image, ball_image=ball_image,
+                         profiler=profiler, frame_sink=sink, scale=PREVIEW_SCALE, fps=PREVIEW_FPS)
+    return sink.data if success else None
+
+def draw_scene(patterns, line_color='#0000ff', text_color='#000000', background_image=None, ball_image=None,
+               profiler=None, frame_sink=None, scale=1.0, fps=FRAME_RATE, output_path="animation.mp4"):
+    """Render the breathing animation to `output_path` (animation.mp4 by default).
+
+    Returns True on success. Pass a RenderProfiler to get per-stage timings,
+    the per-frame histogram and encoder throughput back in `profiler.report`,
+    and a frame sink to receive the RGBA frames instead of the MP4 encoder.
+    `scale` and `fps` reduce resolution and frame rate for draft previews.
+    """
+    profiler = profiler if profiler is not None else RenderProfiler()
+    profiler.start()
+    encoder = frame_sink if frame_sink is not None else video_sink(output_path)
     try:
-        # Set up the figure and axis
-        dpi = 200
-        fig_width = 1080 / dpi
-        fig_height = 1920 / dpi
-        fig, ax = plt.subplots(figsize=(fig_width, fig_height), dpi=dpi)
-        
-        # Calculate dimensions for 16:9 aspect ratio
-        TOTAL_WIDTH = sum(sum(step.duration for step in create_breathing_steps(pattern)) * pattern["numReps"] 
-                         for pattern in patterns)
-        BALL_X_CENTER = TOTAL_WIDTH / 2
-        x_half_width = 5.4 / 2
-        
-        # Set up the plot
-        ax.set_xlim(BALL_X_CENTER - x_half_width, BALL_X_CENTER + x_half_width)
-        ax.set_ylim(-1, 8.6)
-        ax.set_aspect('equal')
-        ax.set_xticks([])
-        ax.set_yticks([])
-        ax.axis('off')
+        with profiler.span('setup'):
+            # Set up the figure and axis
+            dpi = 200
+            fig_width = 1080 / dpi
+            fig_height = 1920 / dpi
+            fig, ax = plt.subplots(figsize=(fig_width, fig_height), dpi=dpi * scale)
+            
+            # Calculate dimensions for 16:9 aspect ratio
+            timeline = build_timeline(patterns)
+            TOTAL_WIDTH = timeline.total_width
+            BALL_X_CENTER = TOTAL_WIDTH / 2
+            x_half_width = 5.4 / 2
+            
+            # Set up the plot
+            ax.set_xlim(BALL_X_CENTER - x_half_width, BALL_X_CENTER + x_half_width)
+            ax.set_ylim(-1, 8.6)
+            ax.set_aspect('equal')
+            ax.set_xticks([])
+            ax.set_yticks([])
+            ax.axis('off')
         
-        # Load and display background image if provided
-        if background_image and os.path.exists(background_image):
+        # Load ball image
+        with profiler.span('load_ball'):
             try:
-                bg_img = resize_image(background_image, 1080)
-                if bg_img is not None:
-                    # Ensure proper normalization
-                    if bg_img.max() > 1.0:
-                        bg_img = bg_img / 255.0
-                    ax.imshow(bg_img, extent=[BALL_X_CENTER - x_half_width, BALL_X_CENTER + x_half_width, -1, 8.6], 
-                             aspect='auto', zorder=0)
+                if ball_image and os.path.exists(ball_image):
+                    ball_digest = file_digest(ball_image)
+                    ball_img = load_ball_sprite(ball_image, ball_digest)
+                else:
+                    logging.error(f"Ball image not found at: {ball_image}")
+                    plt.close(fig)
+                    profiler.finish(success=False)
+                    return False
             except Exception as e:
-                logging.error(f"Error loading background image: {str(e)}")
-        
-        # Load ball image
-        try:
-            if ball_image and os.path.exists(ball_image):
-                ball_img = resize_image(ball_image, 200, 200)
-                if ball_img is None:
-                    raise ValueError("Failed to resize ball image")
-                # Ensure proper normalization
-                if ball_img.max() > 1.0:
-                    ball_img = ball_img / 255.0
-            else:
-                logging.error(f"Ball image not found at: {ball_image}")
+                logging.error(f"Error loading ball image: {str(e)}")
+                plt.close(fig)
+                profiler.finish(success=False)
                 return False
-        except Exception as e:
-            logging.error(f"Error loading ball image: {str(e)}")
-            return False
-        
-        # Create the ball image box with transparency
-        imagebox = OffsetImage(ball_img, zoom=0.2)
-        imagebox.image.axes = ax
-        ab = AnnotationBbox(imagebox, (BALL_X_CENTER, 0), frameon=False, pad=0.0)
-        ax.add_artist(ab)
         
-        # Generate line coordinates
-        all_steps = []
-        for pattern in patterns:
-            steps = create_breathing_steps(pattern)
-            steps = assign_y_coordinates(steps, MAX_SCREEN_HEIGHT)
-            for _ in range(pattern["numReps"]):
-                all_steps.extend(steps)
-        
-        x_line_base, y_line = generate_line_coordinates(all_steps, 1)
-        line_rgb = hex_to_rgb(line_color)
-        text_rgb = hex_to_rgb(text_color)
-        
-        line, = ax.plot(x_line_base, y_line, color=line_rgb, linewidth=2)
-        timer_text = ax.text(BALL_X_CENTER, MAX_SCREEN_HEIGHT + 0.5, '3s',
-                           horizontalalignment='center',
-                           verticalalignment='center',
-                           fontsize=12,
-                           fontweight='bold',
-                           color=text_rgb)
-        
-        TOTAL_FRAMES = int(TOTAL_WIDTH * FRAME_RATE)
+        with profiler.span('setup'):
+            # Create the ball image box with transparency
+            imagebox = OffsetImage(ball_img, zoom=0.2)
+            imagebox.image.axes = ax
+            ab = AnnotationBbox(imagebox, (BALL_X_CENTER, 0), frameon=False, pad=0.0)
+            ax.add_artist(ab)
+            
+            line_window = LineWindow(timeline.x_line, timeline.y_line, x_half_width)
+            line_rgb = hex_to_rgb(line_color)
+            text_rgb = hex_to_rgb(text_color)
+            
+            x_visible, y_visible = line_window.visible(0)
+            line, = ax.plot(x_visible + BALL_X_CENTER, y_visible, color=line_rgb, linewidth=2)
+            timer_text = ax.text(BALL_X_CENTER, MAX_SCREEN_HEIGHT + 0.5, '3s',
+                               horizontalalignment='center',
+                               verticalalignment='center',
+                               fontsize=12,
+                               fontweight='bold',
+                               color=text_rgb)
+            
+            TOTAL_FRAMES = int(TOTAL_WIDTH * fps)
+            
+            # Only the line, ball and timer change between frames. Marking them
+            # animated keeps them out of the full draw that paints the static layer.
+            dynamic_artists = (line, ab, timer_text)
+            for artist in dynamic_artists:
+                artist.set_animated(True)
+            width, height = fig.canvas.get_width_height()
         
-        # Pre-calculate rotation angles for the ball
-        rotation_angles = np.linspace(0, -360, TOTAL_FRAMES // 4)
+        # The static layer (figure face plus background image) is composited once
+        # and cached as an RGBA frame keyed by the background's content, so a
+        # known background is neither decoded, resized nor resampled again
+        base_layer = None
+        layer_key = None
+        if background_image and os.path.exists(background_image):
+            with profiler.span('load_background'):
+                try:
+                    layer_key = base_layer_key(file_digest(background_image), width, height, fig.get_facecolor())
+                    base_layer = load_base_layer(layer_key)
+                    if base_layer is not None:
+                        # imshow(aspect='auto') below also relaxes the axes aspect, which moves the line
+                        ax.set_aspect('auto')
+                    else:
+                        bg_img = resize_image(background_image, int(1080 * scale), None, file_digest(background_image))
+                        if bg_img is not None:
+                            # Ensure proper normalization
+                            if bg_img.max() > 1.0:
+                                bg_img = bg_img / 255.0
+                            ax.imshow(bg_img, extent=[BALL_X_CENTER - x_half_width, BALL_X_CENTER + x_half_width, -1, 8.6], 
+                                     aspect='auto', zorder=0)
+                        else:
+                            layer_key = None
+                except Exception as e:
+                    logging.error(f"Error loading background image: {str(e)}")
+                    layer_key = None
         
-        # Convert steps to tuple for caching
-        steps_tuple = tuple(all_steps)
+        with profiler.span('setup'):
+            # Lays out the axes and paints the static artists into the canvas buffer
+            fig.canvas.draw()
+            canvas_pixels = np.asarray(fig.canvas.buffer_rgba())
+            if base_layer is None:
+                base_layer = canvas_pixels.copy()
+                if layer_key is not None:
+                    base_layer = store_base_layer(layer_key, base_layer)
         
         # Pre-calculate ball rotations for better performance
-        ball_rotations = []
-        for angle in rotation_angles:
-            img_rotated = rotate(ball_img, angle, reshape=False)
-            if img_rotated.shape[-1] == 4:
-                rgb = np.clip(img_rotated[..., :3], 0, 1)
-                alpha = img_rotated[..., 3]
-                img_rotated = np.dstack((rgb, alpha))
-            ball_rotations.append(img_rotated)
+        with profiler.span('rotate_sprites'):
+            ball_rotations = rotated_sprites(ball_image, ball_digest, max(1, TOTAL_FRAMES // 4))
         
         def update(frame):
-            t = frame / FRAME_RATE
-            y_at_t = get_y_at_time(t, TOTAL_WIDTH, steps_tuple)
-            ab.xybox = (BALL_X_CENTER, y_at_t)
+            t = frame / fps
+            t_line = t % TOTAL_WIDTH
+            ab.xybox = (BALL_X_CENTER, line_window.y_at(t_line))
             
             # Use pre-calculated rotation
             imagebox.image.set_array(ball_rotations[frame % len(ball_rotations)])
             
-            # Update line position
-            shift = BALL_X_CENTER - (t % TOTAL_WIDTH)
-            x_line_shifted = x_line_base + shift
-            line.set_data(x_line_shifted, y_line)
+            # Update line position, handing matplotlib only the visible vertices
+            shift = BALL_X_CENTER - t_line
+            x_visible, y_visible = line_window.visible(t_line)
+            line.set_data(x_visible + shift, y_visible)
             
             # Update countdown timer
-            current_time = 0
-            for step in all_steps:
-                step_end = current_time + step.duration
-                if current_time <= t < step_end:
-                    remaining_time = step_end - t
-                    countdown = math.ceil(remaining_time) if remaining_time > 0 else 1
-                    timer_text.set_text(f'{countdown}s')
-                    break
-                current_time = step_end
+            remaining_time = line_window.remaining_in_step(t)
+            if remaining_time is not None:
+                countdown = math.ceil(remaining_time) if remaining_time > 0 else 1
+                timer_text.set_text(f'{countdown}s')
             
             return line, ab, timer_text
         
-        # Use blit=True for faster animation and cache frames
-        ani = animation.FuncAnimation(fig, update, frames=TOTAL_FRAMES,
-                                    interval=FRAME_INTERVAL, blit=True, cache_frame_data=True)
-        
-        # Use ffmpeg with optimized settings for faster encoding
-        ani.save("animation.mp4", writer="ffmpeg", fps=FRAME_RATE,
-                extra_args=['-preset', 'ultrafast', '-crf', '23', '-threads', 'auto'])
+        # Drive the frames ourselves so update, Agg rasterization and encoding
+        # can be timed separately; frames go straight from the canvas buffer
+        # into the sink (ffmpeg by default)
+        with profiler.span('encode'):
+            encoder.open(width, height, fps)
+        for frame in range(TOTAL_FRAMES):
+            frame_started = time.perf_counter()
+            with profiler.span('update'):
+                update(frame)
+            with profiler.span('rasterize'):
+                # Blit the static layer, then draw only what moves on top of it
+                np.copyto(canvas_pixels, base_layer)
+                for artist in dynamic_artists:
+                    ax.draw_artist(artist)
+                buffer = fig.canvas.buffer_rgba()
+            with profiler.span('encode'):
+                encoder.write(buffer)
+            profiler.record_frame(time.perf_counter() - frame_started, encoder.frame_bytes)
+        with profiler.span('encode'):
+            encoder.close()
+        profiler.sink_metrics = getattr(encoder, 'metrics', None)
         plt.close(fig)
+        profiler.finish(success=True)
         return True
         
     except Exception as e:
         logging.error(f"Error generating animation: {e}")
+        encoder.abort()
         if 'fig' in locals():
             plt.close(fig)
+        profiler.finish(success=False)
         return False
 
 if __name__ == '__main__':
@@ -0,0 +1,201 @@
+"""Shared-memory ring of RGBA frame slots between a renderer and an encoder process.
+
+The renderer copies each canvas buffer into the next free slot and moves on;
+a separate encoder process writes filled slots straight from shared memory
+into ffmpeg's stdin, so rendering and encoding run on different cores and
+frames are never pickled or copied through Python objects.
+
+Slot bookkeeping lives in a small header at the start of the segment: the
+producer's sequence number (frames published) and the consumer's (frames
+handed to ffmpeg), plus the consumer's timing counters and, at the end,
+ffmpeg's peak RSS. Slot `n % slots` holds frame `n`. Each side only waits
+when it must (ring full / ring empty), blocking on one-byte doorbell and ack
+pipes instead of spinning.
+
+This module only needs NumPy (producer side) and render_profiling, so the
+encoder process starts without importing the renderer.
+"""
+import json
+import os
+import struct
+import subprocess
+import sys
+import time
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+from render_profiling import peak_rss_mb
+
+# producer_seq, consumer_seq, consumer_wait_seconds, consumer_write_seconds, encoder_peak_rss_mb
+HEADER = struct.Struct('<QQddd')
+HEADER_SIZE = 64
+SLOT_ALIGNMENT = 64
+
+
+def slot_stride(frame_bytes):
+    return -(-frame_bytes // SLOT_ALIGNMENT) * SLOT_ALIGNMENT
+
+
+class FrameRing:
+    """Fixed-size frame slots plus sequence counters in one shared memory segment"""
+
+    def __init__(self, shm, frame_bytes, slots):
+        self.shm = shm
+        self.frame_bytes = frame_bytes
+        self.slots = slots
+        self.stride = slot_stride(frame_bytes)
+
+    @classmethod
+    def create(cls, frame_bytes, slots):
+        shm = shared_memory.SharedMemory(create=True, size=HEADER_SIZE + slot_stride(frame_bytes) * slots)
+        HEADER.pack_into(shm.buf, 0, 0, 0, 0.0, 0.0, 0.0)
+        return cls(shm, frame_bytes, slots)
+
+    @classmethod
+    def attach(cls, name, frame_bytes, slots):
+        try:
+            shm = shared_memory.SharedMemory(name=name, track=False)
+        except TypeError:  # Python < 3.13 always tracks, and would unlink the creator's segment on exit
+            shm = shared_memory.SharedMemory(name=name)
+            resource_tracker.unregister(shm._name, 'shared_memory')
+        return cls(shm, frame_bytes, slots)
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def header(self):
+        return HEADER.unpack_from(self.shm.buf, 0)
+
+    def publish(self, producer_seq):
+        struct.pack_into('<Q', self.shm.buf, 0, producer_seq)
+
+    def consume(self, consumer_seq, wait_seconds, write_seconds):
+        struct.pack_into('<Qdd', self.shm.buf, 8, consumer_seq, wait_seconds, write_seconds)
+
+    def report_peak_rss(self, megabytes):
+        struct.pack_into('<d', self.shm.buf, 32, megabytes)
+
+    def offset(self, seq):
+        return HEADER_SIZE + (seq % self.slots) * self.stride
+
+    def close(self, unlink=False):
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
+
+
+class RingProducer:
+    """Renderer side: starts the encoder process and writes frames into free slots"""
+
+    def __init__(self, frame_bytes, slots, command):
+        self.ring = FrameRing.create(frame_bytes, slots)
+        self._slots = np.ndarray((slots, self.ring.stride), dtype=np.uint8, buffer=self.ring.shm.buf, offset=HEADER_SIZE)
+        self.published = 0
+        self.wait_seconds = 0.0
+        self.copy_seconds = 0.0
+        self._started = time.perf_counter()
+        self._proc = subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), 'encode', self.ring.name,
+             str(frame_bytes), str(slots), json.dumps(command)],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        self._doorbell = self._proc.stdin.fileno()
+        self._acks = self._proc.stdout.fileno()
+
+    def write(self, frame):
+        started = time.perf_counter()
+        # Ring full: wait for the encoder to free a slot
+        while self.published - self.ring.header()[1] >= self.ring.slots:
+            if not os.read(self._acks, 65536):
+                raise self._encoder_failed()
+        copied = time.perf_counter()
+        self.wait_seconds += copied - started
+
+        np.copyto(self._slots[self.published % self.ring.slots, :self.ring.frame_bytes],
+                  np.asarray(frame, dtype=np.uint8).reshape(-1))
+        self.published += 1
+        self.ring.publish(self.published)
+        try:
+            os.write(self._doorbell, b'.')
+        except BrokenPipeError:
+            raise self._encoder_failed()
+        self.copy_seconds += time.perf_counter() - copied
+
+    def _encoder_failed(self):
+        self._proc.wait()
+        err = self._proc.stderr.read().decode(errors='replace')
+        return RuntimeError(f"Frame encoder exited early with {self._proc.returncode}: {err}")
+
+    def close(self):
+        """Wait for every published frame to be encoded; returns the throughput metrics"""
+        producer_seconds = time.perf_counter() - self._started
+        _, err = self._proc.communicate()
+        _, consumed, consumer_wait, consumer_write, encoder_rss = self.ring.header()
+        self._release()
+        if self._proc.returncode:
+            raise RuntimeError(f"Frame encoder exited with {self._proc.returncode}: {err.decode(errors='replace')}")
+        return {
+            'slots': self.ring.slots,
+            'frames': consumed,
+            'producer_wait_seconds': self.wait_seconds,
+            'producer_copy_seconds': self.copy_seconds,
+            'producer_fps': self.published / producer_seconds if producer_seconds else 0.0,
+            'consumer_wait_seconds': consumer_wait,
+            'consumer_write_seconds': consumer_write,
+            'consumer_fps': consumed / consumer_write if consumer_write else 0.0,
+            'encoder_peak_rss_mb': encoder_rss or None,
+        }
+
+    def abort(self):
+        if self._proc.poll() is None:
+            self._proc.kill()
+        self._proc.communicate()
+        self._release()
+
+    def _release(self):
+        if self._slots is not None:
+            self._slots = None  # the segment cannot close while a view of it exists
+            self.ring.close(unlink=True)
+
+
+def run_encoder(name, frame_bytes, slots, command):
+    """Encoder side: feed published slots to `command` (ffmpeg) until the producer hangs up"""
+    ring = FrameRing.attach(name, frame_bytes, slots)
+    ffmpeg = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL)
+    doorbell = sys.stdin.fileno()
+    acks = sys.stdout.fileno()
+    consumed = 0
+    wait_seconds = 0.0
+    write_seconds = 0.0
+    try:
+        while True:
+            started = time.perf_counter()
+            rung = os.read(doorbell, 65536)
+            wait_seconds += time.perf_counter() - started
+            published = ring.header()[0]
+            while consumed < published:
+                started = time.perf_counter()
+                offset = ring.offset(consumed)
+                with ring.shm.buf[offset:offset + frame_bytes] as frame:
+                    ffmpeg.stdin.write(frame)
+                write_seconds += time.perf_counter() - started
+                consumed += 1
+                ring.consume(consumed, wait_seconds, write_seconds)
+                os.write(acks, b'.')
+            if not rung:
+                break
+        # ffmpeg's peak after it was sent every frame (see render_profiling.peak_rss_mb)
+        ring.report_peak_rss(peak_rss_mb(ffmpeg.pid) or 0.0)
+        ffmpeg.stdin.close()
+        return ffmpeg.wait()
+    except BrokenPipeError:
+        return ffmpeg.wait() or 1
+    finally:
+        ring.close()
+
+if __name__ == '__main__':
+    if len(sys.argv) != 6 or sys.argv[1] != 'encode':
+        print("usage: python frame_ring.py encode <shm name> <frame bytes> <slots> <command json>", file=sys.stderr)
+        sys.exit(2)
+    sys.exit(run_encoder(sys.argv[2], int(sys.argv[3]), int(sys.argv[4]), json.loads(sys.argv[5])))
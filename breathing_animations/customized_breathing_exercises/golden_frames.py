@@ -0,0 +1,347 @@
+"""Golden-frame regression harness for draw_scene.
+
+Renders a fixed set of reference patterns, captures every RGBA frame through
+a frame sink and stores a checksum plus a downscaled thumbnail per frame.
+Candidate renderers (anything with draw_scene's signature) are then compared
+frame by frame: identical checksums pass outright, otherwise the thumbnails
+must stay within the PSNR/SSIM thresholds. `check` also compares the
+line's visible window (LineWindow) in every frame against clipping the full
+breathing curve, which needs no goldens.
+
+    python golden_frames.py record
+    python golden_frames.py check
+    python golden_frames.py check --renderer my_module:fast_draw_scene --report diff.json
+"""
+import argparse
+import hashlib
+import importlib
+import json
+import logging
+import math
+import os
+import sys
+
+import cv2
+import matplotlib
+import numpy as np
+
+from customized_breathing import LineWindow, build_timeline, draw_scene
+from render_config import FRAME_RATE
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+GOLDEN_DIR = os.path.join(BASE_DIR, 'golden_frames')
+BALL_IMAGE = os.path.join(BASE_DIR, 'uploads', 'ball_images', 'nymera_ball_transparent.png')
+BACKGROUND_IMAGE = os.path.join(BASE_DIR, 'uploads', 'background_images', 'Warmup_Cover.jpg')
+
+# Thumbnails are stored at 1/THUMBNAIL_SCALE of the frame size
+THUMBNAIL_SCALE = 4
+PSNR_THRESHOLD = 40.0
+SSIM_THRESHOLD = 0.98
+
+# Reference sessions covering the paths draw_scene takes: a plain box
+# pattern, uneven durations with a skipped hold, several patterns back to back,
+# a custom background with non-default colours, a zero exhale (a vertical drop
+# in the line) and a long session of over 1000 frames mixing zero holds and
+# zero exhales
+REFERENCE_CASES = {
+    'box': {
+        'patterns': [
+            {"name": "Box", "numReps": 1, "inhaleDuration": 1, "firstHoldDuration": 1,
+             "exhaleDuration": 1, "secondHoldDuration": 1},
+        ],
+        'ball_image': BALL_IMAGE,
+    },
+    'uneven_no_hold': {
+        'patterns': [
+            {"name": "Relax", "numReps": 2, "inhaleDuration": 1, "firstHoldDuration": 0,
+             "exhaleDuration": 1.5, "secondHoldDuration": 0.5},
+        ],
+        'ball_image': BALL_IMAGE,
+    },
+    'multi_pattern': {
+        'patterns': [
+            {"name": "Warmup", "numReps": 1, "inhaleDuration": 0.5, "firstHoldDuration": 0.5,
+             "exhaleDuration": 0.5, "secondHoldDuration": 0.5},
+            {"name": "Deep", "numReps": 1, "inhaleDuration": 1.5, "firstHoldDuration": 0.5,
+             "exhaleDuration": 1, "secondHoldDuration": 0},
+        ],
+        'ball_image': BALL_IMAGE,
+    },
+    'background_colors': {
+        'patterns': [
+            {"name": "Box", "numReps": 1, "inhaleDuration": 1, "firstHoldDuration": 0.5,
+             "exhaleDuration": 1, "secondHoldDuration": 0.5},
+        ],
+        'line_color': '#ff6600',
+        'text_color': '#ffffff',
+        'background_image': BACKGROUND_IMAGE,
+        'ball_image': BALL_IMAGE,
+    },
+    'zero_exhale': {
+        'patterns': [
+            # At 25 fps, window edges land exactly on the drops in frames 115 and 155
+            {"name": "Sigh", "numReps": 2, "inhaleDuration": 2.4, "firstHoldDuration": 1,
+             "exhaleDuration": 0, "secondHoldDuration": 0.6},
+        ],
+        'ball_image': BALL_IMAGE,
+    },
+    'long_session': {
+        'patterns': [
+            {"name": "Calm", "numReps": 3, "inhaleDuration": 4, "firstHoldDuration": 0,
+             "exhaleDuration": 6, "secondHoldDuration": 2},
+            {"name": "Sigh", "numReps": 2, "inhaleDuration": 2.5, "firstHoldDuration": 3,
+             "exhaleDuration": 0, "secondHoldDuration": 1},
+        ],
+        'ball_image': BALL_IMAGE,
+    },
+}
+
+
+class FrameRecorder:
+    """Frame sink that keeps a checksum and an RGB thumbnail of every frame"""
+
+    def __init__(self, thumbnail_scale=THUMBNAIL_SCALE):
+        self.thumbnail_scale = thumbnail_scale
+        self.checksums = []
+        self.thumbnails = []
+        self.frame_bytes = 0
+        self.size = None
+
+    def open(self, width, height, fps):
+        self.size = (width, height)
+        self.frame_bytes = width * height * 4
+        self._thumbnail_size = (max(1, width // self.thumbnail_scale), max(1, height // self.thumbnail_scale))
+
+    def write(self, frame):
+        self.checksums.append(hashlib.blake2b(frame, digest_size=16).hexdigest())
+        rgb = np.asarray(frame)[..., :3]
+        self.thumbnails.append(cv2.resize(rgb, self._thumbnail_size, interpolation=cv2.INTER_AREA))
+
+    def close(self):
+        pass
+
+    def abort(self):
+        pass
+
+
+def psnr(a, b):
+    """Peak signal-to-noise ratio in dB between two uint8 images (inf when identical)"""
+    mse = np.mean((a.astype(np.float64) - b.astype(np.float64)) ** 2)
+    if mse == 0:
+        return math.inf
+    return 10 * math.log10(255.0 ** 2 / mse)
+
+
+def ssim(a, b):
+    """Mean structural similarity of two RGB uint8 images, computed on luma with an 11x11 Gaussian window"""
+    a = cv2.cvtColor(a, cv2.COLOR_RGB2GRAY).astype(np.float64)
+    b = cv2.cvtColor(b, cv2.COLOR_RGB2GRAY).astype(np.float64)
+    c1 = (0.01 * 255) ** 2
+    c2 = (0.03 * 255) ** 2
+
+    def blur(x):
+        return cv2.GaussianBlur(x, (11, 11), 1.5)
+
+    mu_a, mu_b = blur(a), blur(b)
+    var_a = blur(a * a) - mu_a * mu_a
+    var_b = blur(b * b) - mu_b * mu_b
+    covar = blur(a * b) - mu_a * mu_b
+    ssim_map = ((2 * mu_a * mu_b + c1) * (2 * covar + c2)) / \
+        ((mu_a * mu_a + mu_b * mu_b + c1) * (var_a + var_b + c2))
+    return float(ssim_map.mean())
+
+
+def pack_thumbnails(thumbnails):
+    """Delta-encode consecutive thumbnails (mod 256) so static layers compress to almost nothing"""
+    stack = np.stack(thumbnails)
+    deltas = stack.copy()
+    deltas[1:] -= stack[:-1]
+    return deltas
+
+
+def unpack_thumbnails(deltas):
+    return np.cumsum(deltas, axis=0, dtype=np.uint8)
+
+
+def capture(renderer, case):
+    """Render one reference case with `renderer` and return its FrameRecorder"""
+    recorder = FrameRecorder()
+    success = renderer(
+        patterns=case['patterns'],
+        line_color=case.get('line_color', '#0000ff'),
+        text_color=case.get('text_color', '#000000'),
+        background_image=case.get('background_image'),
+        ball_image=case.get('ball_image'),
+        frame_sink=recorder,
+    )
+    if not success:
+        raise RuntimeError("Renderer reported a failed render")
+    return recorder
+
+
+def record_goldens(renderer=draw_scene, golden_dir=GOLDEN_DIR, cases=None):
+    """Store checksums (<case>.json, committed) and thumbnails (<case>.npz, local) for each reference case"""
+    os.makedirs(golden_dir, exist_ok=True)
+    for name in cases or REFERENCE_CASES:
+        recorder = capture(renderer, REFERENCE_CASES[name])
+        np.savez_compressed(os.path.join(golden_dir, f'{name}.npz'),
+                            thumbnail_deltas=pack_thumbnails(recorder.thumbnails))
+        with open(os.path.join(golden_dir, f'{name}.json'), 'w') as f:
+            json.dump({
+                'case': name,
+                'frame_count': len(recorder.checksums),
+                'width': recorder.size[0],
+                'height': recorder.size[1],
+                'thumbnail_scale': recorder.thumbnail_scale,
+                'matplotlib': matplotlib.__version__,
+                'checksums': recorder.checksums,
+            }, f, indent=2)
+        logging.info(f"Recorded {len(recorder.checksums)} golden frames for '{name}'")
+
+
+def compare_case(name, recorder, golden_dir=GOLDEN_DIR, psnr_threshold=PSNR_THRESHOLD,
+                 ssim_threshold=SSIM_THRESHOLD):
+    """Compare a captured case against its goldens and return a per-frame diff report"""
+    with open(os.path.join(golden_dir, f'{name}.json')) as f:
+        golden = json.load(f)
+    # Only the checksums are committed; without local thumbnails every frame must match exactly
+    thumbnails_path = os.path.join(golden_dir, f'{name}.npz')
+    golden_thumbnails = None
+    if os.path.exists(thumbnails_path):
+        golden_thumbnails = unpack_thumbnails(np.load(thumbnails_path)['thumbnail_deltas'])
+
+    problems = []
+    if recorder.size != (golden['width'], golden['height']):
+        problems.append(f"frame size {recorder.size} != golden {(golden['width'], golden['height'])}")
+    if len(recorder.checksums) != golden['frame_count']:
+        problems.append(f"frame count {len(recorder.checksums)} != golden {golden['frame_count']}")
+
+    frames = []
+    for index in range(min(len(recorder.checksums), golden['frame_count'])):
+        if recorder.checksums[index] == golden['checksums'][index]:
+            frames.append({'frame': index, 'exact': True, 'psnr': None, 'ssim': 1.0, 'passed': True})
+            continue
+        candidate = recorder.thumbnails[index]
+        reference = golden_thumbnails[index] if golden_thumbnails is not None else None
+        if reference is None or candidate.shape != reference.shape:
+            frames.append({'frame': index, 'exact': False, 'psnr': None, 'ssim': None, 'passed': False})
+            continue
+        frame_psnr = psnr(candidate, reference)
+        frame_ssim = ssim(candidate, reference)
+        frames.append({
+            'frame': index,
+            'exact': False,
+            'psnr': None if math.isinf(frame_psnr) else round(frame_psnr, 3),
+            'ssim': round(frame_ssim, 5),
+            'passed': frame_psnr >= psnr_threshold and frame_ssim >= ssim_threshold,
+        })
+
+    failed = [frame['frame'] for frame in frames if not frame['passed']]
+    return {
+        'case': name,
+        'passed': not problems and not failed,
+        'problems': problems,
+        'exact_frames': sum(1 for frame in frames if frame['exact']),
+        'failed_frames': failed,
+        'min_psnr': min((frame['psnr'] for frame in frames if frame['psnr'] is not None), default=None),
+        'min_ssim': min((frame['ssim'] for frame in frames if frame['ssim'] is not None), default=None),
+        'frames': frames,
+    }
+
+
+def check_renderer(renderer=draw_scene, golden_dir=GOLDEN_DIR, cases=None,
+                   psnr_threshold=PSNR_THRESHOLD, ssim_threshold=SSIM_THRESHOLD):
+    """Render every reference case with `renderer` and compare it against the stored goldens"""
+    results = []
+    for name in cases or REFERENCE_CASES:
+        recorder = capture(renderer, REFERENCE_CASES[name])
+        results.append(compare_case(name, recorder, golden_dir, psnr_threshold, ssim_threshold))
+    return results
+
+
+def clip_curve(x, y, x_start, x_end):
+    """The polyline (x, y) clipped to x_start <= x <= x_end, walking every segment of the full curve"""
+    points = []
+    for i in range(len(x) - 1):
+        if x[i + 1] < x_start or x[i] > x_end:
+            continue
+        if x[i + 1] == x[i]:
+            points += [(x[i], y[i]), (x[i + 1], y[i + 1])]
+            continue
+        for edge in (max(x[i], x_start), min(x[i + 1], x_end)):
+            points.append((edge, y[i] + (y[i + 1] - y[i]) * (edge - x[i]) / (x[i + 1] - x[i])))
+    return points
+
+
+def _path(points):
+    """Drop repeated points, which draw nothing"""
+    path = []
+    for point in points:
+        if not path or not np.allclose(point, path[-1]):
+            path.append(point)
+    return path
+
+
+def check_line_window(patterns, fps=FRAME_RATE):
+    """Frames whose visible line differs from the full curve clipped to the same window"""
+    timeline = build_timeline(patterns)
+    window = LineWindow(timeline.x_line, timeline.y_line, 5.4 / 2)
+    failed = []
+    for frame in range(int(timeline.total_width * fps)):
+        t = (frame / fps) % timeline.total_width
+        xs, ys = window.visible(t)
+        expected = _path(clip_curve(window.x, window.y, xs[0], xs[-1]))
+        actual = _path(zip(xs, ys))
+        if len(actual) != len(expected) or not np.allclose(actual, expected):
+            failed.append(frame)
+    return failed
+
+
+def load_renderer(spec):
+    """Resolve a 'module:function' renderer spec"""
+    module_name, _, function_name = spec.partition(':')
+    return getattr(importlib.import_module(module_name), function_name or 'draw_scene')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Golden-frame regression harness for draw_scene")
+    parser.add_argument('command', choices=['record', 'check'])
+    parser.add_argument('--renderer', default='customized_breathing:draw_scene',
+                        help="renderer to run, as module:function")
+    parser.add_argument('--golden-dir', default=GOLDEN_DIR)
+    parser.add_argument('--case', action='append', choices=sorted(REFERENCE_CASES),
+                        help="limit to one reference case (repeatable)")
+    parser.add_argument('--psnr', type=float, default=PSNR_THRESHOLD, help="minimum PSNR in dB")
+    parser.add_argument('--ssim', type=float, default=SSIM_THRESHOLD, help="minimum SSIM")
+    parser.add_argument('--report', help="write the full per-frame diff report to this JSON file")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    logging.getLogger('matplotlib').setLevel(logging.ERROR)
+    renderer = load_renderer(args.renderer)
+
+    if args.command == 'record':
+        record_goldens(renderer, args.golden_dir, args.case)
+        return 0
+
+    line_failures = {name: check_line_window(REFERENCE_CASES[name]['patterns']) for name in args.case or REFERENCE_CASES}
+    for name, failed in line_failures.items():
+        print(f"{'FAIL' if failed else 'PASS'} {name} line window: failed frames {failed[:10]}"
+              f"{' ...' if len(failed) > 10 else ''}")
+    results = check_renderer(renderer, args.golden_dir, args.case, args.psnr, args.ssim)
+    for result in results:
+        status = 'PASS' if result['passed'] else 'FAIL'
+        print(f"{status} {result['case']}: {result['exact_frames']}/{len(result['frames'])} exact, "
+              f"min PSNR {result['min_psnr']}, min SSIM {result['min_ssim']}, "
+              f"failed frames {result['failed_frames'][:10]}{' ...' if len(result['failed_frames']) > 10 else ''}")
+        for problem in result['problems']:
+            print(f"    {problem}")
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(results, f, indent=2)
+    passed = all(result['passed'] for result in results) and not any(line_failures.values())
+    return 0 if passed else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,441 @@
+"""Live group breathing rooms: one instructor's timeline, followed by every participant.
+
+A room compiles its patterns into phases with the same breathing steps the
+renderer draws (breathing_steps.py) and, instead of rendering anything,
+streams phase changes to its participants as Server-Sent Events. Each event
+is serialized once and the same bytes are written to every subscriber's
+socket, so a broadcast costs one JSON encode plus one buffered write per
+participant. A subscriber whose socket stops draining is dropped rather
+than buffered without bound.
+
+Staying in sync does not depend on delivery latency: every phase event
+carries the server time the phase `starts_at`, and is sent
+EVENT_LEAD_SECONDS ahead of it. Every event also carries `sent_at`, the
+server clock when it was sent, as a clock-offset hint. A client estimates
+its offset as the largest `sent_at - local receive time` it has seen, since
+the fastest delivery is closest to the true offset. It can refine that with
+GET /clock round trips, and then starts each phase at `starts_at - offset`
+on its own clock. Connecting clients get the whole `schedule` first, so they
+can follow the room on their own and treat phase events as corrections.
+
+    POST /rooms               {"patterns": [...], "start_in": 10} -> room id and schedule
+    GET  /rooms/<id>          schedule, start time and subscriber count
+    GET  /rooms/<id>/events   text/event-stream: schedule, clock, phase..., end
+    GET  /clock               {"server_time": ...}
+
+POST /rooms needs `X-Admin-Token: $ADMIN_TOKEN` and returns 404 while
+ADMIN_TOKEN is unset. At most ROOM_MAX_ROOMS rooms are open at a time.
+
+    python group_rooms.py serve --port 5002
+    python group_rooms.py loadtest --subscribers 10000
+"""
+import argparse
+import asyncio
+import hmac
+import json
+import logging
+import multiprocessing
+import os
+import resource
+import secrets
+import statistics
+import sys
+import time
+from collections import namedtuple
+
+from breathing_steps import MAX_SCREEN_HEIGHT, assign_y_coordinates, create_breathing_steps
+from render_cost import session_duration
+
+Phase = namedtuple('Phase', ['index', 'name', 'offset', 'duration', 'y_start', 'y_end'])
+
+# Phase events go out this long before the phase starts, so clients can start it on time even
+# when writing to thousands of sockets takes a few hundred milliseconds
+EVENT_LEAD_SECONDS = 1.0
+HEARTBEAT_SECONDS = 15
+MAX_ROOM_SECONDS = 3 * 3600
+MAX_ROOM_PHASES = 20_000
+MAX_START_DELAY = 24 * 3600
+# Unsent bytes a subscriber may fall behind by before it is dropped
+MAX_BUFFERED_BYTES = 256 * 1024
+MAX_REQUEST_BYTES = 64 * 1024
+REQUEST_TIMEOUT = 10
+
+LOADTEST_PATTERNS = [{"name": "Load test", "numReps": 3, "inhaleDuration": 1, "firstHoldDuration": 0.5,
+                      "exhaleDuration": 1, "secondHoldDuration": 0.5}]
+
+STATUS_TEXT = {200: 'OK', 201: 'Created', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+               413: 'Payload Too Large', 503: 'Service Unavailable'}
+
+
+def compile_schedule(patterns):
+    """The room's phases in order, with their offset from the room's start, and the total duration"""
+    if session_duration(patterns) > MAX_ROOM_SECONDS:
+        raise ValueError(f"A room may last at most {MAX_ROOM_SECONDS} seconds")
+    phases, offset = [], 0.0
+    for pattern in patterns:
+        steps = assign_y_coordinates(create_breathing_steps(pattern), MAX_SCREEN_HEIGHT)
+        for _ in range(pattern["numReps"]):
+            for step in steps:
+                if step.duration <= 0:
+                    continue  # a zero-length hold is not a phase anyone can follow
+                if len(phases) == MAX_ROOM_PHASES:
+                    raise ValueError(f"A room may have at most {MAX_ROOM_PHASES} phases")
+                phases.append(Phase(len(phases), step.name, round(offset, 6), step.duration,
+                                    round(step.y_start, 4), round(step.y_end, 4)))
+                offset += step.duration
+    return tuple(phases), offset
+
+
+def sse_event(event, data, event_id=None):
+    """One Server-Sent Event, encoded"""
+    lines = [] if event_id is None else [f'id: {event_id}']
+    lines += [f'event: {event}', 'data: ' + json.dumps(data, separators=(',', ':'))]
+    return ('\n'.join(lines) + '\n\n').encode()
+
+
+class Room:
+    def __init__(self, room_id, patterns, starts_at):
+        self.id = room_id
+        self.phases, self.duration = compile_schedule(patterns)
+        self.starts_at = starts_at
+        self.subscribers = set()
+        self.seq = 0
+        self.stats = {'broadcasts': 0, 'last_fanout_ms': 0.0, 'max_fanout_ms': 0.0, 'dropped': 0}
+        self.schedule = [phase._asdict() for phase in self.phases]
+        # Every joining client gets the same schedule, so it is encoded once too
+        self.schedule_event = sse_event('schedule', {'room': self.id, 'starts_at': self.starts_at,
+                                                     'duration': self.duration, 'phases': self.schedule})
+
+    def info(self):
+        return {'room': self.id, 'starts_at': self.starts_at, 'duration': self.duration,
+                'subscribers': len(self.subscribers), 'server_time': time.time(), 'stats': self.stats,
+                'phases': self.schedule}
+
+    def subscribe(self, writer):
+        writer.write(b'retry: 2000\n\n' + self.schedule_event
+                     + sse_event('clock', {'sent_at': time.time()}))
+        self.subscribers.add(writer)
+
+    def unsubscribe(self, writer):
+        self.subscribers.discard(writer)
+
+    def broadcast(self, payload):
+        """Write one encoded event to every subscriber, dropping those that stopped reading"""
+        started = time.perf_counter()
+        stalled = []
+        for writer in self.subscribers:
+            transport = writer.transport
+            if transport.is_closing() or transport.get_write_buffer_size() > MAX_BUFFERED_BYTES:
+                stalled.append(writer)
+            else:
+                transport.write(payload)
+        for writer in stalled:
+            self.subscribers.discard(writer)
+            writer.transport.abort()
+        elapsed_ms = 1000 * (time.perf_counter() - started)
+        self.stats['broadcasts'] += 1
+        self.stats['dropped'] += len(stalled)
+        self.stats['last_fanout_ms'] = round(elapsed_ms, 3)
+        self.stats['max_fanout_ms'] = round(max(self.stats['max_fanout_ms'], elapsed_ms), 3)
+
+    def phase_event(self, phase):
+        self.seq += 1
+        following = self.phases[phase.index + 1].name if phase.index + 1 < len(self.phases) else None
+        return sse_event('phase', {
+            'room': self.id, 'index': phase.index, 'phase': phase.name,
+            'starts_at': self.starts_at + phase.offset, 'duration': phase.duration,
+            'y_start': phase.y_start, 'y_end': phase.y_end, 'next': following, 'sent_at': time.time(),
+        }, self.seq)
+
+    async def run(self):
+        # Sleeping until each wall-clock target, rather than for each duration, keeps errors from adding up
+        for phase in self.phases:
+            await asyncio.sleep(max(0.0, self.starts_at + phase.offset - EVENT_LEAD_SECONDS - time.time()))
+            self.broadcast(self.phase_event(phase))
+        await asyncio.sleep(max(0.0, self.starts_at + self.duration - time.time()))
+        self.seq += 1
+        self.broadcast(sse_event('end', {'room': self.id, 'sent_at': time.time()}, self.seq))
+        for writer in list(self.subscribers):
+            writer.close()
+        self.subscribers.clear()
+
+
+class RoomServer:
+    """Rooms of one process, served over a minimal HTTP/1.1 front end"""
+
+    def __init__(self, admin_token=None, max_subscribers=20_000, max_rooms=100):
+        self.admin_token = admin_token
+        self.max_subscribers = max_subscribers
+        self.max_rooms = max_rooms
+        self.rooms = {}
+        self._tasks = set()
+
+    @classmethod
+    def from_environ(cls):
+        return cls(admin_token=os.environ.get('ADMIN_TOKEN'),
+                   max_subscribers=int(os.environ.get('ROOM_MAX_SUBSCRIBERS', 20_000)),
+                   max_rooms=int(os.environ.get('ROOM_MAX_ROOMS', 100)))
+
+    @property
+    def subscriber_count(self):
+        return sum(len(room.subscribers) for room in self.rooms.values())
+
+    def create_room(self, patterns, start_in=10):
+        if not isinstance(start_in, (int, float)) or not 0 <= start_in <= MAX_START_DELAY:
+            raise ValueError(f"start_in must be between 0 and {MAX_START_DELAY} seconds")
+        room = Room(secrets.token_hex(4), patterns, time.time() + start_in)
+        self.rooms[room.id] = room
+        task = asyncio.get_running_loop().create_task(self._run_room(room))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        logging.info(f"Room {room.id}: {len(room.phases)} phases over {room.duration:.0f}s, starts in {start_in}s")
+        return room
+
+    async def _run_room(self, room):
+        try:
+            await room.run()
+        finally:
+            self.rooms.pop(room.id, None)
+
+    async def _heartbeat(self):
+        """Keep idle connections open and give clients a fresh clock sample"""
+        while True:
+            await asyncio.sleep(HEARTBEAT_SECONDS)
+            for room in list(self.rooms.values()):
+                room.broadcast(sse_event('clock', {'sent_at': time.time()}))
+
+    async def serve(self, host='0.0.0.0', port=5002, ready=None):
+        server = await asyncio.start_server(self.handle, host, port, backlog=4096, limit=MAX_REQUEST_BYTES)
+        heartbeat = asyncio.get_running_loop().create_task(self._heartbeat())
+        logging.info(f"Group rooms listening on {', '.join(str(s.getsockname()) for s in server.sockets)}")
+        if ready is not None:
+            ready.set_result(server.sockets[0].getsockname()[1])
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            heartbeat.cancel()
+
+    def respond(self, writer, status, data):
+        body = json.dumps(data, separators=(',', ':')).encode()
+        writer.write(f'HTTP/1.1 {status} {STATUS_TEXT[status]}\r\nContent-Type: application/json\r\n'
+                     f'Content-Length: {len(body)}\r\nAccess-Control-Allow-Origin: *\r\n'
+                     f'Connection: close\r\n\r\n'.encode() + body)
+
+    async def read_request(self, reader, writer):
+        """(method, path segments, headers, body), or None after answering or dropping a bad request"""
+        try:
+            head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), REQUEST_TIMEOUT)
+            request_line, *header_lines = head.decode('latin-1').split('\r\n')
+            method, target, _ = request_line.split(' ', 2)
+            headers = {name.strip().lower(): value.strip()
+                       for name, _, value in (line.partition(':') for line in header_lines if line)}
+            length = int(headers.get('content-length', 0))
+            if length > MAX_REQUEST_BYTES:
+                self.respond(writer, 413, {'error': 'Request body is too large'})
+                return None
+            body = await asyncio.wait_for(reader.readexactly(length), REQUEST_TIMEOUT) if length else b''
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, TimeoutError, ValueError, ConnectionError):
+            return None
+        return method, target.split('?', 1)[0].strip('/').split('/'), headers, body
+
+    async def handle(self, reader, writer):
+        try:
+            request = await self.read_request(reader, writer)
+            if request is None:
+                return
+            method, parts, headers, body = request
+            if parts == ['clock'] and method == 'GET':
+                self.respond(writer, 200, {'server_time': time.time()})
+            elif parts == ['rooms'] and method == 'POST':
+                self.post_room(writer, headers, body)
+            elif len(parts) in (2, 3) and parts[0] == 'rooms' and method == 'GET':
+                room = self.rooms.get(parts[1])
+                if room is None:
+                    self.respond(writer, 404, {'error': 'No such room'})
+                elif len(parts) == 2:
+                    self.respond(writer, 200, room.info())
+                elif parts[2] == 'events':
+                    await self.stream(room, reader, writer)
+                else:
+                    self.respond(writer, 404, {'error': 'Not found'})
+            elif parts[0] in ('clock', 'rooms'):
+                self.respond(writer, 405, {'error': 'Method not allowed'})
+            else:
+                self.respond(writer, 404, {'error': 'Not found'})
+        finally:
+            await self._close(writer)
+
+    def post_room(self, writer, headers, body):
+        # Like the render app's admin routes, creating rooms does not exist without a token
+        if not self.admin_token or not hmac.compare_digest(headers.get('x-admin-token', ''), self.admin_token):
+            return self.respond(writer, 404, {'error': 'Not found'})
+        if len(self.rooms) >= self.max_rooms:
+            return self.respond(writer, 503, {'error': 'Too many rooms'})
+        try:
+            data = json.loads(body or b'{}')
+            room = self.create_room(data.get('patterns'), data.get('start_in', 10))
+        except (ValueError, TypeError, KeyError, AttributeError) as e:
+            return self.respond(writer, 400, {'error': f"Invalid room: {str(e)}"})
+        self.respond(writer, 201, room.info())
+
+    async def stream(self, room, reader, writer):
+        if self.subscriber_count >= self.max_subscribers:
+            return self.respond(writer, 503, {'error': 'Too many participants'})
+        writer.write(b'HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nCache-Control: no-cache\r\n'
+                     b'Access-Control-Allow-Origin: *\r\nX-Accel-Buffering: no\r\n\r\n')
+        room.subscribe(writer)
+        try:
+            # Nothing is expected from the client; reading only notices when it goes away
+            while await reader.read(1024):
+                pass
+        except ConnectionError:
+            pass
+        finally:
+            room.unsubscribe(writer)
+
+    async def _close(self, writer):
+        writer.close()
+        try:
+            await writer.wait_closed()
+        except ConnectionError:
+            pass
+
+
+def raise_file_limit():
+    """Allow as many open sockets as the hard limit does; returns the new soft limit"""
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft != hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    return hard
+
+
+async def _subscriber(host, port, room_id, lags, late, received, connect_slots):
+    async with connect_slots:
+        reader, writer = await asyncio.open_connection(host, port)
+        writer.write(f'GET /rooms/{room_id}/events HTTP/1.1\r\nHost: {host}\r\n\r\n'.encode())
+        status = await reader.readline()
+        await reader.readuntil(b'\r\n\r\n')
+    if b' 200 ' not in status:
+        writer.close()
+        raise ConnectionError(status.decode().strip())
+    phases, event = 0, None
+    try:
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            if line.startswith(b'event: '):
+                event = line[7:].strip()
+            elif line.startswith(b'data: ') and event == b'phase':
+                now, data = time.time(), json.loads(line[6:])
+                lags.append(now - data['sent_at'])
+                late.append(now > data['starts_at'])
+                phases += 1
+            elif line.startswith(b'data: ') and event == b'end':
+                break
+    finally:
+        writer.close()
+    received.append(phases)
+
+
+def _loadtest_client(host, port, room_id, count, results):
+    """One client process: `count` subscribers to the room, reporting delivery lags and phases received"""
+    raise_file_limit()
+
+    async def run():
+        lags, late, received = [], [], []
+        connect_slots = asyncio.Semaphore(256)
+        outcomes = await asyncio.gather(
+            *(_subscriber(host, port, room_id, lags, late, received, connect_slots) for _ in range(count)),
+            return_exceptions=True)
+        failures = [str(outcome) for outcome in outcomes if isinstance(outcome, BaseException)]
+        return lags, sum(late), received, failures
+
+    results.put(asyncio.run(run()))
+
+
+async def _run_loadtest(subscribers, clients, ramp_seconds, patterns):
+    server = RoomServer(max_subscribers=subscribers + 1)
+    ready = asyncio.get_running_loop().create_future()
+    serving = asyncio.get_running_loop().create_task(server.serve('127.0.0.1', 0, ready))
+    port = await ready
+    room = server.create_room(patterns, start_in=ramp_seconds)
+
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    shares = [subscribers // clients + (i < subscribers % clients) for i in range(clients)]
+    processes = [context.Process(target=_loadtest_client, args=('127.0.0.1', port, room.id, share, results))
+                 for share in shares]
+    connect_started = time.perf_counter()
+    for process in processes:
+        process.start()
+    while len(room.subscribers) < subscribers and time.time() < room.starts_at:
+        await asyncio.sleep(0.05)
+    connected, connect_seconds = len(room.subscribers), time.perf_counter() - connect_started
+    peak_subscribers = connected
+
+    while room.id in server.rooms:
+        peak_subscribers = max(peak_subscribers, len(room.subscribers))
+        await asyncio.sleep(0.05)
+    loop = asyncio.get_running_loop()
+    outcomes = [await loop.run_in_executor(None, results.get) for _ in processes]
+    for process in processes:
+        process.join()
+    serving.cancel()
+
+    lags = sorted(lag for outcome in outcomes for lag in outcome[0])
+    late = sum(outcome[1] for outcome in outcomes)
+    received = [count for outcome in outcomes for count in outcome[2]]
+    failures = [failure for outcome in outcomes for failure in outcome[3]]
+    return {
+        'subscribers': subscribers,
+        'connected_before_start': connected,
+        'peak_subscribers': peak_subscribers,
+        'connect_seconds': round(connect_seconds, 2),
+        'failed_connections': len(failures),
+        'phases': len(room.phases),
+        'complete_streams': sum(count == len(room.phases) for count in received),
+        'fanout_ms_max': room.stats['max_fanout_ms'],
+        'dropped': room.stats['dropped'],
+        'delivery_ms_p50': round(1000 * statistics.median(lags), 1) if lags else None,
+        'delivery_ms_p99': round(1000 * lags[int(0.99 * (len(lags) - 1))], 1) if lags else None,
+        'delivery_ms_max': round(1000 * lags[-1], 1) if lags else None,
+        'lead_ms': 1000 * EVENT_LEAD_SECONDS,
+        # Phase events that reached a client after the phase had already started
+        'late_deliveries': late,
+        'server_peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        'failure_sample': failures[:3],
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Group breathing rooms")
+    commands = parser.add_subparsers(dest='command', required=True)
+    serve = commands.add_parser('serve', help="run the room service")
+    serve.add_argument('--host', default=os.environ.get('ROOM_HOST', '0.0.0.0'))
+    serve.add_argument('--port', type=int, default=int(os.environ.get('ROOM_PORT', 5002)))
+    loadtest = commands.add_parser('loadtest', help="one room, many subscribers from separate client processes")
+    loadtest.add_argument('--subscribers', type=int, default=10_000)
+    loadtest.add_argument('--clients', type=int, default=max(1, min(4, os.cpu_count() or 1)),
+                          help="client processes opening the subscriptions")
+    loadtest.add_argument('--ramp', type=float, default=30, help="seconds between creating the room and its start")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    limit = raise_file_limit()
+    if args.command == 'serve':
+        asyncio.run(RoomServer.from_environ().serve(args.host, args.port))
+        return 0
+
+    if args.subscribers + 64 > limit:
+        print(f"Open file limit is {limit}; raise it (ulimit -n) for {args.subscribers} subscribers", file=sys.stderr)
+        return 1
+    result = asyncio.run(_run_loadtest(args.subscribers, args.clients, args.ramp, LOADTEST_PATTERNS))
+    print(json.dumps(result, indent=2))
+    ok = (result['failed_connections'] == 0 and result['complete_streams'] == args.subscribers)
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,175 @@
+"""On-demand cProfile of single render jobs.
+
+A `/generate` or `/preview` request is profiled when it carries
+`X-Profile-Token: <expires>.<signature>`, an HMAC-SHA256 with
+PROFILING_SECRET over the expiry time and the request path (the same
+format the Django API uses), or when an admin has armed the next N renders
+with POST /admin/profiles/arm. The render worker writes the profile to
+`<id>.prof` in the store, and the app adds `<id>.json` with the request and
+the render report. Renders that are not profiled never start a profiler.
+
+Admin routes need `X-Admin-Token: $ADMIN_TOKEN` and do not exist while
+ADMIN_TOKEN is unset.
+
+    python profile_store.py sign /generate --ttl 600
+"""
+import argparse
+import hashlib
+import hmac
+import io
+import json
+import os
+import pstats
+import secrets
+import threading
+import time
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+TOKEN_HEADER = 'X-Profile-Token'
+MAX_TOKEN_SECONDS = 24 * 3600
+
+
+def _signature(secret, expires, path):
+    return hmac.new(secret.encode(), f'{expires}:{path}'.encode(), hashlib.sha256).hexdigest()
+
+
+def sign_token(secret, path, ttl=600):
+    """Profile token for requests to `path` during the next `ttl` seconds"""
+    if not secret:
+        raise ValueError("PROFILING_SECRET is not set")
+    expires = int(time.time()) + min(ttl, MAX_TOKEN_SECONDS)
+    return f'{expires}.{_signature(secret, expires, path)}', expires
+
+
+def verify_token(secret, token, path):
+    if not secret or not token:
+        return False
+    expires, _, signature = token.partition('.')
+    if not expires.isdigit() or int(expires) < time.time():
+        return False
+    return hmac.compare_digest(signature, _signature(secret, int(expires), path))
+
+
+class ProfileStore:
+    """Render profiles as `<id>.prof` (pstats) and `<id>.json` (metadata), keeping the newest `max_profiles`
+
+    The profile file is written by the render worker, so an id and its path
+    are handed out before the render starts and the metadata is added after.
+    """
+
+    def __init__(self, directory, secret=None, max_profiles=200):
+        self.directory = directory
+        self.secret = secret
+        self.max_profiles = max_profiles
+        self._armed = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_environ(cls):
+        return cls(os.environ.get('PROFILE_STORE_DIR', os.path.join(BASE_DIR, 'profiles')),
+                   secret=os.environ.get('PROFILING_SECRET'),
+                   max_profiles=int(os.environ.get('PROFILE_STORE_MAX', 200)))
+
+    def arm(self, count):
+        """Profile the next `count` renders regardless of headers; returns how many are armed"""
+        with self._lock:
+            self._armed = max(0, count)
+            return self._armed
+
+    @property
+    def armed(self):
+        return self._armed
+
+    def trigger(self, token, path):
+        """'token' or 'armed' if this request should be profiled, else None"""
+        if token is not None and verify_token(self.secret, token, path):
+            return 'token'
+        if self._armed:
+            with self._lock:
+                if self._armed:
+                    self._armed -= 1
+                    return 'armed'
+        return None
+
+    def _path(self, profile_id, extension):
+        # Ids are generated here; anything else (e.g. path separators from a URL) is not a profile
+        if not profile_id.replace('-', '').isalnum():
+            raise KeyError(profile_id)
+        return os.path.join(self.directory, f'{profile_id}.{extension}')
+
+    def reserve(self, kind):
+        """A new profile id and the path its render should dump stats to"""
+        os.makedirs(self.directory, exist_ok=True)
+        profile_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{kind}-{secrets.token_hex(4)}"
+        return profile_id, self._path(profile_id, 'prof')
+
+    def save_metadata(self, profile_id, metadata):
+        with open(self._path(profile_id, 'json'), 'w') as f:
+            json.dump(dict(metadata, id=profile_id), f)
+        self.prune()
+
+    def list(self):
+        """Metadata of every stored profile, newest first"""
+        if not os.path.isdir(self.directory):
+            return []
+        profiles = []
+        for name in sorted(os.listdir(self.directory), reverse=True):
+            if name.endswith('.json'):
+                try:
+                    with open(os.path.join(self.directory, name)) as f:
+                        profiles.append(json.load(f))
+                except (OSError, ValueError):
+                    continue  # removed or half-written meanwhile
+        return profiles
+
+    def get(self, profile_id):
+        try:
+            with open(self._path(profile_id, 'json')) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            raise KeyError(profile_id)
+
+    def profile_path(self, profile_id):
+        path = self._path(profile_id, 'prof')
+        if not os.path.exists(path):
+            raise KeyError(profile_id)
+        return path
+
+    def summary(self, profile_id, limit=40, sort='cumulative'):
+        """The top `limit` functions, as pstats prints them"""
+        output = io.StringIO()
+        stats = pstats.Stats(self.profile_path(profile_id), stream=output)
+        stats.strip_dirs().sort_stats(sort).print_stats(limit)
+        return output.getvalue()
+
+    def prune(self):
+        ids = sorted(name[:-5] for name in os.listdir(self.directory) if name.endswith('.json'))
+        for profile_id in ids[:max(0, len(ids) - self.max_profiles)]:
+            for extension in ('json', 'prof'):
+                try:
+                    os.remove(self._path(profile_id, extension))
+                except FileNotFoundError:
+                    pass
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+    sign = commands.add_parser('sign', help="print an X-Profile-Token for a path")
+    sign.add_argument('path')
+    sign.add_argument('--ttl', type=int, default=600)
+    commands.add_parser('list', help="list stored profiles")
+    args = parser.parse_args(argv)
+
+    store = ProfileStore.from_environ()
+    if args.command == 'sign':
+        token, expires = sign_token(store.secret, args.path, args.ttl)
+        print(token)
+    else:
+        for metadata in store.list():
+            print(f"{metadata['id']}  {metadata['path']}  {metadata.get('total_seconds', 0):.2f}s  "
+                  f"{metadata['trigger']}  {metadata.get('remote_addr')}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,21 @@
+"""Render parameters shared by the renderer and the web process.
+
+Kept free of heavy imports so app.py can cost and route render jobs without
+loading matplotlib, scipy or OpenCV.
+"""
+
+import os
+
+# Animation parameters
+FRAME_RATE = 25
+FRAME_WIDTH = 1080
+FRAME_HEIGHT = 1920
+
+# Draft preview parameters: quarter resolution (270x480) at a low frame rate
+PREVIEW_SCALE = 0.25
+PREVIEW_FPS = 8
+
+# Frames are handed to a separate encoder process through a shared-memory ring of
+# this many slots (8 MB each at full size); 0 pipes them to ffmpeg from the render
+# process, which is the default on single-core machines where there is nothing to overlap
+FRAME_RING_SLOTS = int(os.environ.get('FRAME_RING_SLOTS', 8 if (os.cpu_count() or 1) > 1 else 0))
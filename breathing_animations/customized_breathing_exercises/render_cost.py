@@ -0,0 +1,321 @@
+"""Render cost estimation and admission control for /generate and /preview.
+
+The number of frames draw_scene produces is fully determined by the submitted
+patterns, so CPU time and peak memory can be predicted before rendering
+starts. The coefficients below were measured on a reference box; run
+
+    python render_cost.py calibrate
+
+to fit them to the current machine (written to render_cost.json, or the path
+in RENDER_COST_MODEL). Calibration fits the memory coefficients from measured
+peak RSS on Linux only; elsewhere the memory estimate is a guess.
+"""
+import heapq
+import itertools
+import json
+import logging
+import math
+import os
+import sys
+import tempfile
+import threading
+import time
+from collections import namedtuple
+
+from PIL import Image
+
+from render_config import FRAME_HEIGHT, FRAME_RATE, FRAME_RING_SLOTS, FRAME_WIDTH
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+COST_MODEL_PATH = os.environ.get('RENDER_COST_MODEL', os.path.join(BASE_DIR, 'render_cost.json'))
+
+FULL_FRAME_PIXELS = FRAME_WIDTH * FRAME_HEIGHT
+SPRITE_BYTES = 200 * 200 * 4 * 4  # one float32 RGBA rotation of the 200x200 ball
+
+# Seconds (or MB) per unit; see estimate_render_cost for how they combine
+DEFAULT_COEFFICIENTS = {
+    'setup_seconds': 0.05,
+    'rotation_seconds': 0.025,
+    'frame_seconds': 0.025,              # update + rasterize + encode at 1080x1920
+    'background_frame_seconds': 0.005,   # extra per frame when a background image is drawn (blitted base layer)
+    'background_decode_seconds_per_mpx': 0.03,
+    'base_memory_mb': 160.0,
+    'background_memory_mb_per_mpx': 48.0,
+}
+
+RenderEstimate = namedtuple('RenderEstimate', ['frames', 'duration_seconds', 'rotations', 'cpu_seconds', 'peak_memory_mb'])
+
+
+def load_coefficients(path=COST_MODEL_PATH):
+    coefficients = dict(DEFAULT_COEFFICIENTS)
+    if os.path.exists(path):
+        try:
+            with open(path) as f:
+                coefficients.update(json.load(f))
+        except (OSError, ValueError) as e:
+            logging.warning(f"Ignoring unreadable render cost model {path}: {str(e)}")
+    return coefficients
+
+
+def image_pixels(source):
+    """Pixel count of an image path or file object, read from its header without decoding"""
+    try:
+        with Image.open(source) as img:
+            width, height = img.size
+        return width * height
+    except Exception:
+        return 0
+    finally:
+        if hasattr(source, 'seek'):
+            source.seek(0)
+
+
+def session_duration(patterns):
+    """Total session length in seconds, validating the fields draw_scene relies on"""
+    if not isinstance(patterns, list) or not patterns:
+        raise ValueError("patterns must be a non-empty list")
+    total = 0.0
+    for pattern in patterns:
+        num_reps = pattern.get("numReps")
+        if not isinstance(num_reps, int) or num_reps < 1:
+            raise ValueError("numReps must be a positive integer")
+        durations = [pattern.get(key) for key in
+                     ("inhaleDuration", "firstHoldDuration", "exhaleDuration", "secondHoldDuration")]
+        if any(not isinstance(d, (int, float)) or d < 0 or not math.isfinite(d) for d in durations):
+            raise ValueError("durations must be non-negative numbers")
+        if sum(durations) <= 0:
+            raise ValueError("a pattern needs at least one non-zero duration")
+        total += sum(durations) * num_reps
+    return total
+
+
+def estimate_render_cost(patterns, background_pixels=0, scale=1.0, fps=FRAME_RATE, coefficients=None):
+    """Predict CPU seconds and peak memory of a draw_scene call from its inputs"""
+    c = coefficients or load_coefficients()
+    duration = session_duration(patterns)
+    frames = int(duration * fps)
+    rotations = max(1, frames // 4)
+    pixel_ratio = scale * scale
+    background_mpx = background_pixels / 1e6
+    has_background = background_pixels > 0
+
+    cpu_seconds = (c['setup_seconds']
+                   + rotations * c['rotation_seconds']
+                   + frames * pixel_ratio * (c['frame_seconds']
+                                             + (c['background_frame_seconds'] if has_background else 0.0))
+                   + background_mpx * c['background_decode_seconds_per_mpx'])
+    peak_memory_mb = (c['base_memory_mb']
+                      + rotations * SPRITE_BYTES / (1024 * 1024)
+                      + (FULL_FRAME_PIXELS * pixel_ratio / 1e6) * c['background_memory_mb_per_mpx'] * has_background
+                      + (1 + FRAME_RING_SLOTS) * FULL_FRAME_PIXELS * pixel_ratio * 4 / (1024 * 1024))
+    return RenderEstimate(frames=frames, duration_seconds=duration, rotations=rotations,
+                          cpu_seconds=cpu_seconds, peak_memory_mb=peak_memory_mb)
+
+
+class AdmissionRejected(Exception):
+    def __init__(self, status_code, message, estimate, retry_after=None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.estimate = estimate
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """CPU-second budget for one client, refilled continuously"""
+
+    def __init__(self, capacity, refill_per_second):
+        self.capacity = capacity
+        self.refill_per_second = refill_per_second
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.refill_per_second)
+        self.updated = now
+
+    def try_take(self, amount):
+        """Take `amount` tokens, or return the seconds until they would be available"""
+        now = time.monotonic()
+        self._refill(now)
+        if self.tokens >= amount:
+            self.tokens -= amount
+            return 0.0
+        return (amount - self.tokens) / self.refill_per_second
+
+    def give_back(self, amount):
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+
+class AdmissionController:
+    """Gates render jobs on their estimated cost.
+
+    - Jobs larger than `max_job_seconds` or `max_job_memory_mb` are refused (413), and
+      so are jobs larger than `client_capacity`, which no client bucket could ever pay for.
+    - Each client draws estimated CPU seconds from its own token bucket (429 when empty).
+    - At most `global_cpu_seconds` of estimated work runs at once. It is a concurrency
+      budget, not a job size limit: a job larger than it waits until it can run alone.
+      Jobs waiting for capacity are admitted cheapest first; a job still waiting after
+      `queue_timeout` seconds is refused (429).
+    """
+
+    def __init__(self, client_capacity=600.0, client_refill_per_second=0.5, global_cpu_seconds=None,
+                 max_job_seconds=1800.0, max_job_memory_mb=4096.0, queue_timeout=30.0, max_clients=10000):
+        self.client_capacity = client_capacity
+        self.client_refill_per_second = client_refill_per_second
+        self.global_cpu_seconds = global_cpu_seconds or (os.cpu_count() or 1) * 120.0
+        self.max_job_seconds = min(max_job_seconds, client_capacity)
+        self.max_job_memory_mb = max_job_memory_mb
+        self.queue_timeout = queue_timeout
+        self.max_clients = max_clients
+        self.in_flight = 0.0
+        self._buckets = {}
+        self._waiting = []
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+
+    @classmethod
+    def from_environ(cls):
+        def env(name, default):
+            value = os.environ.get(name)
+            return float(value) if value else default
+        return cls(client_capacity=env('RENDER_CLIENT_BUDGET_SECONDS', 600.0),
+                   client_refill_per_second=env('RENDER_CLIENT_REFILL_PER_SECOND', 0.5),
+                   global_cpu_seconds=env('RENDER_GLOBAL_CPU_SECONDS', None),
+                   max_job_seconds=env('RENDER_MAX_JOB_SECONDS', 1800.0),
+                   max_job_memory_mb=env('RENDER_MAX_JOB_MEMORY_MB', 4096.0),
+                   queue_timeout=env('RENDER_QUEUE_TIMEOUT', 30.0))
+
+    def _bucket(self, client):
+        bucket = self._buckets.get(client)
+        if bucket is None:
+            if len(self._buckets) >= self.max_clients:
+                # Drop buckets that have refilled completely; they carry no state
+                now = time.monotonic()
+                for key, old in list(self._buckets.items()):
+                    old._refill(now)
+                    if old.tokens >= old.capacity:
+                        del self._buckets[key]
+            bucket = self._buckets[client] = TokenBucket(self.client_capacity, self.client_refill_per_second)
+        return bucket
+
+    def acquire(self, client, estimate):
+        """Block until the job may run; raises AdmissionRejected otherwise. Pair with release()."""
+        cost = estimate.cpu_seconds
+        if cost > self.max_job_seconds:
+            raise AdmissionRejected(413, f"Render too large: estimated {cost:.0f} CPU seconds "
+                                         f"(limit {self.max_job_seconds:.0f})", estimate)
+        if estimate.peak_memory_mb > self.max_job_memory_mb:
+            raise AdmissionRejected(413, f"Render too large: estimated {estimate.peak_memory_mb:.0f} MB peak memory "
+                                         f"(limit {self.max_job_memory_mb:.0f})", estimate)
+
+        with self._condition:
+            bucket = self._bucket(client)
+            wait = bucket.try_take(cost)
+            if wait:
+                raise AdmissionRejected(429, "Render budget exhausted for this client", estimate,
+                                        retry_after=math.ceil(wait))
+
+            ticket = (cost, next(self._sequence))
+            heapq.heappush(self._waiting, ticket)
+            deadline = time.monotonic() + self.queue_timeout
+            while self._waiting[0] is not ticket or not self._fits(cost):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._waiting.remove(ticket)
+                    heapq.heapify(self._waiting)
+                    bucket.give_back(cost)
+                    self._condition.notify_all()
+                    raise AdmissionRejected(429, "Render capacity is busy, try again shortly", estimate,
+                                            retry_after=math.ceil(self.queue_timeout))
+                self._condition.wait(remaining)
+            heapq.heappop(self._waiting)
+            self.in_flight += cost
+            # The next-cheapest job may fit alongside this one
+            self._condition.notify_all()
+
+    def _fits(self, cost):
+        # A job over the whole budget runs once nothing else is in flight
+        return self.in_flight + cost <= self.global_cpu_seconds or self.in_flight == 0
+
+    def release(self, estimate):
+        with self._condition:
+            self.in_flight = max(0.0, self.in_flight - estimate.cpu_seconds)
+            self._condition.notify_all()
+
+
+def calibrate(output_path=COST_MODEL_PATH):
+    """Render short benchmark sessions and fit the CPU and memory coefficients
+
+    Memory is fitted from the render process' per-job peak RSS (see
+    render_profiling.peak_rss_mb), which only Linux reports; elsewhere the
+    memory coefficients keep their uncalibrated defaults.
+    """
+    import customized_breathing
+    from customized_breathing import FFmpegPipe, draw_scene
+    from render_profiling import RenderProfiler
+
+    ball = os.path.join(BASE_DIR, 'uploads', 'ball_images', 'nymera_ball_transparent.png')
+    background = os.path.join(BASE_DIR, 'uploads', 'background_images', 'Warmup_Cover.jpg')
+    patterns = [{"name": "Calibration", "numReps": 1, "inhaleDuration": 1.5, "firstHoldDuration": 0.5,
+                 "exhaleDuration": 1.5, "secondHoldDuration": 0.5}]
+
+    def run(background_image):
+        profiler = RenderProfiler()
+        with tempfile.TemporaryDirectory() as tmp:
+            # An empty base layer cache, so the background is decoded as on its first render
+            layer_dir, customized_breathing.BASE_LAYER_DIR = customized_breathing.BASE_LAYER_DIR, tmp
+            try:
+                if not draw_scene(patterns, background_image=background_image, ball_image=ball, profiler=profiler,
+                                  frame_sink=FFmpegPipe(os.path.join(tmp, 'calibration.mp4'))):
+                    raise RuntimeError("Calibration render failed")
+            finally:
+                customized_breathing.BASE_LAYER_DIR = layer_dir
+        return profiler.report
+
+    run(None)  # warm imports, fonts and caches
+    plain = run(None)
+    with_background = run(background)
+
+    def per_frame(report):
+        return (report.stages['update'] + report.stages['rasterize'] + report.stages['encode']) / report.frame_count
+
+    rotations = max(1, plain.frame_count // 4)
+    # Sprites are cached after the warm-up run, so time the rotation table directly
+    from customized_breathing import file_digest, rotated_sprites
+    rotated_sprites.cache_clear()
+    started = time.perf_counter()
+    rotated_sprites(ball, file_digest(ball), rotations)
+    rotation_seconds = (time.perf_counter() - started) / rotations
+
+    background_mpx = image_pixels(background) / 1e6
+    coefficients = dict(load_coefficients(output_path))
+    coefficients.update({
+        'setup_seconds': plain.stages['setup'] + plain.stages['load_ball'],
+        'rotation_seconds': rotation_seconds,
+        'frame_seconds': per_frame(plain),
+        'background_frame_seconds': max(0.0, per_frame(with_background) - per_frame(plain)),
+        'background_decode_seconds_per_mpx': with_background.stages['load_background'] / background_mpx
+        if background_mpx else DEFAULT_COEFFICIENTS['background_decode_seconds_per_mpx'],
+    })
+    if plain.peak_rss_mb and with_background.peak_rss_mb:
+        # Calibration encodes through FFmpegPipe, so one frame buffer and no ring slots
+        frame_mb = FULL_FRAME_PIXELS * 4 / (1024 * 1024)
+        coefficients.update({
+            'base_memory_mb': max(0.0, plain.peak_rss_mb - rotations * SPRITE_BYTES / (1024 * 1024) - frame_mb),
+            'background_memory_mb_per_mpx': max(0.0, with_background.peak_rss_mb - plain.peak_rss_mb)
+            / (FULL_FRAME_PIXELS / 1e6),
+        })
+    else:
+        logging.warning("Peak RSS is not measurable per render here; the memory limit stays an uncalibrated guess")
+    with open(output_path, 'w') as f:
+        json.dump(coefficients, f, indent=2)
+    return coefficients
+
+
+if __name__ == '__main__':
+    if sys.argv[1:] != ['calibrate']:
+        print("usage: python render_cost.py calibrate")
+        sys.exit(2)
+    logging.basicConfig(level=logging.INFO)
+    logging.getLogger('matplotlib').setLevel(logging.ERROR)
+    print(json.dumps(calibrate(), indent=2))
@@ -0,0 +1,209 @@
+"""Prefork pool of warmed render processes.
+
+The web process never imports the renderer (matplotlib, scipy, OpenCV).
+Renders run in a multiprocessing pool whose workers fork from a forkserver
+that has already imported customized_breathing, and every worker draws one
+throwaway figure on start, so font cache and Agg setup are paid before the
+first request rather than during it.
+
+    python render_pool.py benchmark    # cold vs warm time-to-first-frame
+"""
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import statistics
+import subprocess
+import sys
+import threading
+import time
+
+from render_profiling import RenderProfiler
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+BALL_IMAGE = os.path.join(BASE_DIR, 'uploads', 'ball_images', 'nymera_ball_transparent.png')
+
+# Modules the forkserver imports once so forked workers start with them loaded
+RENDERER_MODULES = ['customized_breathing']
+
+BENCHMARK_PATTERNS = [{"name": "Benchmark", "numReps": 1, "inhaleDuration": 0.2, "firstHoldDuration": 0,
+                       "exhaleDuration": 0.2, "secondHoldDuration": 0}]
+
+
+def _init_worker():
+    logging.getLogger('matplotlib').setLevel(logging.ERROR)
+    from customized_breathing import warm_renderer
+    warm_renderer()
+
+
+def _worker_pid(delay):
+    time.sleep(delay)
+    return os.getpid()
+
+
+def run_render(kind, patterns, options, profile_path=None):
+    """Run one render and return (result, RenderReport).
+
+    `result` is draw_scene's success flag for kind 'video' and the image bytes
+    (or None) for kind 'preview'.
+    """
+    from customized_breathing import draw_preview, draw_scene
+    profiler = RenderProfiler(profile_path=profile_path)
+    if kind == 'preview':
+        result = draw_preview(patterns, profiler=profiler, **options)
+    else:
+        result = draw_scene(patterns, profiler=profiler, **options)
+    return result, profiler.report
+
+
+class RenderPool:
+    """Warmed render processes shared by the web workers.
+
+    With `processes=0` renders run in the calling process instead, importing
+    the renderer on first use.
+    """
+
+    def __init__(self, processes=None, max_tasks_per_child=None, start_method=None):
+        self.processes = min(4, os.cpu_count() or 1) if processes is None else processes
+        self.max_tasks_per_child = max_tasks_per_child
+        self.start_method = start_method
+        self._pool = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_environ(cls):
+        processes = os.environ.get('RENDER_WORKERS')
+        max_tasks = os.environ.get('RENDER_WORKER_MAX_TASKS')
+        return cls(processes=int(processes) if processes else None,
+                   max_tasks_per_child=int(max_tasks) if max_tasks else None)
+
+    def start(self):
+        """Fork the workers, which then warm up on their own"""
+        with self._lock:
+            if self._pool is not None or not self.processes:
+                return
+            method = self.start_method
+            if method is None:
+                method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+            context = multiprocessing.get_context(method)
+            if method == 'forkserver':
+                context.set_forkserver_preload(RENDERER_MODULES)
+            self._pool = context.Pool(self.processes, initializer=_init_worker,
+                                      maxtasksperchild=self.max_tasks_per_child)
+            logging.info(f"Started {self.processes} render workers ({method})")
+
+    def start_in_background(self):
+        """Start the pool without blocking the caller on the forkserver's renderer import"""
+        threading.Thread(target=self.start, name='render-pool-start', daemon=True).start()
+
+    def wait_ready(self, timeout=120.0):
+        """Block until every worker has finished warming up"""
+        self.start()
+        if self._pool is None:
+            return
+        # A worker only takes tasks once its initializer is done, so seeing
+        # every worker answer means the whole pool is warm
+        seen = set()
+        deadline = time.monotonic() + timeout
+        while len(seen) < self.processes:
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"Only {len(seen)}/{self.processes} render workers ready after {timeout}s")
+            pids = self._pool.map(_worker_pid, [0.05] * self.processes, chunksize=1)
+            seen.update(pids)
+
+    def render(self, kind, patterns, options, profile_path=None):
+        """Render in a pool worker (or in-process) and return (result, RenderReport)"""
+        self.start()
+        if self._pool is None:
+            return run_render(kind, patterns, options, profile_path)
+        return self._pool.apply(run_render, (kind, patterns, options, profile_path))
+
+    def close(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.terminate()
+                self._pool.join()
+                self._pool = None
+
+
+class _FirstFrameSink:
+    """Frame sink that only notes the wall-clock time of the first frame"""
+
+    def __init__(self):
+        self.frame_bytes = 0
+        self.first_frame_at = None
+
+    def open(self, width, height, fps):
+        self.frame_bytes = width * height * 4
+
+    def write(self, frame):
+        if self.first_frame_at is None:
+            self.first_frame_at = time.time()
+
+    def close(self):
+        pass
+
+    def abort(self):
+        pass
+
+
+def _first_frame_time():
+    from customized_breathing import draw_scene
+    sink = _FirstFrameSink()
+    if not draw_scene(BENCHMARK_PATTERNS, ball_image=BALL_IMAGE, frame_sink=sink):
+        raise RuntimeError("Benchmark render failed")
+    return sink.first_frame_at
+
+
+def _subprocess_seconds(code):
+    """Wall time from launching a fresh interpreter to the timestamp it prints"""
+    started = time.time()
+    output = subprocess.run([sys.executable, '-c', code], cwd=BASE_DIR, check=True,
+                            capture_output=True, text=True).stdout
+    return float(output.strip().splitlines()[-1]) - started
+
+
+def benchmark(runs=3):
+    """Compare time-to-first-frame for a fresh process against a warmed pool worker"""
+    app_import = [_subprocess_seconds("import time, app; print(time.time())") for _ in range(runs)]
+    cold = [_subprocess_seconds("import time, render_pool; print(render_pool._first_frame_time())")
+            for _ in range(runs)]
+
+    pool = RenderPool(processes=1)
+    started = time.time()
+    pool.wait_ready()
+    pool_ready = time.time() - started
+    warm = []
+    try:
+        for _ in range(runs):
+            started = time.time()
+            warm.append(pool._pool.apply(_first_frame_time) - started)
+    finally:
+        pool.close()
+
+    return {
+        'runs': runs,
+        'app_import_seconds': statistics.median(app_import),
+        'pool_ready_seconds': pool_ready,
+        'cold_first_frame_seconds': statistics.median(cold),
+        # The first job in a fresh worker still decodes the ball and builds its sprites
+        'warm_first_request_seconds': warm[0],
+        'warm_first_frame_seconds': statistics.median(warm),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Render worker pool tools")
+    parser.add_argument('command', choices=['benchmark'])
+    parser.add_argument('--runs', type=int, default=3)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING)
+    results = benchmark(args.runs)
+    print(json.dumps(results, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
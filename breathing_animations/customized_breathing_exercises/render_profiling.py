@@ -0,0 +1,249 @@
+import cProfile
+import logging
+import os
+import sys
+import threading
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+
+# Upper bounds (seconds) of the per-frame render-time histogram buckets
+FRAME_TIME_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+# Stages timed inside draw_scene, in pipeline order
+RENDER_STAGES = ('setup', 'load_background', 'load_ball', 'rotate_sprites',
+                 'update', 'rasterize', 'encode')
+
+RenderReport = namedtuple('RenderReport', [
+    'success',
+    'total_seconds',
+    'stages',                # stage name -> seconds spent in it
+    'frame_count',
+    'frame_time_buckets',    # bucket upper bound -> frames at or below it (cumulative)
+    'frame_time_p50',
+    'frame_time_p95',
+    'frame_time_max',
+    'frame_time_total',
+    'encoded_bytes',         # raw RGBA bytes handed to the encoder
+    'encoder_fps',
+    'encoder_mb_per_s',
+    'peak_rss_mb',           # the render process' own peak during this job, None where it cannot be reset
+    'encoder_peak_rss_mb',   # the encoder's (ffmpeg's) peak, reported by the frame sink
+    'profile_path',
+    'sink_metrics',          # frame sink's own counters, e.g. the shared-memory ring's per-side throughput
+])
+
+
+def maxrss_mb(maxrss):
+    """Convert an rusage ru_maxrss to MB"""
+    # ru_maxrss is reported in bytes on macOS and in kilobytes on Linux
+    if sys.platform == 'darwin':
+        return maxrss / (1024 * 1024)
+    return maxrss / 1024
+
+
+def reset_peak_rss():
+    """Reset the process' peak RSS (Linux VmHWM) to its current RSS; returns False where that is not possible
+
+    ru_maxrss never goes down, so in a long-lived worker it is the largest job
+    so far rather than the current one. The reset is process-wide: renders
+    running concurrently in one process (RENDER_WORKERS=0) share the peak.
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss_mb(pid='self'):
+    """Return a process' peak RSS in MB since it started or since reset_peak_rss(), or None when unavailable
+
+    Child processes are measured here rather than with RUSAGE_CHILDREN or
+    wait4: an exec'd child's ru_maxrss starts from the memory of the process
+    that spawned it, so ffmpeg started by a 500 MB worker would report 500 MB.
+    """
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+def _percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+class RenderProfiler:
+    """Collects timed spans and per-frame timings for a single draw_scene call.
+
+    Pass one to draw_scene and read `report` afterwards. When `profile_path`
+    is set the whole job also runs under cProfile and the stats are dumped
+    there (loadable with pstats, snakeviz or speedscope's pstats importer).
+    """
+
+    def __init__(self, profile_path=None):
+        self.profile_path = profile_path
+        self.stages = {stage: 0.0 for stage in RENDER_STAGES}
+        self.frame_times = []
+        self.encoded_bytes = 0
+        self.sink_metrics = None
+        self.report = None
+        self._started = None
+        self._profile = None
+        self._rss_reset = False
+
+    def start(self):
+        self._started = time.perf_counter()
+        self._rss_reset = reset_peak_rss()
+        if self.profile_path:
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+
+    @contextmanager
+    def span(self, stage):
+        """Add the wall time of the enclosed block to `stage`"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[stage] = self.stages.get(stage, 0.0) + time.perf_counter() - started
+
+    def record_frame(self, seconds, nbytes):
+        self.frame_times.append(seconds)
+        self.encoded_bytes += nbytes
+
+    def finish(self, success):
+        """Stop timing, dump the optional cProfile stats and build the RenderReport"""
+        total = time.perf_counter() - self._started if self._started is not None else 0.0
+        profile_path = None
+        if self._profile is not None:
+            self._profile.disable()
+            try:
+                os.makedirs(os.path.dirname(os.path.abspath(self.profile_path)), exist_ok=True)
+                self._profile.dump_stats(self.profile_path)
+                profile_path = self.profile_path
+            except OSError as e:
+                logging.error(f"Could not write render profile to {self.profile_path}: {str(e)}")
+            self._profile = None
+
+        frame_times = sorted(self.frame_times)
+        buckets = {}
+        position = 0
+        for bound in FRAME_TIME_BUCKETS:
+            while position < len(frame_times) and frame_times[position] <= bound:
+                position += 1
+            buckets[bound] = position
+
+        encode_seconds = self.stages.get('encode', 0.0)
+        self.report = RenderReport(
+            success=success,
+            total_seconds=total,
+            stages=dict(self.stages),
+            frame_count=len(frame_times),
+            frame_time_buckets=buckets,
+            frame_time_p50=_percentile(frame_times, 0.5),
+            frame_time_p95=_percentile(frame_times, 0.95),
+            frame_time_max=frame_times[-1] if frame_times else 0.0,
+            frame_time_total=sum(frame_times),
+            encoded_bytes=self.encoded_bytes,
+            encoder_fps=len(frame_times) / encode_seconds if encode_seconds else 0.0,
+            encoder_mb_per_s=self.encoded_bytes / (1024 * 1024) / encode_seconds if encode_seconds else 0.0,
+            peak_rss_mb=peak_rss_mb() if self._rss_reset else None,
+            encoder_peak_rss_mb=(self.sink_metrics or {}).get('encoder_peak_rss_mb'),
+            profile_path=profile_path,
+            sink_metrics=self.sink_metrics,
+        )
+        return self.report
+
+
+class RenderMetrics:
+    """Process-wide aggregate of RenderReports, exported in Prometheus text format"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.jobs = {'success': 0, 'failure': 0}
+        self.stage_seconds = {stage: 0.0 for stage in RENDER_STAGES}
+        self.frame_buckets = {bound: 0 for bound in FRAME_TIME_BUCKETS}
+        self.frame_count = 0
+        self.frame_seconds = 0.0
+        self.encoded_bytes = 0
+        self.peak_rss_mb = 0.0
+        self.encoder_peak_rss_mb = 0.0
+        self.ring_frames = 0
+        self.ring_seconds = {(side, state): 0.0 for side in ('producer', 'consumer') for state in ('wait', 'busy')}
+
+    def observe(self, report):
+        with self._lock:
+            self.jobs['success' if report.success else 'failure'] += 1
+            for stage, seconds in report.stages.items():
+                self.stage_seconds[stage] = self.stage_seconds.get(stage, 0.0) + seconds
+            for bound, count in report.frame_time_buckets.items():
+                self.frame_buckets[bound] += count
+            self.frame_count += report.frame_count
+            self.frame_seconds += report.frame_time_total
+            self.encoded_bytes += report.encoded_bytes
+            if report.peak_rss_mb:
+                self.peak_rss_mb = max(self.peak_rss_mb, report.peak_rss_mb)
+            if report.encoder_peak_rss_mb:
+                self.encoder_peak_rss_mb = max(self.encoder_peak_rss_mb, report.encoder_peak_rss_mb)
+            ring = report.sink_metrics
+            if ring and 'consumer_write_seconds' in ring:
+                self.ring_frames += ring['frames']
+                self.ring_seconds['producer', 'wait'] += ring['producer_wait_seconds']
+                self.ring_seconds['producer', 'busy'] += ring['producer_copy_seconds']
+                self.ring_seconds['consumer', 'wait'] += ring['consumer_wait_seconds']
+                self.ring_seconds['consumer', 'busy'] += ring['consumer_write_seconds']
+
+    def render_prometheus(self):
+        with self._lock:
+            lines = [
+                '# HELP breath_render_jobs_total Render jobs by outcome.',
+                '# TYPE breath_render_jobs_total counter',
+            ]
+            for outcome, count in self.jobs.items():
+                lines.append(f'breath_render_jobs_total{{outcome="{outcome}"}} {count}')
+
+            lines += [
+                '# HELP breath_render_stage_seconds_total Wall time spent per draw_scene stage.',
+                '# TYPE breath_render_stage_seconds_total counter',
+            ]
+            for stage, seconds in self.stage_seconds.items():
+                lines.append(f'breath_render_stage_seconds_total{{stage="{stage}"}} {seconds:.6f}')
+
+            lines += [
+                '# HELP breath_render_frame_seconds Per-frame render time (update, rasterize and encode).',
+                '# TYPE breath_render_frame_seconds histogram',
+            ]
+            for bound, count in self.frame_buckets.items():
+                lines.append(f'breath_render_frame_seconds_bucket{{le="{bound}"}} {count}')
+            lines.append(f'breath_render_frame_seconds_bucket{{le="+Inf"}} {self.frame_count}')
+            lines.append(f'breath_render_frame_seconds_sum {self.frame_seconds:.6f}')
+            lines.append(f'breath_render_frame_seconds_count {self.frame_count}')
+
+            lines += [
+                '# HELP breath_render_encoded_bytes_total Raw RGBA bytes handed to the video encoder.',
+                '# TYPE breath_render_encoded_bytes_total counter',
+                f'breath_render_encoded_bytes_total {self.encoded_bytes}',
+                '# HELP breath_render_peak_rss_megabytes Largest peak RSS of the render process during a single render.',
+                '# TYPE breath_render_peak_rss_megabytes gauge',
+                f'breath_render_peak_rss_megabytes {self.peak_rss_mb:.1f}',
+                '# HELP breath_render_encoder_peak_rss_megabytes Largest peak RSS of the video encoder during a single render.',
+                '# TYPE breath_render_encoder_peak_rss_megabytes gauge',
+                f'breath_render_encoder_peak_rss_megabytes {self.encoder_peak_rss_mb:.1f}',
+                '# HELP breath_render_ring_frames_total Frames passed through the shared-memory frame ring.',
+                '# TYPE breath_render_ring_frames_total counter',
+                f'breath_render_ring_frames_total {self.ring_frames}',
+                '# HELP breath_render_ring_seconds_total Frame ring time per side: waiting on the other side or busy copying/writing.',
+                '# TYPE breath_render_ring_seconds_total counter',
+            ]
+            for (side, state), seconds in self.ring_seconds.items():
+                lines.append(f'breath_render_ring_seconds_total{{side="{side}",state="{state}"}} {seconds:.6f}')
+        return '\n'.join(lines) + '\n'
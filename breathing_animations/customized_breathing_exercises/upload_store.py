@@ -0,0 +1,267 @@
+"""Content-addressed store for uploaded ball and background images.
+
+Multipart file parts are streamed straight to a temporary file in the store
+while they are hashed, so an upload is written once and never re-read to
+find its digest. Images are stored as `<digest>.<ext>` in the ball and
+background folders: identical uploads share one file, and a ball image that
+has been seen before skips the PNG conversion entirely. Size and pixel-count
+limits are enforced while streaming and from the image header, before
+anything is decoded.
+
+    python upload_store.py gc --max-age-days 7 --max-total-mb 2048
+"""
+import argparse
+import hashlib
+import logging
+import os
+import re
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+from PIL import Image
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+CHUNK_SIZE = 1 << 16
+# Formats by what the file contains, not what it is called
+STORED_FORMATS = {'PNG': 'png', 'JPEG': 'jpg', 'GIF': 'gif'}
+DIGEST_NAME = re.compile(r'^[0-9a-f]{32}\.(png|jpg|gif)$')
+TEMP_PREFIX = 'incoming-'
+STALE_TEMP_SECONDS = 3600
+
+
+class UploadRejected(Exception):
+    # Deliberately not a ValueError: werkzeug's form parser silently swallows those
+    def __init__(self, status_code, message):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class HashingFile:
+    """Writable temporary file that hashes and size-checks every chunk written to it.
+
+    Used as werkzeug's stream factory so multipart file parts land on disk
+    with their digest already known. Closing an unclaimed file deletes it.
+    """
+
+    def __init__(self, directory, max_bytes):
+        fd, self.path = tempfile.mkstemp(prefix=TEMP_PREFIX, dir=directory)
+        self._file = os.fdopen(fd, 'w+b')
+        self._hash = hashlib.blake2b(digest_size=16)
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.claimed = False
+
+    def write(self, data):
+        self.size += len(data)
+        if self.size > self.max_bytes:
+            raise UploadRejected(413, f"Upload exceeds the {self.max_bytes // (1024 * 1024)} MB limit")
+        self._hash.update(data)
+        return self._file.write(data)
+
+    def hexdigest(self):
+        return self._hash.hexdigest()
+
+    def close(self):
+        if not self._file.closed:
+            self._file.close()
+        if not self.claimed and os.path.exists(self.path):
+            os.remove(self.path)
+
+    def __getattr__(self, name):
+        # read, readline, seek, tell, flush, ... go straight to the file
+        return getattr(self._file, name)
+
+
+def make_transparent_png(source_path, output_path):
+    """Save `source_path` as RGBA PNG, turning near-white pixels of opaque images transparent"""
+    with Image.open(source_path) as img:
+        if img.mode in ['RGB', 'L']:
+            rgba = np.array(img.convert('RGB').convert('RGBA'))
+            white = (rgba[..., :3] > 240).all(axis=-1)
+            rgba[white] = (255, 255, 255, 0)
+            img = Image.fromarray(rgba, 'RGBA')
+        elif img.mode != 'RGBA':
+            img = img.convert('RGBA')
+        img.save(output_path, 'PNG')
+
+
+class UploadStore:
+    """Stores uploads by content digest under the ball and background image folders"""
+
+    def __init__(self, folders, max_bytes=20 * 1024 * 1024, max_pixels=40_000_000,
+                 max_age_seconds=7 * 24 * 3600, max_total_bytes=2 * 1024 ** 3, gc_interval=3600):
+        self.folders = folders  # kind ('ball' / 'background') -> directory
+        self.temp_dir = os.path.join(os.path.dirname(os.path.abspath(folders['ball'])), '.incoming')
+        self.max_bytes = max_bytes
+        self.max_pixels = max_pixels
+        self.max_age_seconds = max_age_seconds
+        self.max_total_bytes = max_total_bytes
+        self.gc_interval = gc_interval
+        self._last_gc = 0.0
+        self._gc_lock = threading.Lock()
+        for directory in list(folders.values()) + [self.temp_dir]:
+            os.makedirs(directory, exist_ok=True)
+
+    @classmethod
+    def from_environ(cls, folders):
+        def env(name, default, scale=1):
+            value = os.environ.get(name)
+            return int(float(value) * scale) if value else default
+        return cls(folders,
+                   max_bytes=env('UPLOAD_MAX_MB', 20 * 1024 * 1024, 1024 * 1024),
+                   max_pixels=env('UPLOAD_MAX_PIXELS', 40_000_000),
+                   max_age_seconds=env('UPLOAD_MAX_AGE_DAYS', 7 * 24 * 3600, 24 * 3600),
+                   max_total_bytes=env('UPLOAD_MAX_TOTAL_MB', 2 * 1024 ** 3, 1024 * 1024))
+
+    def open_incoming(self):
+        """Stream factory for multipart file parts"""
+        return HashingFile(self.temp_dir, self.max_bytes)
+
+    def _incoming_from(self, file):
+        """The HashingFile behind an upload, copying it in chunks if it was parsed some other way"""
+        if isinstance(file.stream, HashingFile):
+            return file.stream
+        incoming = self.open_incoming()
+        try:
+            file.stream.seek(0)
+            for chunk in iter(lambda: file.stream.read(CHUNK_SIZE), b''):
+                incoming.write(chunk)
+            incoming.flush()
+        except BaseException:
+            incoming.close()
+            raise
+        return incoming
+
+    def _check_image(self, path):
+        """Validate format and dimensions from the header only; returns the stored extension"""
+        try:
+            with Image.open(path) as img:
+                image_format = img.format
+                width, height = img.size
+        except Exception:
+            raise UploadRejected(415, "Upload is not a readable image")
+        if image_format not in STORED_FORMATS:
+            raise UploadRejected(415, f"Unsupported image format: {image_format}")
+        if width * height > self.max_pixels:
+            raise UploadRejected(413, f"Image is {width}x{height}; the limit is {self.max_pixels:,} pixels")
+        return STORED_FORMATS[image_format]
+
+    def put(self, file, kind):
+        """Store an uploaded FileStorage and return the path of its content-addressed copy"""
+        incoming = self._incoming_from(file)
+        try:
+            incoming.flush()
+            digest = incoming.hexdigest()
+            folder = self.folders[kind]
+
+            if kind == 'ball':
+                # Ball images are always converted to PNG, keyed by the digest of the original upload
+                path = os.path.join(folder, f'{digest}.png')
+                if self._reuse(path):
+                    return path
+                self._check_image(incoming.path)
+                temp_path = f'{path}.{os.getpid()}-{threading.get_ident()}.tmp'
+                make_transparent_png(incoming.path, temp_path)
+                os.replace(temp_path, path)
+                logging.info(f"Stored converted ball image {path}")
+            else:
+                extension = self._check_image(incoming.path)
+                path = os.path.join(folder, f'{digest}.{extension}')
+                if self._reuse(path):
+                    return path
+                os.replace(incoming.path, path)
+                incoming.claimed = True
+                logging.info(f"Stored background image {path}")
+            return path
+        finally:
+            incoming.close()
+            self.maybe_collect_garbage()
+
+    def _reuse(self, path):
+        """Mark an existing blob as used; False if it is not stored yet"""
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return False
+        logging.info(f"Reusing stored upload {path}")
+        return True
+
+    def collect_garbage(self, dry_run=False):
+        """Delete blobs unused for max_age_seconds, then the least recently used beyond max_total_bytes.
+
+        A blob's mtime is its last use: storing or re-uploading it touches it,
+        so anything a render could still be reading is far younger than the
+        age limit. Only digest-named files are considered; bundled images in
+        the same folders are never removed.
+        """
+        now = time.time()
+        blobs = []
+        for folder in self.folders.values():
+            for entry in os.scandir(folder):
+                if entry.is_file() and DIGEST_NAME.match(entry.name):
+                    stat = entry.stat()
+                    blobs.append((stat.st_mtime, stat.st_size, entry.path))
+        blobs.sort()
+
+        total = sum(size for _, size, _ in blobs)
+        expired = []
+        for mtime, size, path in blobs:
+            if now - mtime > self.max_age_seconds or total > self.max_total_bytes:
+                expired.append(path)
+                total -= size
+        stale = [entry.path for entry in os.scandir(self.temp_dir)
+                 if entry.name.startswith(TEMP_PREFIX) and now - entry.stat().st_mtime > STALE_TEMP_SECONDS]
+
+        if not dry_run:
+            for path in expired + stale:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+        return {'removed': expired + stale, 'kept': len(blobs) - len(expired), 'kept_bytes': total}
+
+    def maybe_collect_garbage(self):
+        """Run collect_garbage in the background at most once per gc_interval"""
+        now = time.monotonic()
+        if now - self._last_gc < self.gc_interval or not self._gc_lock.acquire(blocking=False):
+            return
+        self._last_gc = now
+
+        def run():
+            try:
+                result = self.collect_garbage()
+                if result['removed']:
+                    logging.info(f"Upload GC removed {len(result['removed'])} files")
+            except Exception as e:
+                logging.error(f"Upload GC failed: {str(e)}")
+            finally:
+                self._gc_lock.release()
+        threading.Thread(target=run, name='upload-gc', daemon=True).start()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Maintain the content-addressed upload store")
+    parser.add_argument('command', choices=['gc'])
+    parser.add_argument('--uploads', default=os.path.join(BASE_DIR, 'uploads'))
+    parser.add_argument('--max-age-days', type=float, default=7)
+    parser.add_argument('--max-total-mb', type=float, default=2048)
+    parser.add_argument('--dry-run', action='store_true')
+    args = parser.parse_args(argv)
+
+    store = UploadStore({'ball': os.path.join(args.uploads, 'ball_images'),
+                         'background': os.path.join(args.uploads, 'background_images')},
+                        max_age_seconds=args.max_age_days * 24 * 3600,
+                        max_total_bytes=int(args.max_total_mb * 1024 * 1024))
+    result = store.collect_garbage(dry_run=args.dry_run)
+    for path in result['removed']:
+        print(f"{'would remove' if args.dry_run else 'removed'} {path}")
+    print(f"{len(result['removed'])} removed, {result['kept']} blobs kept ({result['kept_bytes'] / (1024 * 1024):.1f} MB)")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())